@@ -1,27 +1,40 @@
 import os
 import re
+import glob
+import codecs
 import logging
-import urllib2
-import requests
+import tempfile
+import numpy as np
 import pandas as pd
-import pydap.client
-import pydap.exceptions
-import xray
 
-from bs4 import BeautifulSoup
-from collections import namedtuple
 from contextlib import closing
-from datetime import datetime
-from requests.exceptions import ConnectionError
+from datetime import datetime, timedelta
 from shutil import move
 
+# The network and parsing backends (requests, urllib2, pydap, xray and bs4)
+# are imported in the methods that use them so that reading a cache file
+# does not pay for importing them.
+
 # Support Python 2.7 and 3.x
 try:
     from io import StringIO
 except ImportError:
     from cStringIO import StringIO
+try:
+    from xml.etree.cElementTree import iterparse, ParseError
+except ImportError:
+    from xml.etree.ElementTree import iterparse, ParseError
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
 
 from exceptions import RequiredVariableNotPresent
+from CacheWriter import CacheWriter
+from FrameCache import FrameCache
+from ProfileCollection import ProfileCollection
+from Generations import Generations
+from SpilledFrame import SpilledFrame
 
 class ArgoData(object):
     '''Collection of methods for working with Argo profiling float data.
@@ -45,10 +58,53 @@ class ArgoData(object):
     _STATUS = 'status'
     _GLOBAL_META = 'global_meta'
     _BIO_PROFILE_INDEX = 'bio_global_index'
+    _MERGE_PROFILE_INDEX = 'merge_global_index'
     _ALL_WMO_DF = 'all_wmo_df'
     _OXY_COUNT_DF = 'oxy_count_df'
+    _PROFILE_COUNTS = 'profile_counts'
+    _FLOAT_COUNTS = 'float_counts'
+    _MANIFEST = 'manifest'
+    _LOOKUP_TABLES = 'lookup_tables'
+    _TOMBSTONES = 'tombstones'
+    _STANDARD_LEVELS = 'standard_levels'
+    _SURFACE_MEAN = 'surface_mean'
+    _MONTHLY_MEAN = 'monthly_mean'
+    _AGGREGATE_STATE = 'aggregate_state'
+    _CHANGELOG = 'changelog'
+    _DELTA_STATE = 'delta_state'
+    _DELTA_REMOVED = 'delta_removed'
+    _manifest_columns = ['wmo', 'key', 'url', 'code', 'dateloaded', 
+                         'time', 'lon', 'lat', 'pmin', 'pmax',
+                         'nrows', 'nbytes', 'removed']
+    _tombstone_columns = ['wmo', 'key', 'url', 'code', 'reason', 
+                          'dateloaded', 'cleared']
+    _aggregate_state_columns = ['wmo', 'max_pressure', 'manifest_rows', 
+                                'last_loaded']
+    _oxygen_variables = ('DOXY_ADJUSTED', 'DOXY')
+
+    # Changes to profiles recorded in the changelog table for export_delta()
+    _ADDED = 'added'
+    _REPLACED = 'replaced'
+    _REMOVED = 'removed'
+    _changelog_columns = ['key', 'action', 'time', 'run']
+
+    # Reasons for a profile to be tombstoned rather than saved and the days
+    # to wait before trying to load it again, None: only when the delayed
+    # mode DATE_UPDATE changes
+    _MISSING_VARIABLE = 'missing_variable'
+    _NO_OXYGEN = 'no_oxygen'
+    _NO_DATA = 'no_data'
+    _READ_ERROR = 'read_error'
+    _retry_days = {_MISSING_VARIABLE: None, _NO_OXYGEN: None, 
+                   _NO_DATA: 30, _READ_ERROR: 1}
     _coordinates = {'PRES_ADJUSTED', 'LATITUDE', 'LONGITUDE', 'JULD'}
 
+    # With qc_accept set the Argo QC flag of each variable is stored as an 
+    # int8 <variable>_QC column, blank and non-digit flags as _QC_MISSING
+    _qc_suffix = '_QC'
+    _QC_MISSING = 9
+    _index_names = ['wmo', 'time', 'lon', 'lat', 'profile', 'pressure']
+
     # Names and search patterns for cache file naming/parsing
     # Make private and ignore pylint's complaints
     # No other names in this class can end in 'RE'
@@ -59,9 +115,29 @@ class ArgoData(object):
     _wmoRE = 'wmo([0-9-]+)'
     _variablesRE = 'var([0-9-]+)'
 
+    # Profile file names on the GDAC: <code><wmo>_<profile>.nc
+    _profile_url_regex = re.compile(r"([a-zA-Z]+)(\d+_\d+).nc$")
+
+    # Indexes of all the bio profile files and of the merged core and bio
+    # profile files on the GDAC
+    _bio_index_url = 'ftp://ftp.ifremer.fr/ifremer/argo/argo_bio-profile_index.txt'
+    _merge_index_url = 'ftp://ftp.ifremer.fr/ifremer/argo/argo_merge-profile_index.txt'
+    _discovery_modes = ('catalog', 'index')
+
+    # Per-shard cache files are named <cache_file>_shard<i>of<N>.hdf
+    _shard_fmt = '_shard{:d}of{:d}'
+
     _MAX_VALUE = 10000000000
     _compparms = dict(complib='zlib', complevel=9)
 
+    # Smaller arrays are repacked uncompressed as the index that a chunked
+    # array needs takes more space than compression saves
+    _min_compress_bytes = 16384
+
+    # Downloads of index files are decoded into a temporary file that is
+    # kept in memory up to this size
+    _spool_bytes = 50000000
+
     # PyTables: Use non-empty minimal df to minimize HDF file size
     _blank_df = pd.DataFrame([pd.np.nan])
 
@@ -69,7 +145,11 @@ class ArgoData(object):
             status_url='http://argo.jcommops.org/FTPRoot/Argo/Status/argo_all.txt',
             global_url='ftp://ftp.ifremer.fr/ifremer/argo/ar_index_global_meta.txt',
             thredds_url='http://tds0.ifremer.fr/thredds/catalog/CORIOLIS-ARGO-GDAC-OBS',
-            variables=('TEMP_ADJUSTED', 'PSAL_ADJUSTED', 'DOXY_ADJUSTED')):
+            variables=('TEMP_ADJUSTED', 'PSAL_ADJUSTED', 'DOXY_ADJUSTED'),
+            batch_profiles=50, batch_bytes=50000000, batch_seconds=60,
+            compact=False, retry_days=None, pressure_tolerance=None,
+            standard_levels=None, frame_cache_bytes=100000000,
+            index_ttl_days=7, discovery='catalog', qc_accept=None):
 
         '''Initialize ArgoData object.
         
@@ -87,6 +167,53 @@ class ArgoData(object):
                                http://tds0.ifremer.fr/thredds/catalog/CORIOLIS-ARGO-GDAC-OBS
             variables (list): Variables to extract from NetCDF files and put
                               into the Pandas DataFrame
+            batch_profiles (int): Number of profiles to hold in memory before
+                                  writing them to the cache file
+            batch_bytes (int): Size of held profile data that forces a write
+            batch_seconds (float): Age of oldest held profile that forces a write;
+                                   held profiles are also written at the end
+                                   of each float, so a killed load loses at
+                                   most one float's profiles
+            compact (bool): Store profiles with float32 values and their
+                            wmo, time, lon, lat and profile values once in 
+                            the metadata and return float32 DataFrames
+            retry_days (dict): Override days to wait before trying again to
+                               load profiles tombstoned for these reasons:
+                               missing_variable, no_oxygen, no_data and
+                               read_error; None to not retry
+            pressure_tolerance (float): Read both N_PROF arrays of each profile
+                                        once and put bio_list variables that 
+                                        are only in the lower resolution [1] 
+                                        array onto the [0] pressures, matching
+                                        the nearest pressure within this many
+                                        decibars.  By default the whole 
+                                        profile is taken from [1] instead.
+            standard_levels (list): Pressures to interpolate each profile to
+                                    for get_standard_levels(); the gridded
+                                    values are kept in the cache file and 
+                                    updated as profiles are written
+            frame_cache_bytes (int): Size of the in memory cache of the 
+                                     DataFrames that read() returns for each
+                                     float, 0 to not cache them.  Profiles 
+                                     written by this object invalidate it,
+                                     call clear_frame_cache() after other
+                                     processes write to the cache file.
+            index_ttl_days (float): Check the status, global_meta and
+                                    profile index sources for newer 
+                                    versions when the cached copies were 
+                                    checked longer than this ago, None to
+                                    never refresh them
+            discovery (str): How get_float_dataframe() finds the profiles
+                             of each float: 'catalog' reads the float's
+                             THREDDS catalog, 'index' takes them all from
+                             the merge-profile index, see get_profile_work_list()
+            qc_accept (dict): Store the QC flags of variables as int8 
+                              <variable>_QC columns and keep only the values
+                              of each variable in this dictionary whose flag
+                              is in its list, e.g. {'DOXY_ADJUSTED': [1, 2]};
+                              a list applies to all variables.  Rejected 
+                              values are NaN, so are not saved.  The default
+                              None does not read the QC flags.
 
             cache_file (str):
 
@@ -103,6 +230,17 @@ class ArgoData(object):
             3. Custom cache file names. These operate just like the default cache
                file, but can be named whatever the user wants. 
 
+            A directory or glob pattern (e.g. /data/biofloat/*_shard*.hdf)
+            may also be given for cache_file.  The matching shard files, as
+            produced by load_biofloat_cache.py --shard i/N, are then read
+            together as one federated cache.
+
+            A generations directory, as published by load_biofloat_cache.py
+            --generations_dir, is read from a lease on its current generation
+            so that loading the next one does not disturb the reads.  The
+            lease is held until release_snapshot() is called.  Published 
+            generations are read only: the index sources are not refreshed,
+            aggregates are not saved and methods that write raise IOError.
         '''
         self.status_url = status_url
         self.global_url = global_url
@@ -111,6 +249,48 @@ class ArgoData(object):
 
         self.logger.setLevel(self._log_levels[verbosity])
         self._bio_list = bio_list
+        self._batch_parms = dict(max_profiles=batch_profiles, 
+                                 max_bytes=batch_bytes, max_seconds=batch_seconds)
+        self._writer = None
+        self.compact = compact
+        self.retry_days = dict(self._retry_days, **(retry_days or {}))
+        self.pressure_tolerance = pressure_tolerance
+        self.standard_levels = standard_levels
+        self.index_ttl_days = index_ttl_days
+        self._run_time = None
+        if discovery not in self._discovery_modes:
+            raise ValueError('discovery must be one of {}'.format(self._discovery_modes))
+        self.discovery = discovery
+        if qc_accept is not None and not isinstance(qc_accept, dict):
+            qc_accept = dict((v, qc_accept) for v in self.variables)
+        self.qc_accept = qc_accept
+        self._indexes = {}
+        self._frame_cache = None
+        if frame_cache_bytes:
+            self._frame_cache = FrameCache(frame_cache_bytes)
+
+        self._snapshot = None
+        if cache_file and Generations.is_generations(cache_file):
+            self._snapshot = Generations(cache_file).acquire()
+            cache_file = self._snapshot.path
+            self.index_ttl_days = None
+
+        self._shards = []
+        if cache_file and self._is_federated(cache_file):
+            shard_files = self._get_shard_files(cache_file)
+            if not shard_files:
+                raise IOError('No cache files found in {}'.format(cache_file))
+            self._shards = [ArgoData(verbosity=verbosity, cache_file=f,
+                                     bio_list=bio_list, status_url=status_url,
+                                     global_url=global_url, thredds_url=thredds_url,
+                                     variables=variables, compact=compact,
+                                     standard_levels=standard_levels,
+                                     frame_cache_bytes=frame_cache_bytes,
+                                     index_ttl_days=index_ttl_days,
+                                     discovery=discovery, qc_accept=qc_accept) 
+                            for f in shard_files]
+            self.logger.info('Reading %s shard files from %s', 
+                             len(self._shards), cache_file)
 
         if cache_file:
             self.cache_file_parms = self._get_cache_file_parms(cache_file)
@@ -126,12 +306,82 @@ class ArgoData(object):
 
         self.logger.info('Using cache_file %s', self.cache_file)
 
-    def _put_df(self, df, name, metadata=None):
-        '''Save Pandas DataFrame to local HDF file with optional metadata dict.
+    def release_snapshot(self):
+        '''Release the lease on the generation that is being read so that
+        it may be garbage collected once a newer one is published.
+        '''
+        if self._snapshot is not None:
+            self._snapshot.release()
+
+    def _check_writable(self):
+        '''Raise IOError if the cache file is a published generation.
+        '''
+        if self._snapshot is not None:
+            raise IOError('{} is a published generation and is read only'.format(
+                          self.cache_file))
+
+    def _shard_runs(self, wmo_list):
+        '''Return list of (shard, wmo_list) tuples for reading the floats of
+        wmo_list from the shards that hold them in wmo_list order, a tuple 
+        for each run of consecutive floats in the same shard.  With wmo_list
+        None all of each shard is read.
+        '''
+        if wmo_list is None:
+            return [(shard, None) for shard in self._shards]
+
+        holders = {}
+        for shard in self._shards:
+            for wmo in shard.get_cache_file_all_wmo_list():
+                holders.setdefault(str(wmo), []).append(shard)
+        runs = []
+        for wmo in wmo_list:
+            for shard in holders.get(str(wmo), []):
+                if runs and runs[-1][0] is shard:
+                    runs[-1][1].append(wmo)
+                else:
+                    runs.append((shard, [wmo]))
+
+        return runs
+
+    def _concat_results(self, results, as_collection=False):
+        '''Return one DataFrame, or with as_collection ProfileCollection, of
+        the results read from the shards.
+        '''
+        if as_collection:
+            return ProfileCollection.concat(results)
+
+        return pd.concat(results) if results else pd.DataFrame()
+
+    def _is_federated(self, cache_file):
+        '''Return True if cache_file is a directory or glob pattern of shards.
+        '''
+        return os.path.isdir(cache_file) or any(c in cache_file for c in '*?[')
+
+    def _get_shard_files(self, cache_file):
+        '''Return sorted list of the .hdf files matching cache_file directory
+        or glob pattern.
+        '''
+        if os.path.isdir(cache_file):
+            cache_file = os.path.join(cache_file, '*.hdf')
+
+        return sorted(glob.glob(cache_file))
+
+    def shard_wmo_list(self, wmo_list, shard, num_shards):
+        '''Return the floats in wmo_list that belong to shard number `shard` 
+        of `num_shards`.  The partition is by WMO number modulo num_shards 
+        so it is deterministic across runs and machines.
+        '''
+        if not 0 <= shard < num_shards:
+            raise ValueError('shard must be in range(0, {:d})'.format(num_shards))
+
+        return [wmo for wmo in wmo_list if int(wmo) % num_shards == shard]
+
+    def _write_df(self, store, df, name, metadata=None):
+        '''Put Pandas DataFrame into open HDFStore with optional metadata dict.
         '''
-        store = pd.HDFStore(self.cache_file)
         self.logger.debug('Saving DataFrame to name "%s" in file %s',
                                               name, self.cache_file)
+        self._invalidate_frames(name)
         if df.dropna().empty:
             store.put(name, df, format='fixed')
         else:
@@ -141,13 +391,224 @@ class ArgoData(object):
         if metadata and store.get_storer(name):
             store.get_storer(name).attrs.metadata = metadata
 
+    def _invalidate_frames(self, name):
+        '''Drop the frame cache entries of the float of profile name.
+        '''
+        if self._frame_cache is not None and name.startswith('/WMO'):
+            self._frame_cache.invalidate([name.split('/')[1].split('_')[1]])
+
+    def frame_cache_info(self):
+        '''Return dictionary of the hits, misses, hit_rate, entries, nbytes
+        and max_bytes of the in memory cache of read() DataFrames.
+        '''
+        if self._frame_cache is None:
+            return None
+
+        return self._frame_cache.info()
+
+    def clear_frame_cache(self):
+        '''Drop all the DataFrames in the in memory cache of read() results.
+        '''
+        if self._frame_cache is not None:
+            self._frame_cache.clear()
+        for shard in self._shards:
+            shard.clear_frame_cache()
+
+    def _put_df(self, df, name, metadata=None):
+        '''Save Pandas DataFrame to local HDF file with optional metadata dict.
+        '''
+        self._check_writable()
+        store = pd.HDFStore(self.cache_file)
+        self._write_df(store, df, name, metadata)
         self.logger.debug('store.close()')
         store.close()
 
+    def _put_profile(self, df, name, metadata=None):
+        '''Save profile DataFrame through the write-behind CacheWriter when
+        one is active, otherwise write it to the cache file directly.
+        '''
+        self._check_writable()
+        if self.compact:
+            df, metadata = self._compact_profile(df, metadata)
+
+        if self._writer is not None:
+            self._writer.put(name, df, metadata)
+        else:
+            with pd.HDFStore(self.cache_file) as store:
+                self._write_profiles(store, [(name, df, metadata)])
+
+    def _compact_profile(self, df, metadata):
+        '''Return tuple of compact DataFrame and metadata for storing profile
+        df: the pressure and measurements are float32 columns and the index 
+        values that are the same for every row are saved in the metadata.
+        '''
+        if (metadata or {}).get('compact') or self._data_rows(df).empty:
+            return df, metadata
+
+        metadata = dict(metadata or {}, compact=True, 
+                        **dict(zip(self._index_names[:5], df.index[0][:5])))
+        cdf = pd.DataFrame({'pressure': df.index.get_level_values(
+                                        'pressure').values.astype(np.float32)})
+        for col in df.columns:
+            if col.endswith(self._qc_suffix):
+                cdf[col] = df[col].values.astype(np.int8)
+            else:
+                cdf[col] = df[col].values.astype(np.float32)
+
+        return cdf, metadata
+
+    def _data_rows(self, df):
+        '''Return profile df without the rows where every variable is NaN,
+        keeping the levels where only some of the variables were measured.
+        '''
+        subset = [c for c in df.columns 
+                  if c != 'pressure' and not str(c).endswith(self._qc_suffix)]
+
+        return df.dropna(how='all', subset=subset) if subset else df.iloc[0:0]
+
+    def _profile_coords(self, df, metadata):
+        '''Return tuple of the (wmo, time, lon, lat, profile) values and the
+        array of pressures of non-empty profile df as stored in the cache file.
+        '''
+        if (metadata or {}).get('compact'):
+            return (tuple(metadata[n] for n in self._index_names[:5]), 
+                    df['pressure'].values)
+
+        return df.index[0][:5], df.index.get_level_values('pressure').values
+
+    def _profiles_to_frame(self, profiles):
+        '''Return one DataFrame with the wmo, time, lon, lat, profile and 
+        pressure MultiIndex from profiles, a list of (df, metadata) tuples as
+        stored in the cache file.  The index is built from integer codes 
+        into the per profile values rather than from tuples for every row.
+        With compact set the measurements and pressures are float32.
+        '''
+        profiles = [(df, m) for df, m in profiles if not self._data_rows(df).empty]
+        if not profiles:
+            return pd.DataFrame()
+
+        dtype = np.float32 if self.compact else np.float64
+        columns, coords, pressures, values = self._profile_arrays(profiles, dtype)
+
+        rows = np.repeat(np.arange(len(profiles)), [len(p) for p in pressures])
+        levels = []
+        codes = []
+        for per_profile in zip(*coords):
+            c, u = pd.factorize(list(per_profile), sort=True)
+            levels.append(u)
+            codes.append(c[rows])
+        c, u = pd.factorize(np.concatenate(pressures).astype(dtype), sort=True)
+        levels.append(u)
+        codes.append(c)
+
+        try:
+            index = pd.MultiIndex(levels=levels, codes=codes, 
+                                  names=self._index_names)
+        except TypeError:
+            # Pandas before 0.24 calls codes labels
+            index = pd.MultiIndex(levels=levels, labels=codes, 
+                                  names=self._index_names)
+
+        return self._qc_columns(pd.DataFrame(np.concatenate(values), 
+                                             index=index, columns=columns))
+
+    def _qc_columns(self, df):
+        '''Return df with its QC flag columns as int8, _QC_MISSING where
+        the stored profile had no flags.
+        '''
+        for c in df.columns:
+            if c.endswith(self._qc_suffix):
+                df[c] = df[c].fillna(self._QC_MISSING).astype(np.int8)
+
+        return df
+
+    def _profile_arrays(self, profiles, dtype):
+        '''Return tuple of the columns, list of (wmo, time, lon, lat, profile)
+        tuples, list of pressure arrays and list of 2-D arrays of the columns
+        of profiles, a list of non-empty (df, metadata) tuples.
+        '''
+        columns = []
+        for df, _ in profiles:
+            columns.extend(c for c in df.columns if c not in columns + ['pressure'])
+
+        coords, pressures, values = [], [], []
+        for df, m in profiles:
+            c, p = self._profile_coords(df, m)
+            coords.append(c)
+            pressures.append(p)
+            values.append(df.reindex(columns=columns).values.astype(dtype))
+
+        return columns, coords, pressures, values
+
+    def _profiles_to_collection(self, profiles):
+        '''Return ProfileCollection of profiles, a list of (df, metadata) 
+        tuples as stored in the cache file, without building a MultiIndex.
+        '''
+        from collections import OrderedDict
+
+        profiles = [(df, m) for df, m in profiles if not self._data_rows(df).empty]
+        if not profiles:
+            return ProfileCollection.empty()
+
+        dtype = np.float32 if self.compact else np.float64
+        columns, coords, pressures, values = self._profile_arrays(profiles, dtype)
+        wmo, time, lon, lat, profile = zip(*coords)
+        values = np.concatenate(values)
+        data = OrderedDict()
+        for i, c in enumerate(columns):
+            data[c] = values[:, i]
+            if c.endswith(self._qc_suffix):
+                data[c] = np.where(np.isnan(data[c]), self._QC_MISSING, 
+                                   data[c]).astype(np.int8)
+
+        return ProfileCollection(wmo, time, lon, lat, profile, 
+                                 [len(p) for p in pressures],
+                                 np.concatenate(pressures).astype(dtype), data)
+
+    def _write_profiles(self, store, batch):
+        '''Put batch, a list of (name, df, metadata) profile tuples, into the
+        open HDFStore and update the lookup tables maintained for them.
+        '''
+        tombstones = [(n, m) for n, _, m in batch if (m or {}).get('reason')]
+        if tombstones:
+            self._write_tombstones(store, tombstones)
+        batch = [(n, df, m) for n, df, m in batch if not (m or {}).get('reason')]
+        if not batch:
+            return
+
+        if ('/' + self._LOOKUP_TABLES not in store and 
+                not any(n.startswith('WMO') for n in store.get_node('/')._v_children)):
+            # The tables of a new cache file are maintained from the start
+            self._mark_lookup_tables(store)
+        existed = [name in store for name, _, _ in batch]
+        for name, df, metadata in batch:
+            self._write_df(store, df, name, metadata)
+        if '/' + self._TOMBSTONES in store:
+            self._clear_tombstones(store, [name for name, _, _ in batch])
+        if self._levels_node() in store:
+            self._append_standard_levels(store, batch)
+
+        if '/' + self._LOOKUP_TABLES in store:
+            counts_df = pd.concat([self._profile_counts_df(name, df) 
+                                   for name, df, _ in batch], ignore_index=True)
+            self._append_profile_counts(store, counts_df)
+            self._append_manifest(store, pd.DataFrame.from_records(
+                    [self._manifest_record(store, name, df, metadata) 
+                     for name, df, metadata in batch],
+                    columns=self._manifest_columns))
+            self._append_changelog(store, self._changelog_df(
+                    [name for name, _, _ in batch],
+                    [self._REPLACED if e else self._ADDED for e in existed]))
+
     def _get_df(self, name):
         '''Return tuple of Pandas DataFrame and metadata dictionary.
         '''
-        store = pd.HDFStore(self.cache_file)
+        if self._writer is not None and name in self._writer:
+            self.logger.debug('Getting "%s" from write queue', name)
+            return self._writer.get(name)
+
+        store = pd.HDFStore(self.cache_file, 
+                            mode='a' if self._snapshot is None else 'r')
         try:
             self.logger.debug('Getting "%s" from %s', name, self.cache_file)
             df = store[name]
@@ -166,25 +627,315 @@ class ArgoData(object):
     def _remove_df(self, name):
         '''Remove name from cache file
         '''
+        self._check_writable()
+        if self._writer is not None and name in self._writer:
+            self._writer.remove(name)
+            return
+
+        with pd.HDFStore(self.cache_file) as store:
+            self._delete_df(store, name)
+
+    def _delete_df(self, store, name):
+        '''Remove name from the open store and record profile removals in
+        the lookup tables.
+        '''
+        self.logger.debug('Removing "%s" from %s', name, self.cache_file)
+        store.remove(name)
+        self._invalidate_frames(name)
+        self._indexes.pop(name.lstrip('/'), None)
+        if name.startswith('/WMO') and self._levels_node() in store:
+            self._append_standard_levels(store, [(name, None, None)])
+        if name.startswith('/WMO') and '/' + self._LOOKUP_TABLES in store:
+            self._append_profile_counts(store, self._profile_counts_df(name))
+            self._append_manifest(store, pd.DataFrame.from_records(
+                    [self._manifest_record(store, name)],
+                    columns=self._manifest_columns))
+            self._append_changelog(store, self._changelog_df([name], 
+                                                             [self._REMOVED]))
+
+    def _put_tombstone(self, name, url, reason):
+        '''Record that the profile at url could not be saved to name for
+        reason.  Tombstones go through the CacheWriter like profiles, but 
+        are written as rows of the tombstones table rather than as nodes.
+        '''
+        self._put_profile(self._blank_df, name, dict(url=url, reason=reason,
+                                                     dateloaded=datetime.utcnow()))
+
+    def _write_tombstones(self, store, tombstones):
+        '''Append tombstones, a list of (name, metadata) tuples, to the
+        tombstones table in the open store, removing any profile data 
+        previously saved to those names.
+        '''
+        records = []
+        for name, m in tombstones:
+            if name in store:
+                self._delete_df(store, name)
+            try:
+                _, code = self._float_profile_key(m['url'])
+            except AttributeError:
+                code = ''
+            records.append((name.split('/')[1].split('_')[1], name, m['url'], 
+                            code, m['reason'], m['dateloaded'], False))
+
+        self._append_tombstones(store, pd.DataFrame.from_records(records, 
+                                columns=self._tombstone_columns))
+
+    def _clear_tombstones(self, store, names):
+        '''Mark as cleared the tombstones of names that now have profile 
+        data saved in the open store.
+        '''
+        names = [str(n) for n in names]
+        df = store.select(self._TOMBSTONES, where='key={}'.format(names))
+        df = df.drop_duplicates('key', keep='last')
+        df = df[~df['cleared'].astype(bool)]
+        if not df.empty:
+            self._append_tombstones(store, df.assign(cleared=True, 
+                                                     dateloaded=datetime.utcnow()))
+
+    def _append_tombstones(self, store, tombstones_df):
+        '''Append rows to the tombstones table in the open store.
+        '''
+        store.append(self._TOMBSTONES, tombstones_df, format='table',
+                     data_columns=['wmo', 'key', 'reason'],
+                     min_itemsize=dict(wmo=16, key=32, url=256, code=8, reason=32))
+
+    def get_tombstones(self):
+        '''Return DataFrame of the profiles that have been found to have no
+        usable data, with the reason and the time that they were last tried.
+        '''
+        columns = self._tombstone_columns[:-1]
+        if self._shards:
+            return pd.concat([s.get_tombstones() for s in self._shards], 
+                             ignore_index=True)
+
+        try:
+            with pd.HDFStore(self.cache_file, mode='r') as s:
+                if '/' + self._TOMBSTONES not in s:
+                    return pd.DataFrame(columns=columns)
+                df = s.select(self._TOMBSTONES)
+        except IOError:
+            return pd.DataFrame(columns=columns)
+
+        # The last row for a profile is its current state
+        df = df.drop_duplicates('key', keep='last')
+
+        return df[~df['cleared'].astype(bool)].loc[:, columns].reset_index(drop=True)
+
+    def _retry_tombstone(self, tombstone, url, code, update_delayed_mode=False):
+        '''Return True if it's time to try loading the tombstoned profile at
+        url again according to retry_days, because it was recorded for a
+        different file, e.g. the bio file found in the bio-profile index, or
+        with update_delayed_mode set because its delayed mode data have been
+        updated.
+        '''
+        if tombstone['url'] != url:
+            return True
+        days = self.retry_days.get(tombstone['reason'])
+        if days is not None:
+            if datetime.utcnow() - tombstone['dateloaded'] >= timedelta(days=days):
+                return True
+        if 'D' in code.upper() and update_delayed_mode:
+            DATE_UPDATED = self._get_update_datetime(url)
+            if DATE_UPDATED and tombstone['dateloaded'] < DATE_UPDATED:
+                return True
+
+        return False
+
+    def convert_blank_profiles(self):
+        '''Replace the blank DataFrame nodes that older versions saved for
+        profiles without usable data with rows in the tombstones table.
+        Returns the number of profiles converted.
+        '''
+        self._check_writable()
+        df = self.get_profile_metadata()
+        df = df[df['nrows'] == 0]
+        tombstones = [(name, dict(url=url, reason=self._NO_DATA, dateloaded=dl))
+                      for name, url, dl in zip(df['name'], df['url'], df['dateloaded'])]
+        if tombstones:
+            self.logger.info('Converting %s blank profiles in %s to tombstones',
+                             len(tombstones), self.cache_file)
+            with pd.HDFStore(self.cache_file) as store:
+                self._write_tombstones(store, tombstones)
+
+        return len(tombstones)
+
+    def _index_expired(self, metadata, url):
+        '''Return True if the index table with metadata needs to be checked
+        against url for a newer version.
+        '''
+        if metadata.get('url', url) != url:
+            return True
+        if self.index_ttl_days is None:
+            return False
+        if 'checked' not in metadata:
+            return True
+
+        return (datetime.utcnow() - metadata['checked'] > 
+                timedelta(days=self.index_ttl_days))
+
+    def _get_index(self, name, url, fetch):
+        '''Return DataFrame of index table name.  Tables are memoized in 
+        memory and loaded from the cache file once.  When expired they are
+        refreshed by fetch(url, metadata), which returns tuple of DataFrame, 
+        None if url has not changed since the validators in metadata, and 
+        dictionary of the new validators.  A table that can't be refreshed
+        is used as is.
+        '''
+        try:
+            df, metadata = self._indexes[name]
+        except KeyError:
+            try:
+                df, metadata = self._get_df(name)
+            except (IOError, KeyError):
+                df, metadata = None, None
+            metadata = metadata or {}
+            self._indexes[name] = (df, metadata)
+
+        if df is not None and not self._index_expired(metadata, url):
+            return df
+
+        self.logger.info('Checking %s for a newer %s', url, name)
+        validators = {}
+        if df is not None and metadata.get('url', url) == url:
+            validators = metadata
+        try:
+            new_df, validators = fetch(url, validators)
+        except (IOError, EOFError) as e:
+            if df is None:
+                raise
+            self.logger.warn('Using cached %s, could not refresh it: %s', name, e)
+            return df
+
+        # A published generation keeps the refreshed table in memory only
+        if new_df is None:
+            self.logger.debug('%s has not changed', url)
+            metadata = dict(metadata, url=url, checked=datetime.utcnow())
+            if self._snapshot is None:
+                with pd.HDFStore(self.cache_file) as store:
+                    store.get_storer(name).attrs.metadata = metadata
+        else:
+            metadata = dict(validators, url=url, checked=datetime.utcnow())
+            if self._snapshot is None:
+                self._swap_df(new_df, name, metadata)
+            df = new_df
+        self._indexes[name] = (df, metadata)
+
+        return df
+
+    def _swap_df(self, df, name, metadata=None):
+        '''Replace name in the cache file with df by writing it to a new
+        node and renaming that over the old one so that name is never 
+        missing or half written.
+        '''
+        new_name = name + '_new'
         with pd.HDFStore(self.cache_file) as store:
-            self.logger.debug('Removing "%s" from %s', name, self.cache_file)
-            store.remove(name)
+            self._write_df(store, df, new_name, metadata)
+            store.get_node(new_name)._f_rename(name, overwrite=True)
+
+    def _conditional_get(self, url, metadata):
+        '''Return streaming requests response for url, None if the server
+        says that it has not changed since the etag or last_modified in 
+        metadata.
+        '''
+        import requests
+
+        headers = {}
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+
+        self.logger.info('Reading data from %s', url)
+        req = requests.get(url, headers=headers, stream=True)
+        if req.status_code == 304:
+            req.close()
+            return None
+        req.raise_for_status()
+        req.raw.decode_content = True
+
+        return req
+
+    def _http_validators(self, req):
+        '''Return dictionary of the validators of requests response req for
+        the next conditional request.
+        '''
+        return dict(etag=req.headers.get('ETag'), 
+                    last_modified=req.headers.get('Last-Modified'))
+
+    def _ftp_modified(self, url):
+        '''Return modification time string of the file at ftp url, None if
+        the server does not report it.
+        '''
+        import ftplib
+
+        parts = urlparse(url)
+        try:
+            with closing(ftplib.FTP(parts.hostname, timeout=60)) as ftp:
+                ftp.login()
+                return ftp.sendcmd('MDTM ' + parts.path).split()[-1]
+        except ftplib.all_errors as e:
+            self.logger.debug('No modification time for %s: %s', url, e)
+            return None
+
+    def _decode_csv(self, chunks, encoding, **kwargs):
+        '''Return Pandas DataFrame of the csv text in byte string chunks.
+        The text is decoded as the chunks arrive into a temporary UTF-8 file
+        so that the whole file is never held in memory as unicode.  
+        '''
+        decoder = codecs.getincrementaldecoder(encoding)()
+        with tempfile.SpooledTemporaryFile(max_size=self._spool_bytes) as f:
+            for chunk in chunks:
+                f.write(decoder.decode(chunk).encode('utf-8'))
+            f.write(decoder.decode(b'', final=True).encode('utf-8'))
+            f.seek(0)
+            df = pd.read_csv(f, encoding='utf-8', **kwargs)
+
+        return df
+
+    def _fetch_status(self, url, metadata):
+        '''Return tuple of status DataFrame from url, None if not modified,
+        and validators for get_index().
+        '''
+        req = self._conditional_get(url, metadata)
+        if req is None:
+            return None, {}
+
+        # The status file is UTF-16 with a leading BOM
+        with closing(req):
+            df = self._decode_csv(req.iter_content(chunk_size=65536), 'utf-16')
+
+        return df, self._http_validators(req)
+
+    def _fetch_csv(self, url, metadata, date_columns=[]):
+        '''Return tuple of DataFrame of the csv file at url, None if not
+        modified, and validators for get_index().
+        '''
+        if not url.startswith('ftp'):
+            req = self._conditional_get(url, metadata)
+            if req is None:
+                return None, {}
+            with closing(req):
+                df = pd.read_csv(req.raw, comment='#', parse_dates=date_columns)
+            return df, self._http_validators(req)
+
+        modified = self._ftp_modified(url)
+        if modified and modified == metadata.get('last_modified'):
+            return None, {}
+
+        return self._ftp_csv_to_df(url, date_columns), dict(last_modified=modified)
 
     def _status_to_df(self):
         '''Read the data at status_url link and return it as a Pandas DataFrame.
         '''
-        self.logger.info('Reading data from %s', self.status_url)
-        req = requests.get(self.status_url)
-        req.encoding = 'UTF-16LE'
+        df, _ = self._fetch_status(self.status_url, {})
 
-        # Had to tell requests the encoding, StringIO makes the text 
-        # look like a file object. Skip over leading BOM bytes.
-        df = pd.read_csv(StringIO(req.text[1:]))
         return df
 
     def _ftp_csv_to_df(self, url, date_columns=[]):
         '''Read the data at url link and return it as a Pandas DataFrame.
         '''
+        import urllib2
+
         self.logger.info('Reading data from %s', url)
         with closing(urllib2.urlopen(url)) as r:
             df = pd.read_csv(r, comment='#', parse_dates=date_columns)
@@ -211,6 +962,8 @@ class ArgoData(object):
         '''Return list of tuples that is used for Pandas MultiIndex hireachical 
         index and indices to pressure variable.
         '''
+        import pydap.exceptions
+
         pressures = []
         pres_indices = []
         try:
@@ -230,10 +983,38 @@ class ArgoData(object):
 
         return indices, pres_indices
 
+    def _qc_flags(self, ds, v, url):
+        '''Return 2-D int8 array of the QC flags of variable v in ds, read 
+        from the <v>_QC char array, all _QC_MISSING if ds doesn't have it.
+        '''
+        try:
+            chars = np.atleast_2d(np.asarray(ds[v + self._qc_suffix].values))
+        except KeyError:
+            self.logger.warn('%s not in %s', v + self._qc_suffix, url)
+            return np.full(np.atleast_2d(ds[v].values).shape, self._QC_MISSING, 
+                           dtype=np.int8)
+
+        # Decode all flags at once from their character codes
+        flags = chars.astype('S1').view(np.uint8).astype(np.int16) - ord('0')
+        flags[(flags < 0) | (flags > 9)] = self._QC_MISSING
+
+        return flags.astype(np.int8)
+
+    def _apply_qc(self, df, v, flags):
+        '''Add int8 flags column for variable v to df and set the values of
+        v whose flags are not in v's qc_accept list to NaN.
+        '''
+        df[v + self._qc_suffix] = flags
+        accept = self.qc_accept.get(v)
+        if accept is not None:
+            df[v] = np.where(np.in1d(flags, accept), df[v].values, np.nan)
+
     def _build_profile_dataframe(self, wmo, url, ds, max_pressure, profile, nprof):
         '''Return DataFrame containing the variables from N_PROF column in
         url specified by nprof integer (0,1).
         '''
+        import pydap.exceptions
+
         df = pd.DataFrame()
         # Add only non-coordinate variables to the DataFrame
         for v in self.variables:
@@ -243,6 +1024,8 @@ class ArgoData(object):
                 s = pd.Series(ds[v].values[nprof][pres_indices], index=indices)
                 self.logger.debug('Added %s to DataFrame', v)
                 df[v] = s
+                if self.qc_accept is not None:
+                    self._apply_qc(df, v, self._qc_flags(ds, v, url)[nprof][pres_indices])
             except (KeyError, TypeError):
                 self.logger.warn('%s not in %s', v, url)
             except pydap.exceptions.ServerError as e:
@@ -250,21 +1033,108 @@ class ArgoData(object):
 
         return df
 
+    def _nearest_values(self, pressures, source_pressures, values, tolerance):
+        '''Return array of values at the source_pressures nearest to each of
+        pressures, NaN where there is no valid value within tolerance.
+        '''
+        valid = ~(np.isnan(source_pressures) | np.isnan(values))
+        order = np.argsort(source_pressures[valid])
+        sp = source_pressures[valid][order]
+        sv = values[valid][order]
+        aligned = np.empty(len(pressures))
+        aligned.fill(np.nan)
+        if not len(sp):
+            return aligned
+
+        right = np.clip(np.searchsorted(sp, pressures), 0, len(sp) - 1)
+        left = np.clip(right - 1, 0, len(sp) - 1)
+        use_left = np.abs(pressures - sp[left]) <= np.abs(sp[right] - pressures)
+        nearest = np.where(use_left, left, right)
+        matched = np.abs(sp[nearest] - pressures) <= tolerance
+        aligned[matched] = sv[nearest[matched]]
+
+        return aligned
+
+    def _merge_profile_dataframe(self, wmo, url, ds, max_pressure, profile):
+        '''Return DataFrame of the variables on the N_PROF [0] pressures of
+        url with bio_list variables that are empty there taken from the 
+        nearest N_PROF [1] pressures within self.pressure_tolerance.  Each
+        variable is read from ds once for both N_PROF arrays.
+        '''
+        import pydap.exceptions
+
+        try:
+            all_pressures = np.atleast_2d(ds['PRES_ADJUSTED'].values)
+        except pydap.exceptions.ServerError as e:
+            self.logger.error(e)
+            return pd.DataFrame()
+
+        # Same as _get_pressures(): [0] levels before reaching max_pressure
+        with np.errstate(invalid='ignore'):
+            deeper = np.nonzero(all_pressures[0] >= max_pressure)[0]
+        nlevels = deeper[0] if len(deeper) else all_pressures.shape[1]
+        pressures = all_pressures[0][:nlevels].astype(np.float64)
+        if not nlevels:
+            self.logger.warn('No PRES_ADJUSTED values in netCDF file')
+
+        df = pd.DataFrame(index=pd.MultiIndex.from_arrays(
+                [[wmo] * nlevels, 
+                 np.repeat(ds['JULD'].values[0], nlevels),
+                 np.repeat(ds['LONGITUDE'].values[0], nlevels),
+                 np.repeat(ds['LATITUDE'].values[0], nlevels),
+                 [profile] * nlevels, np.round(pressures, 2)],
+                names=self._index_names))
+        for v in self.variables:
+            try:
+                values = np.atleast_2d(ds[v].values).astype(np.float64)
+            except (KeyError, TypeError):
+                self.logger.warn('%s not in %s', v, url)
+                continue
+            except pydap.exceptions.ServerError as e:
+                self.logger.error(e)
+                continue
+
+            df[v] = values[0][:nlevels]
+            flags = None
+            if self.qc_accept is not None:
+                flags = self._qc_flags(ds, v, url)
+                self._apply_qc(df, v, flags[0][:nlevels])
+            if v in self._bio_list and df[v].dropna().empty and len(values) > 1:
+                self.logger.debug('%s: N_PROF [0] empty, aligning [1] onto [0] '
+                                  'pressures', v)
+                df[v] = self._nearest_values(pressures, 
+                                             all_pressures[1].astype(np.float64),
+                                             values[1], self.pressure_tolerance)
+                if flags is not None:
+                    # Align the flags with the same nearest pressures
+                    aligned = self._nearest_values(pressures, 
+                                    all_pressures[1].astype(np.float64),
+                                    np.where(np.isnan(values[1]), np.nan, 
+                                             flags[1]), self.pressure_tolerance)
+                    self._apply_qc(df, v, np.where(np.isnan(aligned), 
+                                   self._QC_MISSING, aligned).astype(np.int8))
+
+        return df
+
     def _profile_to_dataframe(self, wmo, url, key, max_pressure):
         '''Return a Pandas DataFrame of profiling float data from data at url.
         Examine data at url for variables in self._bio_list that may be in 
-        the lower vertical resolution [1] N_PROF array.
+        the lower vertical resolution [1] N_PROF array.  Returns None if url
+        cannot be opened.
         '''
-        df = self._blank_df
+        import pydap.client
+        import pydap.exceptions
+        import xray
+
         try:
             self.logger.debug('Opening %s', url)
             ds = xray.open_dataset(url)
         except pydap.exceptions.ServerError:
             self.logger.error('ServerError opening %s', url)
-            return df
+            return None
         except Exception as e:
             self.logger.error('Error opening %s: %s', url, str(e))
-            return df
+            return None
 
         self.logger.debug('Checking %s for our desired variables', url)
         for v in self._coordinates.union(self.variables):
@@ -273,6 +1143,9 @@ class ArgoData(object):
 
         profile = int(key.split('P')[1])
 
+        if self.pressure_tolerance is not None:
+            return self._merge_profile_dataframe(wmo, url, ds, max_pressure, profile)
+
         df = self._build_profile_dataframe(wmo, url, ds, max_pressure, 
                                            profile, nprof=0)
 
@@ -290,6 +1163,10 @@ class ArgoData(object):
     def _get_update_datetime(self, url):
         '''Return python datetime of DATE_UPDATE variable from NetCDF file at url
         '''
+        import pydap.client
+        import pydap.exceptions
+        import xray
+
         dt = None
         try:
             self.logger.debug('Opening %s', url)
@@ -307,8 +1184,7 @@ class ArgoData(object):
         group name: WMO_<wmo>/P<profilenumber>. The parent group WMO_<wmo>
         must be created before this key can be used to put data.
         '''
-        regex = re.compile(r"([a-zA-Z]+)(\d+_\d+).nc$")
-        m = regex.search(url)
+        m = self._profile_url_regex.search(url)
         key = '/WMO_{:s}'.format(m.group(2).replace('_', '/P'))
         code = m.group(1)
 
@@ -326,13 +1202,7 @@ class ArgoData(object):
         Args:
             age_gte (int): Restrict to floats with data >= age, defaults to 340
         '''
-        try:
-            df, _ = self._get_df(self._STATUS)
-        except (IOError, KeyError):
-            self.logger.debug('Could not read status from cache, loading it.')
-            self._put_df(self._status_to_df(), self._STATUS)
-            df, _ = self._get_df(self._STATUS)
-
+        df = self._get_index(self._STATUS, self.status_url, self._fetch_status)
         odf = df.query('(OXYGEN == 1) & (GREYLIST == 0) & (AGE != 0) & '
                        '(AGE >= {:d})'.format(age_gte))
 
@@ -344,14 +1214,8 @@ class ArgoData(object):
         Args:
             wmo_list (list[str]): List of strings of float numbers
         '''
-        try:
-            df, _ = self._get_df(self._GLOBAL_META)
-        except KeyError:
-            self.logger.debug('Could not read global_meta, putting it into cache.')
-            self._put_df(self._ftp_csv_to_df(self.global_url, 
-                              date_columns=['date_update']), self._GLOBAL_META)
-            df, _ = self._get_df(self._GLOBAL_META)
-
+        df = self._get_index(self._GLOBAL_META, self.global_url, 
+                    lambda url, m: self._fetch_csv(url, m, ['date_update']))
         dac_urls = {}
         for _, row in df.loc[:,['file']].iterrows():
             wmo = row['file'].split('/')[1]
@@ -365,72 +1229,184 @@ class ArgoData(object):
 
         return dac_urls
 
-    def get_bio_profile_index(self,
-            url='ftp://ftp.ifremer.fr/ifremer/argo/argo_bio-profile_index.txt'):
+    def get_bio_profile_index(self, url=_bio_index_url):
         '''Return Pandas DataFrame of data at url
         '''
-        try:
-            df, _ = self._get_df(self._BIO_PROFILE_INDEX)
-        except KeyError:
-            self.logger.debug('Adding %s to cache', self._BIO_PROFILE_INDEX)
-            self._put_df(self._ftp_csv_to_df(url, date_columns=['date', 'date_update']),
-                         self._BIO_PROFILE_INDEX)
-            df, _ = self._get_df(self._BIO_PROFILE_INDEX)
+        return self._get_index(self._BIO_PROFILE_INDEX, url, 
+                    lambda url, m: self._fetch_csv(url, m, ['date', 'date_update']))
 
-        return df
+    def get_merge_profile_index(self, url=_merge_index_url):
+        '''Return Pandas DataFrame of the merge-profile index at url, the
+        merged core and bio profile files, which have the same columns as
+        the bio-profile index.
+        '''
+        return self._get_index(self._MERGE_PROFILE_INDEX, url, 
+                    lambda url, m: self._fetch_csv(url, m, ['date', 'date_update']))
+
+    def _code_rank(self, code):
+        '''Return sort rank of profile file code: 'D' Delayed Mode first,
+        then codes that contain 'D', then 'MR' and then the Realtime ones.
+        '''
+        code = code.upper()
+        if 'D' == code:
+            return 0
+        elif 'D' in code:
+            return 1
+        elif 'MR' == code:
+            return 2
+        else:
+            return 3
+
+    def _sort_url_keys(self, url_keys):
+        '''Sort list of (url, key, code) tuples in the order described in
+        _sort_opendap_urls().
+        '''
+        # Each group in reverse order, as they appear on the TDS
+        url_keys = sorted(url_keys, reverse=True)
+        return sorted(url_keys, key=lambda uk: self._code_rank(uk[2]))
 
     def _sort_opendap_urls(self, urls):
         '''Organize list of Argo OpenDAP URLs so that 'D' Delayed Mode or
         urls that contain 'D' appear before 'R' Realtime ones.
         '''
-        durls = []
-        hasdurls = []
-        mrurls = []
-        rurls = []
+        url_keys = []
         for url in urls:
-            regex = re.compile(r"([a-zA-Z]+)\d+_\d+.nc$")
             try:
-                code = regex.search(url).group(1).upper()
+                key, code = self._float_profile_key(url)
             except AttributeError:
                 continue
-            if 'D' == code:
-                durls.append(url)
-            elif 'D' in code:
-                hasdurls.append(url)
-            elif 'MR' == code:
-                mrurls.append(url)
-            else:
-                rurls.append(url)
+            url_keys.append((url, key, code))
 
-        # Return each group in reverse order, as they appear on the TDS
-        return sorted(durls, reverse=True) + sorted(hasdurls, reverse=True
-                ) + sorted(mrurls, reverse=True) + sorted(rurls, reverse=True)
+        return [url for url, _, _ in self._sort_url_keys(url_keys)]
 
-    def get_profile_opendap_urls(self, catalog_url):
-        '''Returns list of opendap urls for the profiles in catalog. The 
-        list is ordered with Delayed mode versions before Realtime ones.
+    def _parse_catalog(self, xml, base_url):
+        '''Return sorted list of (url, key, code) tuples for the profile 
+        datasets in THREDDS catalog xml, a file-like object.  The catalog 
+        is parsed incrementally and each element is discarded once read.
+        '''
+        url_keys = []
+        for _, elem in iterparse(xml):
+            if elem.tag.endswith('dataset'):
+                path = elem.get('urlPath', '')
+                if path.endswith('nc'):
+                    url = base_url + path
+                    try:
+                        key, code = self._float_profile_key(url)
+                    except AttributeError:
+                        pass
+                    else:
+                        url_keys.append((url, key, code))
+            elem.clear()
+
+        return self._sort_url_keys(url_keys)
+
+    def get_profile_opendap_url_keys(self, catalog_url):
+        '''Returns list of (url, key, code) tuples for the profiles in 
+        catalog, where key and code are as returned by _float_profile_key().
+        The list is ordered with Delayed mode versions before Realtime ones.
         The `catalog_url` is the .xml link for a directory on a THREDDS Data 
         Server.
         '''
-        urls = []
+        import requests
+        from requests.exceptions import ConnectionError
+
+        # Expect that this is a standard TDS with dodsC used for OpenDAP
+        base_url = '/'.join(catalog_url.split('/')[:4]) + '/dodsC/'
+
         try:
             self.logger.info("Checking for updates at %s", catalog_url)
-            req = requests.get(catalog_url)
+            req = requests.get(catalog_url, stream=True)
+            req.raw.decode_content = True
+            with closing(req):
+                return self._parse_catalog(req.raw, base_url)
         except ConnectionError as e:
             self.logger.error('Cannot open catalog_url = %s', catalog_url)
             self.logger.exception(e)
-            return urls
+        except ParseError as e:
+            self.logger.error('Cannot parse catalog_url = %s', catalog_url)
+            self.logger.exception(e)
 
-        soup = BeautifulSoup(req.text, 'html.parser')
+        return []
 
-        # Expect that this is a standard TDS with dodsC used for OpenDAP
-        base_url = '/'.join(catalog_url.split('/')[:4]) + '/dodsC/'
+    def get_profile_opendap_urls(self, catalog_url):
+        '''Returns list of opendap urls for the profiles in catalog. The 
+        list is ordered with Delayed mode versions before Realtime ones.
+        The `catalog_url` is the .xml link for a directory on a THREDDS Data 
+        Server.
+        '''
+        return [url for url, _, _ in self.get_profile_opendap_url_keys(catalog_url)]
 
-        # Pull out <dataset ... urlPath='...nc'> attributes from the XML
-        for e in soup.findAll('dataset', attrs={'urlpath': re.compile("nc$")}):
-            urls.append(base_url + e['urlpath'])
+    def get_profile_work_list(self, wmo_list=None, time=None, region=None,
+                              parameters=None, url=_merge_index_url):
+        '''Return DataFrame of the profiles in the merge-profile index at url
+        with columns wmo, url, key, code, time, lon, lat and date_update.
+        Each float's profiles are in the order of get_profile_opendap_url_keys()
+        so one index download replaces reading the catalog of every float.
+        The merged files have the core variables, e.g. TEMP_ADJUSTED, that
+        the bio files listed in the bio-profile index don't.
 
-        return self._sort_opendap_urls(urls)
+        Args:
+            wmo_list (list[str]): Floats to include, default: all
+            time (tuple): (start, end) of profile dates, either may be None
+            region (tuple): (lon_min, lat_min, lon_max, lat_max) of positions
+            parameters (list): Index parameter names, e.g. ['DOXY'], that
+                               each profile must all have
+            url (str): The argo_bio-profile_index.txt of the bio files has
+                       the same columns and may be used for variables that
+                       are all in the bio files
+        '''
+        if url == self._bio_index_url:
+            df = self.get_bio_profile_index(url)
+        else:
+            df = self.get_merge_profile_index(url)
+        df = df.dropna(subset=['file'])
+        parts = df['file'].str.extract(r'([a-zA-Z]+)(\d+)_(\d+)\.nc$', expand=True)
+        use = parts[0].notnull().values
+        if wmo_list is not None:
+            use &= parts[1].isin([str(w) for w in wmo_list]).values
+        if time is not None:
+            start, end = time
+            if start is not None:
+                use &= (df['date'] >= pd.Timestamp(start)).values
+            if end is not None:
+                use &= (df['date'] <= pd.Timestamp(end)).values
+        if region is not None:
+            lon_min, lat_min, lon_max, lat_max = region
+            use &= df['longitude'].between(lon_min, lon_max).values
+            use &= df['latitude'].between(lat_min, lat_max).values
+        if parameters:
+            names = ' ' + df['parameters'].fillna('') + ' '
+            for parameter in parameters:
+                use &= names.str.contains(' {} '.format(parameter), regex=False).values
+
+        df, parts = df[use], parts[use]
+        base_url = self.thredds_url.replace('/catalog/', '/dodsC/').rstrip('/') + '/'
+        codes = parts[0].str.upper()
+        work_df = pd.DataFrame({'wmo': parts[1], 'url': base_url + df['file'], 
+                                'key': '/WMO_' + parts[1] + '/P' + parts[2],
+                                'code': parts[0], 'time': df['date'],
+                                'lon': df['longitude'], 'lat': df['latitude'],
+                                'date_update': df['date_update'],
+                                'rank': np.select([codes == 'D', codes.str.contains('D'),
+                                                   codes == 'MR'], [0, 1, 2], 3)})
+        work_df = work_df.sort_values(['wmo', 'rank', 'url'], 
+                                      ascending=[True, True, False])
+
+        return work_df[['wmo', 'url', 'key', 'code', 'time', 'lon', 'lat',
+                        'date_update']].reset_index(drop=True)
+
+    def _float_url_keys(self, wmo_list):
+        '''Yield (wmo, url_keys) tuples of the floats in wmo_list, where
+        url_keys is the sorted list of (url, key, code) tuples of the
+        float's profiles found by the discovery mode.
+        '''
+        if self.discovery == 'index':
+            work_df = self.get_profile_work_list(wmo_list)
+            for wmo, df in work_df.groupby('wmo', sort=False):
+                yield wmo, zip(df['url'], df['key'], df['code'])
+        else:
+            for wmo, dac_url in self.get_dac_urls(wmo_list).iteritems():
+                yield wmo, self.get_profile_opendap_url_keys(dac_url)
 
     def _get_cache_file_parms(self, cache_file):
         '''Return dictionary of constraint parameters from name of fixed cache file.
@@ -492,17 +1468,18 @@ class ArgoData(object):
         return adjusted_value
 
     def _validate_oxygen(self, df, url, var_name='DOXY_ADJUSTED'):
-        '''Return blank DataFrame if no valid oxygen otherwise return df.
+        '''Return False if no valid oxygen in df otherwise return True.
         '''
         if df[var_name].dropna().empty:
             self.logger.warn('Oxygen is all NaNs in %s', url)
-            df = self._blank_df
+            return False
 
-        return df
+        return True
 
     def _save_profile(self, url, count, opendap_urls, wmo, key, code,
                       max_pressure, float_msg, max_profiles):
-        '''Put profile data into the local HDF cache.
+        '''Put profile data into the local HDF cache, or a tombstone for it
+        if it has no usable data.
         '''
         m_t = '{}, Profile {} of {}, key = {}, code = {}'
         m_t_mp = '{}, Profile {} of {}({}), key = {}, code = {}'
@@ -514,29 +1491,39 @@ class ArgoData(object):
         except NameError:
             pass
 
+        reason = None
         try:
             self.logger.info(msg)
-            df = self._profile_to_dataframe(wmo, url, key, max_pressure).dropna()
-            if df.empty:
-                df = self._blank_df
+            df = self._profile_to_dataframe(wmo, url, key, max_pressure)
+            if df is None:
+                reason = self._READ_ERROR
+            elif self._data_rows(df).empty:
+                reason = self._NO_DATA
             else:
-                if 'DOXY_ADJUSTED' in self._bio_list:
-                    df = self._validate_oxygen(df, url, 'DOXY_ADJUSTED')
-                elif 'DOXY' in self._bio_list:
-                    df = self._validate_oxygen(df, url, 'DOXY')
+                df = self._data_rows(df)
+                for var_name in self._oxygen_variables:
+                    if var_name in self._bio_list:
+                        if not self._validate_oxygen(df, url, var_name):
+                            reason = self._NO_OXYGEN
+                        break
         except RequiredVariableNotPresent as e:
             self.logger.warn(str(e))
-            df = self._blank_df
+            reason = self._MISSING_VARIABLE
         except KeyError as e:
             self.logger.error(str(e))
-            df = self._blank_df
+            reason = self._READ_ERROR
+
+        if reason:
+            self._put_tombstone(key, url, reason)
+            return self._blank_df
 
-        self._put_df(df, key, dict(url=url, dateloaded=datetime.utcnow()))
+        self._put_profile(df, key, dict(url=url, dateloaded=datetime.utcnow()))
 
         return df
 
     def _get_data_from_argo(self, wmo_list, max_profiles=None, max_pressure=None,
-                                  append_df=True, update_delayed_mode=False):
+                                  append_df=True, update_delayed_mode=False,
+                                  as_collection=False):
         '''Query Argo web resources for all the profile data for floats in
         wmo_list. Return DataFrame.
         '''
@@ -544,72 +1531,343 @@ class ArgoData(object):
         max_pressure = self._validate_cache_file_parm('pressure', max_pressure)
         max_wmo_list = self._validate_cache_file_parm('wmo', wmo_list)
 
-        float_df = pd.DataFrame()
-        for f, (wmo, dac_url) in enumerate(self.get_dac_urls(max_wmo_list).iteritems()):
-            float_msg = 'WMO_{}: Float {} of {}'. format(wmo, f+1, len(max_wmo_list))
-            opendap_urls = self.get_profile_opendap_urls(dac_url)
-            for i, url in enumerate(opendap_urls):
-                if i >= max_profiles:
-                    self.logger.info('Stopping at max_profiles = %s', max_profiles)
-                    break
-                try:
-                    key, code = self._float_profile_key(url)
-                except AttributeError:
-                    continue
-                try:
-                    df, m = self._get_df(key)
-                    self.logger.debug(m['url'])
-                    if 'D' in code.upper() and update_delayed_mode:
-                        DATE_UPDATED = self._get_update_datetime(url)
-                        if DATE_UPDATED:
-                            if m['dateloaded'] < DATE_UPDATED:
-                                self.logger.info(
-                                        'Replacing %s as dateloaded time of %s'
-                                        ' is before DATE_UPDATED time of %s',
-                                        key, m['dateloaded'], DATE_UPDATED)
-                                self._remove_df(key)
-                                raise KeyError
-                except KeyError:
-                    df = self._save_profile(url, i, opendap_urls, wmo, key, code,
-                                            max_pressure, float_msg, max_profiles)
-
-                self.logger.debug(df.head())
-                if append_df and not df.dropna().empty:
-                    float_df = float_df.append(df)
-
-        return float_df
-
-    def _get_data_from_cache(self, wmo_list, wmo_df, max_profiles=None):
+        profiles = []
+        self._init_profile_tables()
+        tombstones = self.get_tombstones().set_index('key')
+        self._run_time = datetime.utcnow()
+
+        # Write-behind profiles, the finally guarantees that all are saved
+        self._writer = CacheWriter(self.cache_file, self._write_profiles, 
+                                   logger=self.logger, **self._batch_parms)
+        try:
+            for f, (wmo, url_keys) in enumerate(self._float_url_keys(max_wmo_list)):
+                float_msg = 'WMO_{}: Float {} of {}'. format(wmo, f+1, len(max_wmo_list))
+                opendap_urls = [url for url, _, _ in url_keys]
+                for i, (url, key, code) in enumerate(url_keys):
+                    if i >= max_profiles:
+                        self.logger.info('Stopping at max_profiles = %s', max_profiles)
+                        break
+                    try:
+                        if key in tombstones.index:
+                            if not self._retry_tombstone(tombstones.loc[key], url,
+                                                    code, update_delayed_mode):
+                                self.logger.debug('Skipping %s tombstoned for %s',
+                                                  key, tombstones.loc[key, 'reason'])
+                                continue
+                            self.logger.info('Retrying %s tombstoned for %s',
+                                             key, tombstones.loc[key, 'reason'])
+                            raise KeyError
+                        df, m = self._get_df(key)
+                        self.logger.debug(m['url'])
+                        if 'D' in code.upper() and update_delayed_mode:
+                            DATE_UPDATED = self._get_update_datetime(url)
+                            if DATE_UPDATED:
+                                if m['dateloaded'] < DATE_UPDATED:
+                                    self.logger.info(
+                                            'Replacing %s as dateloaded time of %s'
+                                            ' is before DATE_UPDATED time of %s',
+                                            key, m['dateloaded'], DATE_UPDATED)
+                                    self._remove_df(key)
+                                    raise KeyError
+                    except KeyError:
+                        df = self._save_profile(url, i, opendap_urls, wmo, key, code,
+                                                max_pressure, float_msg, max_profiles)
+                        m = None
+
+                    self.logger.debug(df.head())
+                    if append_df:
+                        profiles.append((df, m))
+
+                # A killed load then loses at most this float's profiles
+                self._writer.flush()
+        finally:
+            self._writer.close()
+            self._writer = None
+            self._run_time = None
+
+        if as_collection:
+            return self._profiles_to_collection(profiles)
+
+        return self._profiles_to_frame(profiles)
+
+    def _get_data_from_cache(self, wmo_list, max_profiles=None, max_pressure=None,
+                             as_collection=False):
         '''Return DataFrame of data in the cache file without querying Argo
         '''
         max_profiles = self._validate_cache_file_parm('profiles', max_profiles)
         # TODO: Make sure all in wmo_list is in max_wmo_list
         ##max_wmo_list = self._validate_cache_file_parm('wmo', wmo_list)
 
-        float_df = pd.DataFrame()
-        for f, wmo in enumerate(wmo_list):
-            rows = wmo_df.loc[wmo_df['wmo'] == wmo, :]
-            for i, (_, row) in enumerate(rows.iterrows()):
-                if i >= max_profiles:
-                    self.logger.info('%s stopping at max_profiles = %s', wmo, max_profiles)
-                    break
-                try:
-                    key, code = self._float_profile_key(row['url'])
-                except AttributeError:
-                    continue
+        pressure = (None, max_pressure) if max_pressure is not None else None
 
-                self.logger.debug('Float %s of %s, Profile %s of %s: %s', 
-                                 f+1, len(wmo_list), i+1, len(rows), key)
-                df, _ = self._get_df(key)
-                if not df.dropna().empty:
-                    float_df = float_df.append(df)
+        return self.read(wmo_list, pressure=pressure, max_profiles=max_profiles,
+                         as_collection=as_collection)
 
-        return float_df
+    def _query_manifest(self, wmo_list=None, time=None, pressure=None, 
+                        codes=None, max_profiles=None):
+        '''Return the profile metadata rows that match the read() arguments.
+        '''
+        df = self.get_profile_metadata()
+        if wmo_list is not None:
+            wmo_list = [str(w) for w in wmo_list]
+            df = df[df['wmo'].isin(wmo_list)]
+            # Return floats in wmo_list order, profiles in manifest order
+            order = dict((w, i) for i, w in enumerate(wmo_list))
+            df = df.iloc[np.argsort(df['wmo'].map(order).values, kind='mergesort')]
+        if codes is not None:
+            df = df[df['code'].str.upper().isin([c.upper() for c in codes])]
+        if time is not None:
+            start, end = time
+            if start is not None:
+                df = df[df['time'] >= pd.Timestamp(start)]
+            if end is not None:
+                df = df[df['time'] <= pd.Timestamp(end)]
+        if pressure is not None:
+            low, high = pressure
+            if low is not None:
+                df = df[df['pmax'] >= low]
+            if high is not None:
+                df = df[df['pmin'] <= high]
+        if max_profiles is not None:
+            df = df.groupby('wmo', sort=False).head(max_profiles)
+
+        return df
+
+    def _select_profile(self, df, metadata, pressure=None, variables=None, qc=None):
+        '''Return stored profile df with only the rows within the pressure
+        range whose QC flags are accepted by qc and the requested variables.
+        '''
+        compact = (metadata or {}).get('compact')
+        if pressure is not None:
+            if compact:
+                pressures = df['pressure'].values
+            else:
+                pressures = df.index.get_level_values('pressure').values
+            low, high = pressure
+            keep = np.ones(len(df), dtype=bool)
+            if low is not None:
+                keep &= pressures >= low
+            if high is not None:
+                keep &= pressures <= high
+            df = df[keep]
+        if qc is not None:
+            keep = np.ones(len(df), dtype=bool)
+            for v, accept in qc.items():
+                c = v + self._qc_suffix
+                flags = df[c].values if c in df else np.full(len(df), 
+                                                    self._QC_MISSING, np.int8)
+                keep &= np.in1d(flags, accept)
+            df = df[keep]
+        if variables is not None:
+            df = df.reindex(columns=(['pressure'] if compact else []) + list(variables))
 
+        return df
+
+    def _read_profiles(self, names, pressure=None, variables=None, qc=None):
+        '''Generate (df, metadata) tuples of the profiles in names, opening
+        the cache file once for all of them.
+        '''
+        store = None
+        try:
+            for name in names:
+                if self._writer is not None and name in self._writer:
+                    df, metadata = self._writer.get(name)
+                else:
+                    if store is None:
+                        store = pd.HDFStore(self.cache_file, mode='r')
+                    df = store[name]
+                    try:
+                        metadata = store.get_storer(name).attrs.metadata
+                    except AttributeError:
+                        metadata = None
+                yield (self._select_profile(df, metadata, pressure, variables, qc), 
+                       metadata)
+        finally:
+            if store is not None:
+                store.close()
+
+    def read(self, wmo_list=None, time=None, pressure=None, variables=None,
+             codes=None, max_profiles=None, as_collection=False, memory_limit=None,
+             qc=None):
+        '''Return DataFrame of the profile data in the cache file that match
+        all of the given constraints, like get_float_dataframe() with
+        update_cache=False.  Profiles outside the constraints are excluded 
+        using the manifest, before reading any profile data.
+
+        Args:
+            wmo_list (list): Float WMO numbers, default: all floats
+            time (tuple): (start, end) of profile times, either may be None
+            pressure (tuple): (min, max) of pressures, either may be None
+            variables (list): Columns to return, default: all
+            codes (list): Profile file codes, e.g. ['D'] for delayed mode only
+            max_profiles (int): Maximum number of profiles from each float
+            as_collection (bool): Return a ProfileCollection rather than a
+                                  DataFrame, these are not kept in the frame
+                                  cache
+            memory_limit (int): Bytes of data to hold in memory, a result 
+                                that is larger is returned as a SpilledFrame
+                                to be read in chunks of whole floats
+            qc (dict): Accepted QC flags of variables, e.g. 
+                       {'DOXY_ADJUSTED': [1, 2]}, only the rows whose flags
+                       are all accepted are returned; needs profiles saved
+                       with qc_accept set
+        '''
+        if memory_limit is not None and not as_collection:
+            if variables is None:
+                columns = self._profile_columns(wmo_list, time, pressure, codes,
+                                                max_profiles)
+            else:
+                columns = list(variables)
+            return self._spill_frames(self.iter_floats(wmo_list, time, 
+                                      pressure, variables, codes, max_profiles,
+                                      qc), memory_limit, columns)
+
+        if self._shards:
+            results = [s.read(wmos, time, pressure, variables, codes,
+                              max_profiles, as_collection, qc=qc) 
+                       for s, wmos in self._shard_runs(wmo_list)]
+            return self._concat_results(results, as_collection)
+
+        if as_collection:
+            df = self._query_manifest(wmo_list, time, pressure, codes, max_profiles)
+            return self._profiles_to_collection(list(self._read_profiles(
+                                                df['name'], pressure, variables,
+                                                qc)))
+
+        if self._frame_cache is None or wmo_list is None:
+            return self._read_frame(wmo_list, time, pressure, variables, codes,
+                                    max_profiles, qc)
+
+        # Cache DataFrames by float, return copies so that callers may modify them
+        query = (None if time is None else tuple(time),
+                 None if pressure is None else tuple(pressure),
+                 None if variables is None else tuple(variables),
+                 None if codes is None else tuple(codes), max_profiles, self.compact,
+                 None if qc is None else tuple(sorted((v, tuple(a)) 
+                                                      for v, a in qc.items())))
+        dfs = []
+        for wmo in wmo_list:
+            key = (str(wmo),) + query
+            try:
+                df = self._frame_cache.get(key)
+            except KeyError:
+                df = self._read_frame([wmo], time, pressure, variables, codes, 
+                                      max_profiles, qc)
+                self._frame_cache.put(key, df)
+            dfs.append(df)
+
+        if len(dfs) == 1:
+            return dfs[0].copy()
+
+        return pd.concat(dfs)
+
+    def iter_floats(self, wmo_list=None, time=None, pressure=None, variables=None,
+                    codes=None, max_profiles=None, qc=None, as_collection=False):
+        '''Generate a DataFrame, or with as_collection a ProfileCollection,
+        of each float's data that read() would return so that all the data
+        in the cache file can be processed, e.g. by converters.to_netcdf(),
+        a float at a time.
+        '''
+        if self._shards:
+            for shard, wmos in self._shard_runs(wmo_list):
+                for data in shard.iter_floats(wmos, time, pressure, variables,
+                                              codes, max_profiles, qc, as_collection):
+                    yield data
+            return
+
+        df = self._query_manifest(wmo_list, time, pressure, codes, max_profiles)
+        to_data = self._profiles_to_collection if as_collection else self._profiles_to_frame
+        for _, names in df.groupby('wmo', sort=False)['name']:
+            data = to_data(list(self._read_profiles(names, pressure, variables, qc)))
+            if len(data):
+                yield data
+
+    def _profile_columns(self, wmo_list=None, time=None, pressure=None,
+                         codes=None, max_profiles=None):
+        '''Return list of the columns of all the profiles that read() would
+        return, read from the profiles without their data.
+        '''
+        columns = []
+        if self._shards:
+            for shard in self._shards:
+                columns.extend(c for c in shard._profile_columns(wmo_list, time,
+                               pressure, codes, max_profiles) if c not in columns)
+            return columns
+
+        df = self._query_manifest(wmo_list, time, pressure, codes, max_profiles)
+        with pd.HDFStore(self.cache_file, mode='r') as store:
+            for name in df['name']:
+                if self._writer is not None and name in self._writer:
+                    labels = self._writer.get(name)[0].columns
+                else:
+                    labels = store.get_storer(name).read_index('axis0')
+                columns.extend(c for c in labels 
+                               if c != 'pressure' and c not in columns)
+
+        return columns
+
+    def _spill_frames(self, frames, memory_limit, columns):
+        '''Return DataFrame of frames concatenated if it's smaller than 
+        memory_limit bytes, otherwise a SpilledFrame of them with columns,
+        the columns of all the frames.
+        '''
+        dfs = []
+        nbytes = 0
+        spilled = None
+        for df in frames:
+            if spilled is not None:
+                spilled.append(self._qc_columns(df.reindex(columns=columns)))
+                continue
+            dfs.append(df)
+            nbytes += df.memory_usage(index=True).sum()
+            if nbytes > memory_limit:
+                self.logger.info('Spilling data over memory_limit of %s bytes '
+                                 'to a temporary file', memory_limit)
+                spilled = SpilledFrame(memory_limit, columns=columns)
+                for d in dfs:
+                    spilled.append(self._qc_columns(d.reindex(columns=columns)))
+                dfs = None
+
+        if spilled is not None:
+            return spilled
+        if not dfs:
+            return pd.DataFrame()
+
+        return pd.concat(dfs)
+
+    def _read_frame(self, wmo_list=None, time=None, pressure=None, variables=None,
+                    codes=None, max_profiles=None, qc=None):
+        '''Return DataFrame for read() from the cache file.
+        '''
+        df = self._query_manifest(wmo_list, time, pressure, codes, max_profiles)
+        self.logger.debug('Reading %s profiles from %s', len(df), self.cache_file)
+
+        return self._profiles_to_frame(list(self._read_profiles(df['name'], 
+                                                     pressure, variables, qc)))
+
+    def iter_read(self, wmo_list=None, time=None, pressure=None, variables=None,
+                  codes=None, max_profiles=None, qc=None):
+        '''Generate a DataFrame for each profile that read() would return
+        so that the data can be processed without holding all of it in 
+        memory.
+        '''
+        if self._shards:
+            for shard, wmos in self._shard_runs(wmo_list):
+                for df in shard.iter_read(wmos, time, pressure, variables,
+                                          codes, max_profiles, qc):
+                    yield df
+            return
+
+        df = self._query_manifest(wmo_list, time, pressure, codes, max_profiles)
+        for profile in self._read_profiles(df['name'], pressure, variables, qc):
+            df = self._profiles_to_frame([profile])
+            if not df.empty:
+                yield df
 
     def get_float_dataframe(self, wmo_list, max_profiles=None, max_pressure=None,
                                   append_df=True, update_delayed_mode=False,
-                                  update_cache=True):
+                                  update_cache=True, as_collection=False,
+                                  memory_limit=None):
         '''Returns Pandas DataFrame for all the profile data from wmo_list.
         Uses cached data if present, populates cache if not present.  If 
         max_profiles limits the number of profiles returned per float,
@@ -620,66 +1878,146 @@ class ArgoData(object):
         to True to reload into the cache updated delayed mode data.  If
         update_cache is True then each DAC will be queried for new profile
         data, which can take some time; for reading just data from the cache
-        set update_cache=False.
+        set update_cache=False.  See read() for more ways to select the data
+        to read from the cache.  Set as_collection to True to get the data 
+        as a ProfileCollection rather than a DataFrame.  Set memory_limit to
+        the bytes of data to hold in memory, a larger result is returned as
+        a SpilledFrame whose chunks can be processed with the calibrate 
+        *_chunked() functions.
         '''
+        if memory_limit is not None and not as_collection:
+            if update_cache and not self._shards:
+                self.get_float_dataframe(wmo_list, max_profiles, max_pressure, 
+                                         append_df=False, 
+                                         update_delayed_mode=update_delayed_mode)
+            max_profiles = self._validate_cache_file_parm('profiles', max_profiles)
+            pressure = (None, max_pressure) if max_pressure is not None else None
+            return self.read(wmo_list, pressure=pressure, max_profiles=max_profiles,
+                             memory_limit=memory_limit)
+
+        if self._shards:
+            if update_cache:
+                self.logger.warn('Cannot update federated cache %s, reading '
+                                 'from its shards', self.cache_file)
+            results = [s.get_float_dataframe(wmos, max_profiles, max_pressure, 
+                                             append_df, update_cache=False,
+                                             as_collection=as_collection)
+                       for s, wmos in self._shard_runs(wmo_list)]
+            return self._concat_results(results, as_collection)
+
         if update_cache:
             df = self._get_data_from_argo(wmo_list, max_profiles, max_pressure,
-                                          append_df, update_delayed_mode)
+                                          append_df, update_delayed_mode,
+                                          as_collection)
         else:
-            wmo_df = self.get_profile_metadata(flush=False)
-            df = self._get_data_from_cache(wmo_list, wmo_df, max_profiles)
+            df = self._get_data_from_cache(wmo_list, max_profiles, max_pressure,
+                                           as_collection)
 
         return df
 
-    def _build_profile_metadata_df(self, wmo_dict):
-        '''Read metadata from .hdf file to return a DataFrame of the metadata
-        for each profile name in wmo_dict.
+    def _manifest_record(self, store, name, df=None, metadata=None):
+        '''Return manifest row for profile df with metadata just written to
+        name in the open store, the row marks name removed if df is None.
         '''
-        profiles = []
-        url_hash = {}
-        Profile = namedtuple('profile', 'wmo name url code dateloaded')
-        with pd.HDFStore(self.cache_file, mode='r+') as f:
-            self.logger.debug('Building wmo_df by scanning %s', self.cache_file)
-            for name, wmo in wmo_dict.iteritems():
-                m = f.get_storer(name).attrs.metadata
-                _, code = self._float_profile_key(m['url'])
-                profiles.append(Profile(wmo, name, m['url'], code, m['dateloaded']))
-                url_hash[m['url']] = Profile(wmo, name, m['url'], code, m['dateloaded'])
+        url = metadata['url'] if metadata else ''
+        try:
+            _, code = self._float_profile_key(url)
+        except AttributeError:
+            code = ''
+        nbytes = 0
+        if df is not None:
+            for leaf in store.get_node(name)._f_walknodes('Leaf'):
+                try:
+                    nbytes += leaf.size_on_disk
+                except NotImplementedError:
+                    # PyTables can't size the VLArrays used for object arrays
+                    pass
+        dateloaded = (metadata or {}).get('dateloaded') or datetime.utcnow()
 
-        # Sort profiles in code order: D, MR, and the rest
-        sorted_profiles = []
-        for url in self._sort_opendap_urls(url_hash.keys()):
-            sorted_profiles.append(url_hash[url])
+        # Profile location, time and pressure range for queries by read()
+        time, lon, lat, pmin, pmax = pd.NaT, np.nan, np.nan, np.nan, np.nan
+        if df is not None and not self._data_rows(df).empty:
+            (_, time, lon, lat, _), pressures = self._profile_coords(df, metadata)
+            pmin, pmax = np.nanmin(pressures), np.nanmax(pressures)
 
-        df = pd.DataFrame.from_records(sorted_profiles, columns=profiles[0]._fields)
+        return (name.split('/')[1].split('_')[1], name, url, code, dateloaded,
+                time, lon, lat, pmin, pmax,
+                0 if df is None else len(self._data_rows(df)), nbytes, df is None)
 
-        return df
+    def _append_manifest(self, store, manifest_df):
+        '''Append rows to the manifest table in the open store.
+        '''
+        store.append(self._MANIFEST, manifest_df, format='table',
+                     data_columns=['wmo', 'key', 'code'],
+                     min_itemsize=dict(wmo=16, key=32, url=256, code=8))
+
+    def _scan_profile_manifest(self):
+        '''Return manifest DataFrame built by reading the metadata and data of
+        every profile in the cache file.  This is the slow repair path for
+        the manifest that is otherwise appended to as profiles are written.
+        '''
+        records = []
+        with pd.HDFStore(self.cache_file, mode='r') as store:
+            self.logger.info('Building %s by scanning %s', self._MANIFEST,
+                                                           self.cache_file)
+            for name in sorted(store.keys()):
+                if name.startswith('/WMO'):
+                    metadata = store.get_storer(name).attrs.metadata
+                    records.append(self._manifest_record(store, name, 
+                                                         store[name], metadata))
+
+        return pd.DataFrame.from_records(records, columns=self._manifest_columns)
 
     def get_profile_metadata(self, flush=False):
-        '''Return DataFrame of all profile metadata in the cache file
+        '''Return DataFrame of all profile metadata in the cache file read
+        from its manifest table.  Set flush to True to rebuild the manifest
+        by scanning all the profiles in the cache file.
         '''
-        if flush:
+        if self._shards:
+            dfs = []
+            for shard in self._shards:
+                df = shard.get_profile_metadata(flush)
+                df['cache_file'] = shard.cache_file
+                dfs.append(df)
+            return pd.concat(dfs, ignore_index=True)
+
+        manifest_df = None
+        if not flush and self._has_lookup_tables():
             try:
-                with pd.HDFStore(self.cache_file, mode='r+') as s:
-                    s.remove(self._ALL_WMO_DF)
-            except KeyError:
+                with pd.HDFStore(self.cache_file, mode='r') as s:
+                    if '/' + self._MANIFEST in s:
+                        manifest_df = s.select(self._MANIFEST)
+                        self.logger.debug('Read %s from cache', self._MANIFEST)
+                        if set(self._manifest_columns) - set(manifest_df.columns):
+                            self.logger.info('Rebuilding %s written by an '
+                                             'earlier version', self._MANIFEST)
+                            manifest_df = None
+                    elif '/' + self._LOOKUP_TABLES in s:
+                        manifest_df = pd.DataFrame(columns=self._manifest_columns)
+            except IOError:
                 pass
-        try:
-            with pd.HDFStore(self.cache_file, mode='r+') as s:
-                wmo_df = s[self._ALL_WMO_DF]
-                self.logger.debug('Read %s from cache', self._ALL_WMO_DF)
-        except (KeyError, TypeError):
-            self.logger.debug('Building float_dict by scanning %s', self.cache_file)
-            with pd.HDFStore(self.cache_file, mode='r+') as f:
-                float_dict = {g: g.split('/')[1].split('_')[1]
-                              for g in sorted(f.keys()) if g.startswith('/WMO')}
-
-            wmo_df = self._build_profile_metadata_df(float_dict)
-            self.logger.info('Putting %s into cache', self._ALL_WMO_DF)
-            with pd.HDFStore(self.cache_file, mode='r+') as s:
-                s.put(self._ALL_WMO_DF, wmo_df, format='fixed')
-
-        return wmo_df
+
+        if manifest_df is None:
+            manifest_df = self._scan_profile_manifest()
+            if self._snapshot is None:
+                self.logger.info('Putting %s into cache', self._MANIFEST)
+                with pd.HDFStore(self.cache_file, mode='a') as s:
+                    for name in (self._MANIFEST, self._ALL_WMO_DF):
+                        if '/' + name in s:
+                            s.remove(name)
+                    if not manifest_df.empty:
+                        self._append_manifest(s, manifest_df)
+
+        # The last manifest row for a profile is its current state
+        df = manifest_df.drop_duplicates('key', keep='last')
+        df = df[~df['removed'].astype(bool)].set_index('url')
+
+        # Sort profiles in code order: D, MR, and the rest
+        df = df.loc[self._sort_opendap_urls(df.index.tolist())].reset_index()
+
+        return df.rename(columns=dict(key='name')).loc[:, ['wmo', 'name', 
+                         'url', 'code', 'dateloaded', 'time', 'lon', 'lat',
+                         'pmin', 'pmax', 'nrows', 'nbytes']]
 
     def get_cache_file_all_wmo_list(self, flush=False):
         '''Return wmo numbers of all the floats in the cache file.  Has side
@@ -689,53 +2027,841 @@ class ArgoData(object):
 
         return wmo_df['wmo'].unique().tolist()
 
-    def get_cache_file_oxy_count_df(self, max_profiles=None, flush=False):
-        '''Return DataFrame of profile and measurment counts for each float
-        that contains oxygen data in the cache file.  Limit loading additional 
-        profiles by setting max_profiles.
+    def _profile_counts_df(self, name, df=None):
+        '''Return DataFrame of the number of valid values of each bio_list
+        variable in profile df saved to name; counts are 0 if df is None.
+        '''
+        counts = [0 if df is None or v not in df else int(df[v].count())
+                  for v in self._bio_list]
+
+        return pd.DataFrame(dict(key=name, wmo=name.split('/')[1].split('_')[1],
+                                 variable=list(self._bio_list), count=counts),
+                            columns=['key', 'wmo', 'variable', 'count'])
+
+    def _summarize_counts(self, profile_counts_df):
+        '''Return DataFrame of profile and measurement counts by float and
+        variable from the per profile counts, the last row for a key wins.
+        '''
+        df = profile_counts_df.drop_duplicates(['key', 'variable'], keep='last')
+        df = df.assign(profile=(df['count'] > 0).astype(int))
+        grouped = df.groupby(['wmo', 'variable'])
+        fc_df = pd.DataFrame(dict(num_profiles=grouped['profile'].sum(),
+                                  num_measurements=grouped['count'].sum()))
+
+        return fc_df.reset_index().reindex(columns=['wmo', 'variable', 
+                                            'num_profiles', 'num_measurements'])
+
+    def _append_profile_counts(self, store, counts_df):
+        '''Append per profile counts to the cache file and recompute the 
+        float counts summary for the floats in counts_df.
+        '''
+        store.append(self._PROFILE_COUNTS, counts_df, format='table',
+                     data_columns=['key', 'wmo', 'variable'],
+                     min_itemsize=dict(key=32, wmo=16, variable=32))
+
+        wmos = [str(w) for w in counts_df['wmo'].unique()]
+        fc_df = self._summarize_counts(store.select(self._PROFILE_COUNTS, 
+                                       where='wmo={}'.format(wmos)))
+        old_fc_df = store[self._FLOAT_COUNTS]
+        fc_df = pd.concat([old_fc_df[~old_fc_df['wmo'].isin(wmos)], fc_df],
+                          ignore_index=True)
+        store.put(self._FLOAT_COUNTS, fc_df, format='fixed')
+
+    def _scan_profile_counts(self):
+        '''Return DataFrame of per profile counts built by reading every
+        profile in the cache file.
+        '''
+        dfs = []
+        with pd.HDFStore(self.cache_file, mode='r') as store:
+            self.logger.info('Counting measurements by scanning %s', self.cache_file)
+            for name in sorted(store.keys()):
+                if name.startswith('/WMO'):
+                    dfs.append(self._profile_counts_df(name, 
+                                                       self._data_rows(store[name])))
+
+        if not dfs:
+            dfs.append(self._profile_counts_df('/WMO_0/P0').iloc[0:0])
+
+        return pd.concat(dfs, ignore_index=True)
+
+    def _init_profile_tables(self):
+        '''Make sure the lookup tables that _write_profiles() maintains
+        exist before adding profiles to the cache file.  The lookup_tables
+        node marks a cache file whose tables are maintained on write.
+        '''
+        self._check_writable()
+        if self.standard_levels is not None:
+            self._init_standard_levels()
+
+        with pd.HDFStore(self.cache_file) as store:
+            if '/' + self._LOOKUP_TABLES in store:
+                return
+            has_profiles = any(k.startswith('/WMO') for k in store.keys())
+            if not has_profiles:
+                self._mark_lookup_tables(store)
+                return
+
+        self.get_cache_file_count_df(flush=True)
+        self.get_profile_metadata(flush=True)
+        with pd.HDFStore(self.cache_file) as store:
+            self._mark_lookup_tables(store, empty=False)
+
+    def _has_lookup_tables(self):
+        '''Return True if the lookup tables of the cache file are maintained
+        on write, migrating a cache file written without them.  A published
+        generation is not migrated.
         '''
-        oxy_count_df = pd.DataFrame()
-        if flush:
+        try:
+            with pd.HDFStore(self.cache_file, mode='r') as store:
+                if '/' + self._LOOKUP_TABLES in store:
+                    return True
+        except IOError:
+            pass
+        if self._snapshot is not None:
+            return False
+        self._init_profile_tables()
+
+        return True
+
+    def _mark_lookup_tables(self, store, empty=True):
+        '''Put the lookup_tables marker into the open store, and the empty
+        float counts table of a cache file without profiles if empty.
+        '''
+        if empty:
+            store.put(self._FLOAT_COUNTS, self._summarize_counts(
+                      self._profile_counts_df('/WMO_0/P0').iloc[0:0]))
+        store.put(self._LOOKUP_TABLES, pd.Series([self._PROFILE_COUNTS, 
+                  self._FLOAT_COUNTS, self._MANIFEST]))
+
+    def _levels_node(self):
+        '''Return name of the node holding the standard level pressures.
+        '''
+        return '/{}/pressure'.format(self._STANDARD_LEVELS)
+
+    def _level_columns(self, num_levels):
+        '''Return column names for the levels in the standard level tables.
+        '''
+        return ['L{:03d}'.format(i) for i in range(num_levels)]
+
+    def _interpolate_profile(self, pressures, values, levels):
+        '''Return values interpolated linearly to levels, NaN outside the
+        range of the valid values.
+        '''
+        valid = ~(np.isnan(pressures) | np.isnan(values))
+        if not valid.any():
+            return np.nan * np.ones(len(levels))
+        order = np.argsort(pressures[valid])
+
+        return np.interp(levels, pressures[valid][order], values[valid][order],
+                         left=np.nan, right=np.nan)
+
+    def _append_standard_levels(self, store, batch):
+        '''Append a row of values interpolated to the standard levels for
+        each variable of each (name, df, metadata) in batch to the tables 
+        of the open store.  A df of None marks name removed.
+        '''
+        levels = store[self._levels_node()].values
+        nan_levels = (np.nan,) * len(levels)
+        variables = [v for v in store.get_node(self._STANDARD_LEVELS)._v_children
+                     if v != 'pressure']
+        rows = {}
+        for name, df, metadata in batch:
+            wmo = name.split('/')[1].split('_')[1]
+            if df is None or self._data_rows(df).empty:
+                for v in set(variables).union(rows):
+                    rows.setdefault(v, []).append((name, wmo, pd.NaT, np.nan, 
+                                                   np.nan, 0, True) + nan_levels)
+                continue
+            (_, time, lon, lat, profile), pressures = self._profile_coords(df, metadata)
+            pressures = pressures.astype(np.float64)
+            for v in df.columns:
+                if v == 'pressure' or v.endswith(self._qc_suffix):
+                    continue
+                rows.setdefault(v, []).append((name, wmo, time, lon, lat, 
+                            profile, False) + tuple(self._interpolate_profile(
+                            pressures, df[v].values.astype(np.float64), levels)))
+
+        columns = ['key', 'wmo', 'time', 'lon', 'lat', 'profile', 'removed'
+                  ] + self._level_columns(len(levels))
+        for v, records in rows.items():
+            self._append_level_rows(store, v, pd.DataFrame.from_records(
+                                              records, columns=columns))
+
+    def _append_level_rows(self, store, variable, levels_df):
+        '''Append rows to the standard levels table of variable in the open
+        store.
+        '''
+        store.append('{}/{}'.format(self._STANDARD_LEVELS, variable), levels_df,
+                     format='table', data_columns=['key', 'wmo'],
+                     min_itemsize=dict(key=32, wmo=16))
+
+    def _init_standard_levels(self):
+        '''Make sure the cache file has standard level tables for 
+        self.standard_levels, building them from all the profiles if needed.
+        '''
+        levels = np.asarray(self.standard_levels, dtype=np.float64)
+        with pd.HDFStore(self.cache_file) as store:
+            if self._levels_node() in store:
+                if np.array_equal(store[self._levels_node()].values, levels):
+                    return
+                self.logger.info('Rebuilding %s for new levels', self._STANDARD_LEVELS)
+                store.remove(self._STANDARD_LEVELS)
+
+            self.logger.info('Interpolating profiles in %s to %s', 
+                             self.cache_file, self._STANDARD_LEVELS)
+            store.put(self._levels_node(), pd.Series(levels))
+            batch = []
+            for name in sorted(store.keys()):
+                if name.startswith('/WMO'):
+                    try:
+                        metadata = store.get_storer(name).attrs.metadata
+                    except AttributeError:
+                        metadata = None
+                    batch.append((name, store[name], metadata))
+                if len(batch) >= self._batch_parms['max_profiles']:
+                    self._append_standard_levels(store, batch)
+                    batch = []
+            if batch:
+                self._append_standard_levels(store, batch)
+
+    def get_standard_levels(self, variable, wmo_list=None):
+        '''Return DataFrame of variable interpolated to the standard levels
+        with a row for each profile indexed by wmo, time, lon, lat and profile
+        and a column for each level pressure.  The cache file must have been
+        written with standard_levels set.
+        '''
+        if self._shards:
+            return pd.concat([s.get_standard_levels(variable, wmo_list) 
+                              for s in self._shards])
+
+        name = '{}/{}'.format(self._STANDARD_LEVELS, variable)
+        with pd.HDFStore(self.cache_file, mode='r') as store:
+            if self._levels_node() not in store:
+                raise KeyError('No {} in {}'.format(self._STANDARD_LEVELS, 
+                                                    self.cache_file))
+            levels = store[self._levels_node()].values
+            if '/' + name not in store:
+                return pd.DataFrame(columns=levels)
+            if wmo_list is None:
+                df = store.select(name)
+            else:
+                df = store.select(name, where='wmo={}'.format(
+                                  [str(w) for w in wmo_list]))
+
+        # The last row for a profile is its current state
+        df = df.drop_duplicates('key', keep='last')
+        df = df[~df['removed'].astype(bool)].set_index(self._index_names[:5])
+        df = df.loc[:, self._level_columns(len(levels))].sort_index()
+        df.columns = levels
+
+        return df
+
+    def _aggregate_versions(self, manifest_df=None):
+        '''Return DataFrame indexed by wmo of the number of manifest rows and
+        the latest dateloaded of each float in manifest_df, by default the
+        manifest of the cache file.  Rows are appended with the current time
+        for every profile written or removed and a rebuilt manifest keeps the
+        dateloaded of the profiles it holds, so a float whose profiles have
+        changed has a different count or latest date.
+        '''
+        df = manifest_df
+        if df is None:
+            with pd.HDFStore(self.cache_file, mode='r') as store:
+                if '/' + self._MANIFEST in store:
+                    df = store.select(self._MANIFEST, columns=['wmo', 'dateloaded'])
+        if df is None:
+            df = self.get_profile_metadata().loc[:, ['wmo', 'dateloaded']]
+
+        grouped = df.groupby(df['wmo'].astype(str))['dateloaded']
+
+        return pd.DataFrame(dict(manifest_rows=grouped.size(), 
+                                 last_loaded=grouped.max()))
+
+    def _aggregate_state(self, store):
+        '''Return DataFrame of the versions of the floats whose aggregates
+        are saved in the open store, empty if none are or if they were saved
+        by an earlier version.
+        '''
+        if '/' + self._AGGREGATE_STATE in store:
+            state = store[self._AGGREGATE_STATE]
+            if set(self._aggregate_state_columns) <= set(state.columns):
+                return state
+
+        return pd.DataFrame(columns=self._aggregate_state_columns)
+
+    def _stale_aggregates(self, max_pressure):
+        '''Return tuple of the sorted list of floats whose saved aggregates
+        for max_pressure are missing or out of date and the 
+        _aggregate_versions() DataFrame they were checked against.
+        '''
+        versions = self._aggregate_versions()
+        with pd.HDFStore(self.cache_file, mode='r') as store:
+            state = self._aggregate_state(store)
+        built = state[state['max_pressure'] == max_pressure]
+        wmos = built['wmo'].astype(str)
+        stale = set(versions.index) - set(wmos[self._up_to_date(built, versions)])
+        stale.update(w for w in wmos if w not in versions.index)
+
+        return sorted(stale), versions
+
+    def _up_to_date(self, state, versions):
+        '''Return boolean array of the rows of aggregate state that match the
+        _aggregate_versions() of their floats.
+        '''
+        saved = versions.reindex(state['wmo'].astype(str))
+
+        return ((saved['manifest_rows'].values == state['manifest_rows'].values) &
+                (saved['last_loaded'].values == state['last_loaded'].values))
+
+    def _compute_aggregates(self, wmo_list, max_pressure):
+        '''Return tuple of the surface mean and monthly mean DataFrames of 
+        the floats in wmo_list with the index reset and a max_pressure 
+        column, computed from the profiles in the cache file.
+        '''
+        from biofloat.calibrate import surface_mean, add_columns_for_groupby, monthly_mean
+        from biofloat.utils import o2sat
+
+        sdfs = []
+        mdfs = []
+        for wmo in wmo_list:
+            df = self._read_frame([wmo], pressure=(None, max_pressure))
+            if df.empty:
+                continue
+            sdf = surface_mean(df, max_pressure)
+            if not sdf.empty:
+                sdf['o2sat'] = 100 * (sdf.DOXY_ADJUSTED / 
+                                      o2sat(sdf.PSAL_ADJUSTED, sdf.TEMP_ADJUSTED))
+                sdfs.append(sdf.reset_index())
+                mdf = monthly_mean(add_columns_for_groupby(sdf.copy()))
+                mdfs.append(mdf.reset_index())
+
+        dfs = []
+        for items in (sdfs, mdfs):
+            df = pd.concat(items, ignore_index=True) if items else pd.DataFrame()
+            df['max_pressure'] = float(max_pressure)
+            dfs.append(df)
+
+        return tuple(dfs)
+
+    def update_aggregates(self, max_pressure=10):
+        '''Recompute the surface mean of each profile and the monthly mean 
+        of each float, as calibrate.surface_mean() and monthly_mean() do, 
+        for the floats whose profiles have changed since they were last 
+        computed for max_pressure and save them in the cache file.  Returns
+        list of the recomputed floats.
+        '''
+        self._check_writable()
+        stale, versions = self._stale_aggregates(max_pressure)
+        if not stale:
+            return stale
+
+        self.logger.info('Computing aggregates for %s floats', len(stale))
+        sdf, mdf = self._compute_aggregates(stale, max_pressure)
+        with pd.HDFStore(self.cache_file) as store:
+            state = self._aggregate_state(store)
+            if state.empty:
+                # Start over from the aggregates of an earlier version
+                for name in (self._SURFACE_MEAN, self._MONTHLY_MEAN):
+                    if '/' + name in store:
+                        store.remove(name)
+            for name, df in ((self._SURFACE_MEAN, sdf), (self._MONTHLY_MEAN, mdf)):
+                if '/' + name in store:
+                    # Keep where clauses short enough for PyTables
+                    for i in range(0, len(stale), 30):
+                        store.remove(name, where=['wmo={}'.format(stale[i:i + 30]),
+                                     'max_pressure={!r}'.format(float(max_pressure))])
+                if not df.empty:
+                    store.append(name, df, format='table', 
+                                 data_columns=['wmo', 'max_pressure'], 
+                                 min_itemsize=dict(wmo=16))
+            state['wmo'] = state['wmo'].astype(str)
+            new_state = versions.loc[[w for w in stale if w in versions.index]]
+            new_state = new_state.rename_axis('wmo').reset_index()
+            new_state['max_pressure'] = max_pressure
+            keep = ~((state['max_pressure'] == max_pressure) & 
+                     state['wmo'].isin(stale))
+            state = pd.concat([state[keep], new_state], ignore_index=True)
+            store.put(self._AGGREGATE_STATE, 
+                      state.loc[:, self._aggregate_state_columns])
+
+        return stale
+
+    def _get_aggregate(self, name, index, wmo_list=None, max_pressure=10):
+        '''Return DataFrame of aggregate name read from the cache file, with
+        the aggregates of floats whose profiles have changed since they were
+        saved computed without writing them.
+        '''
+        if self._shards:
+            return pd.concat([s._get_aggregate(name, index, wmo_list, max_pressure)
+                              for s in self._shards])
+
+        stale, _ = self._stale_aggregates(max_pressure)
+        if wmo_list is not None:
+            wmo_list = [str(w) for w in wmo_list]
+            stale = [w for w in stale if w in wmo_list]
+
+        dfs = []
+        with pd.HDFStore(self.cache_file, mode='r') as store:
+            if '/' + name in store and not self._aggregate_state(store).empty:
+                where = ['max_pressure={!r}'.format(float(max_pressure))]
+                if wmo_list is None:
+                    saved = [store.select(name, where=where)]
+                else:
+                    saved = [store.select(name, where=where +
+                                          ['wmo={}'.format(wmo_list[i:i + 30])])
+                             for i in range(0, len(wmo_list), 30)]
+                dfs.extend(df[~df['wmo'].isin(stale)] for df in saved)
+        if stale:
+            self.logger.debug('Computing aggregates for %s changed floats', 
+                              len(stale))
+            sdf, mdf = self._compute_aggregates(stale, max_pressure)
+            dfs.append(sdf if name == self._SURFACE_MEAN else mdf)
+
+        dfs = [df for df in dfs if not df.empty]
+        if not dfs:
+            return pd.DataFrame()
+
+        df = pd.concat(dfs, ignore_index=True).drop('max_pressure', axis=1)
+
+        return df.set_index(index).sort_index()
+
+    def get_surface_mean(self, wmo_list=None, max_pressure=10):
+        '''Return DataFrame of the mean of each profile's values at pressures
+        less than max_pressure with an o2sat percent saturation column, the
+        same as calibrate.surface_mean() of the float data.  The means saved
+        by update_aggregates() are read from the cache file and those of 
+        floats that have changed since are computed without saving them.
+        '''
+        return self._get_aggregate(self._SURFACE_MEAN, ['wmo', 'time', 'lon', 'lat'],
+                                   wmo_list, max_pressure)
+
+    def get_monthly_mean(self, wmo_list=None, max_pressure=10):
+        '''Return DataFrame of the monthly means of each float's surface 
+        values, the same as calibrate.monthly_mean() of the surface means 
+        with add_columns_for_groupby().  The means saved by 
+        update_aggregates() are read from the cache file and those of floats
+        that have changed since are computed without saving them.
+        '''
+        return self._get_aggregate(self._MONTHLY_MEAN, ['wmo', 'year', 'month'],
+                                   wmo_list, max_pressure)
+
+    def get_cache_file_count_df(self, flush=False):
+        '''Return DataFrame of profile and measurement counts for each float
+        and bio_list variable in the cache file.  The counts are maintained 
+        as profiles are written; set flush to True to rebuild them by reading
+        all the profiles in the cache file.
+        '''
+        if self._shards:
+            return pd.concat([s.get_cache_file_count_df(flush) 
+                              for s in self._shards], ignore_index=True)
+
+        if not flush and self._has_lookup_tables():
             try:
-                with pd.HDFStore(self.cache_file, mode='r+') as s:
-                    s.remove(self._OXY_COUNT_DF)
-            except KeyError:
+                with pd.HDFStore(self.cache_file, mode='r') as s:
+                    fc_df = s[self._FLOAT_COUNTS]
+                    self.logger.debug('Read %s from cache', self._FLOAT_COUNTS)
+                    return fc_df
+            except (IOError, KeyError):
                 pass
-        try:
-            with pd.HDFStore(self.cache_file, mode='r+') as s:
-                oxy_count_df = s[self._OXY_COUNT_DF]
-                self.logger.info('Read %s from cache', self._OXY_COUNT_DF)
-        except KeyError:
-            oxy_hash = {}
-            for wmo in self.get_cache_file_all_wmo_list(flush=False):
-                self.logger.info('Getting %s from cache', wmo)
-                df = self.get_float_dataframe([wmo], max_profiles, update_cache=False)
-                try:
-                    if not df['DOXY_ADJUSTED'].dropna().empty:
-                        odf = df.dropna().xs(wmo, level='wmo')
-                        oxy_hash[wmo] = (
-                                len(odf.index.get_level_values('time').unique()),
-                                len(odf))
-                except (KeyError, AttributeError):
-                    pass
-                try:
-                    if not df['DOXY'].dropna().empty:
-                        odf = df.dropna().xs(wmo, level='wmo')
-                        oxy_hash[wmo] = (
-                                len(odf.index.get_level_values('time').unique()),
-                                len(odf))
-                except (KeyError, AttributeError):
-                    pass
 
-            num_profiles = pd.Series([v[0] for v in oxy_hash.values()])
-            num_measurements = pd.Series([v[1] for v in oxy_hash.values()])
-            oxy_count_df = pd.DataFrame(dict(wmo = pd.Series(oxy_hash.keys()), 
-                                    num_profiles = num_profiles, 
-                                    num_measurements = num_measurements))
+        pc_df = self._scan_profile_counts()
+        fc_df = self._summarize_counts(pc_df)
+        if self._snapshot is not None:
+            return fc_df
+
+        self.logger.info('Putting %s into cache', self._FLOAT_COUNTS)
+        with pd.HDFStore(self.cache_file) as s:
+            if '/' + self._PROFILE_COUNTS in s:
+                s.remove(self._PROFILE_COUNTS)
+            if not pc_df.empty:
+                s.append(self._PROFILE_COUNTS, pc_df, format='table',
+                         data_columns=['key', 'wmo', 'variable'],
+                         min_itemsize=dict(key=32, wmo=16, variable=32))
+            s.put(self._FLOAT_COUNTS, fc_df, format='fixed')
+
+        return fc_df
+
+    def verify_cache_file_count_df(self):
+        '''Return DataFrame of the floats and variables whose maintained
+        counts differ from counts recomputed from all the profiles in the 
+        cache file.  An empty DataFrame means the counts are correct.
+        '''
+        if self._shards:
+            return pd.concat([s.verify_cache_file_count_df() 
+                              for s in self._shards], ignore_index=True)
+
+        df = pd.merge(self.get_cache_file_count_df(),
+                      self._summarize_counts(self._scan_profile_counts()),
+                      on=['wmo', 'variable'], how='outer', 
+                      suffixes=('', '_scanned')).fillna(0)
+        bad = ((df['num_profiles'] != df['num_profiles_scanned']) |
+               (df['num_measurements'] != df['num_measurements_scanned']))
+        if bad.any():
+            self.logger.warn('%s float counts do not match %s', bad.sum(), 
+                                                               self.cache_file)
+
+        return df[bad]
+
+    def get_cache_file_oxy_count_df(self, max_profiles=None, flush=False):
+        '''Return DataFrame of profile and measurment counts for each float
+        that contains oxygen data in the cache file.  The counts are read from
+        get_cache_file_count_df(); max_profiles is ignored and retained for
+        backwards compatibility.
+        '''
+        df = self.get_cache_file_count_df(flush)
+        oxy_vars = [v for v in self._oxygen_variables if v in df['variable'].values]
+        if oxy_vars:
+            df = df[(df['variable'] == oxy_vars[0]) & (df['num_profiles'] > 0)]
+        else:
+            df = df.iloc[0:0]
+
+        return df.loc[:, ['wmo', 'num_profiles', 'num_measurements']
+                     ].reset_index(drop=True)
 
-            self.logger.info('Putting %s into cache', self._OXY_COUNT_DF)
-            with pd.HDFStore(self.cache_file, mode='r+') as s:
-                s.put(self._OXY_COUNT_DF, oxy_count_df, format='fixed')
+    def _changelog_df(self, names, actions):
+        '''Return DataFrame of changelog rows recording actions on the
+        profiles in names during the current load run.
+        '''
+        now = datetime.utcnow()
+        return pd.DataFrame({'key': [str(n) for n in names], 'action': actions,
+                             'time': now, 'run': self._run_time or now},
+                            columns=self._changelog_columns)
+
+    def _append_changelog(self, store, changelog_df):
+        '''Append rows to the changelog table in the open store.
+        '''
+        store.append(self._CHANGELOG, changelog_df, format='table',
+                     data_columns=['key', 'time'],
+                     min_itemsize=dict(key=32, action=16))
+
+    def get_changelog(self, since=None):
+        '''Return DataFrame of the profiles added, replaced or removed after
+        datetime since, with the time of the change and the start time of 
+        the load run that made it.  Changes are recorded once a cache file
+        has lookup tables, as load_biofloat_cache.py builds.
+        '''
+        with pd.HDFStore(self.cache_file, mode='r') as store:
+            if '/' + self._CHANGELOG not in store:
+                return pd.DataFrame(columns=self._changelog_columns)
+            if since is None:
+                df = store.select(self._CHANGELOG)
+            else:
+                df = store.select(self._CHANGELOG, where='time > since')
+
+        return df.reset_index(drop=True)
+
+    def _delta_state(self, store):
+        '''Return datetime that the contents of the cache file in the open
+        store were last exported or patched to, None if never.
+        '''
+        if '/' + self._DELTA_STATE not in store:
+            return None
+
+        return store[self._DELTA_STATE]['until'].iloc[0]
+
+    def export_delta(self, delta_file, since=None):
+        '''Write to delta_file the profiles changed in the cache file after
+        datetime since, by default since the previous export_delta().  
+        The delta holds the current data of the added and replaced profiles,
+        the names of the removed ones and the new tombstones so that 
+        apply_delta() can bring a copy of the cache file up to date without
+        transferring all of it.  Returns the number of profiles changed.
+        '''
+        self._check_writable()
+        until = datetime.utcnow()
+        with pd.HDFStore(self.cache_file) as store:
+            if since is None:
+                since = self._delta_state(store)
+            if '/' + self._CHANGELOG not in store:
+                changes = pd.DataFrame(columns=self._changelog_columns)
+            elif since is None:
+                changes = store.select(self._CHANGELOG)
+            else:
+                changes = store.select(self._CHANGELOG, where='time > since')
+            tombstones = pd.DataFrame(columns=self._tombstone_columns)
+            if '/' + self._TOMBSTONES in store:
+                tombstones = store.select(self._TOMBSTONES)
+                if since is not None:
+                    tombstones = tombstones[tombstones['dateloaded'] > since]
+
+            # The last change to each profile is its state in the delta
+            changes = changes.drop_duplicates('key', keep='last')
+            removed = changes[changes['action'] == self._REMOVED]['key']
+            self.logger.info('Exporting %s changed profiles since %s to %s',
+                             len(changes), since, delta_file)
+            with pd.HDFStore(delta_file, mode='w', **self._compparms) as delta:
+                for name in changes['key'][changes['action'] != self._REMOVED]:
+                    try:
+                        metadata = store.get_storer(name).attrs.metadata
+                    except AttributeError:
+                        metadata = None
+                    self._write_df(delta, store[name], name, metadata)
+                delta.put(self._DELTA_REMOVED, pd.DataFrame({'key': removed.values}),
+                          format='fixed')
+                if not tombstones.empty:
+                    self._append_tombstones(delta, tombstones)
+                delta.put(self._DELTA_STATE, pd.DataFrame({'until': [until],
+                                     'since': [pd.Timestamp(since) if since else pd.NaT]}))
+
+            store.put(self._DELTA_STATE, pd.DataFrame({'until': [until]}))
+
+        return len(changes)
+
+    def apply_delta(self, delta_file, force=False, batch_profiles=100):
+        '''Patch the cache file with delta_file written by export_delta() 
+        from a newer copy of it.  The lookup tables are updated as if the 
+        profiles had been loaded here.  Raises ValueError if the delta starts
+        after the last export or delta that the cache file is up to date 
+        with, or if the cache file is already up to date with all of it, 
+        unless force is True.  Returns the number of profiles changed.
+        '''
+        self._check_writable()
+        self._init_profile_tables()
+        with pd.HDFStore(delta_file, mode='r') as delta, \
+                pd.HDFStore(self.cache_file) as store:
+            info = delta[self._DELTA_STATE]
+            since, until = info['since'].iloc[0], info['until'].iloc[0]
+            current = self._delta_state(store)
+            if not force and pd.notnull(since) and (current is None or current < since):
+                raise ValueError('Delta {} starts at {}, cache file {} is up to '
+                                 'date to {}'.format(delta_file, since, 
+                                                     self.cache_file, current))
+            if not force and current is not None and until <= current:
+                raise ValueError('Delta {} ends at {}, cache file {} is already '
+                                 'up to date to {}'.format(delta_file, until,
+                                                     self.cache_file, current))
+
+            removed = delta[self._DELTA_REMOVED]['key']
+            for name in removed:
+                if name in store:
+                    self._delete_df(store, name)
+
+            names = [n for n in delta.keys() if n.startswith('/WMO')]
+            for i in range(0, len(names), batch_profiles):
+                batch = []
+                for name in names[i:i + batch_profiles]:
+                    try:
+                        metadata = delta.get_storer(name).attrs.metadata
+                    except AttributeError:
+                        metadata = None
+                    batch.append((name, delta[name], metadata))
+                self._write_profiles(store, batch)
+
+            if '/' + self._TOMBSTONES in delta:
+                self._append_tombstones(store, delta.select(self._TOMBSTONES))
+            if current is None or until > current:
+                store.put(self._DELTA_STATE, pd.DataFrame({'until': [until]}))
+
+        self.logger.info('Applied %s changed profiles from %s', 
+                         len(names) + len(removed), delta_file)
+
+        return len(names) + len(removed)
+
+    def merge_cache_files(self, shard_files):
+        '''Copy the profile data from shard_files (a list, directory, or glob 
+        pattern of cache files) into this object's cache_file to produce a
+        single file for publishing.  The profile metadata and oxygen count
+        lookups, and the standard levels if standard_levels is set, are 
+        rebuilt for the merged file.
+        '''
+        self._check_writable()
+        if not isinstance(shard_files, (list, tuple)):
+            shard_files = self._get_shard_files(shard_files)
+        self.clear_frame_cache()
+        self._indexes = {}
+
+        with pd.HDFStore(self.cache_file) as out:
+            for shard_file in shard_files:
+                self.logger.info('Merging %s into %s', shard_file, self.cache_file)
+                with pd.HDFStore(shard_file, mode='r') as shard:
+                    for name in shard.keys():
+                        if not name.startswith('/WMO') and name in out:
+                            continue
+                        if name == '/' + self._TOMBSTONES:
+                            self._append_tombstones(out, shard.select(name))
+                            continue
+                        if name == '/' + self._CHANGELOG:
+                            self._append_changelog(out, shard.select(name))
+                            continue
+                        if name == '/' + self._DELTA_STATE:
+                            continue
+                        if name in self._lookup_names():
+                            continue
+                        if name.startswith('/' + self._STANDARD_LEVELS + '/'):
+                            continue
+                        self.logger.debug('Copying %s', name)
+                        out.put(name, shard[name], format='fixed')
+                        try:
+                            out.get_storer(name).attrs.metadata = (
+                                    shard.get_storer(name).attrs.metadata)
+                        except AttributeError:
+                            pass
+
+        self._init_profile_tables()
+
+    def _lookup_names(self):
+        '''Return names of the nodes derived from the profiles in a cache file.
+        '''
+        return ['/' + n for n in (self._ALL_WMO_DF, self._OXY_COUNT_DF, 
+                                  self._PROFILE_COUNTS, self._FLOAT_COUNTS,
+                                  self._MANIFEST, self._LOOKUP_TABLES,
+                                  self._SURFACE_MEAN, self._MONTHLY_MEAN,
+                                  self._AGGREGATE_STATE)]
+
+    def _append_only_tables(self, store):
+        '''Return names of the append only tables in the open store.
+        '''
+        names = [self._MANIFEST, self._TOMBSTONES, self._PROFILE_COUNTS]
+        if self._levels_node() in store:
+            names.extend('{}/{}'.format(self._STANDARD_LEVELS, v) for v in 
+                         store.get_node(self._STANDARD_LEVELS)._v_children
+                         if v != 'pressure')
+
+        return ['/' + n for n in names if '/' + n in store]
+
+    def _current_rows(self, name, df):
+        '''Return the rows of append only table name that hold the current
+        state of the cache file.
+        '''
+        if name == '/' + self._PROFILE_COUNTS:
+            return df.drop_duplicates(['key', 'variable'], keep='last')
+
+        df = df.drop_duplicates('key', keep='last')
+        if name == '/' + self._TOMBSTONES:
+            return df[~df['cleared'].astype(bool)]
+
+        return df[~df['removed'].astype(bool)]
+
+    def _repack_leaf(self, dst, leaf, filters, chunk_rows=None):
+        '''Copy leaf into the open PyTables File dst with filters.  The
+        uncompressed arrays that fixed format DataFrames are saved in are 
+        written as chunked arrays so that they can be compressed.
+        '''
+        import tables
+
+        parent = dst.get_node(leaf._v_parent._v_pathname)
+        chunkshape = None
+        if chunk_rows and leaf.ndim and leaf.shape[0]:
+            chunkshape = (min(chunk_rows, leaf.shape[0]),) + tuple(leaf.shape[1:])
+
+        if (type(leaf) is tables.Array and leaf.ndim and 0 not in leaf.shape
+                and leaf.size_in_memory >= self._min_compress_bytes):
+            new_leaf = dst.create_carray(parent, leaf.name, obj=leaf.read(), 
+                                         filters=filters, chunkshape=chunkshape)
+            leaf._v_attrs._f_copy(new_leaf)
+        elif leaf.chunkshape is not None:
+            if chunkshape is not None:
+                chunkshape = chunkshape[:len(leaf.chunkshape)]
+            leaf.copy(parent, leaf.name, filters=filters, chunkshape=chunkshape)
+        else:
+            leaf.copy(parent, leaf.name)
+
+    def _repack_nodes(self, src, dst, filters, chunk_rows, skip):
+        '''Copy the groups and leaves of open PyTables File src, except for
+        those with paths for which skip(path) is True, into dst.
+        '''
+        src.root._v_attrs._f_copy(dst.root)
+        for group in src.walk_groups('/'):
+            if group._v_pathname == '/' or skip(group._v_pathname):
+                continue
+            if group._v_pathname not in dst:
+                new_group = dst.create_group(group._v_parent._v_pathname, 
+                                             group._v_name)
+                group._v_attrs._f_copy(new_group)
+        for leaf in src.walk_nodes('/', 'Leaf'):
+            if not skip(leaf._v_pathname):
+                self._repack_leaf(dst, leaf, filters, chunk_rows)
+
+    def _repack_aggregate_state(self, src, dst, manifest_df):
+        '''Put the aggregate state of the open store src into dst with the 
+        versions of the floats in manifest_df, the current rows of the 
+        manifest kept by repack().  The state of floats whose aggregates are
+        out of date is dropped so that they are recomputed.
+        '''
+        state = self._aggregate_state(src)
+        if state.empty:
+            return
+
+        state = state[self._up_to_date(state, self._aggregate_versions(
+                      src.select(self._MANIFEST, columns=['wmo', 'dateloaded'])))]
+        versions = self._aggregate_versions(manifest_df).reindex(
+                                            state['wmo'].astype(str))
+        state = state.assign(manifest_rows=versions['manifest_rows'].values,
+                             last_loaded=versions['last_loaded'].values)
+        state = state.dropna(subset=['manifest_rows'])
+        if not state.empty:
+            dst.put(self._AGGREGATE_STATE, state.astype(dict(manifest_rows=int)))
+
+    def repack(self, out_file=None, complib=_compparms['complib'], 
+               complevel=_compparms['complevel'], shuffle=True, chunk_rows=None):
+        '''Copy the cache file into a new file with its data compressed and
+        with only the current rows of its append only tables, reclaiming the
+        space left by removed and replaced profiles.  Without out_file the 
+        cache file is replaced with the repacked one.  Returns name of the 
+        repacked file.
+
+        Args:
+            out_file (str): File to write, default: replace the cache file
+            complib (str): PyTables compression library, e.g. 'zlib', 'lzo',
+                           'bzip2', 'blosc', 'blosc:lz4', 'blosc:zstd'
+            complevel (int): Compression level, 0-9
+            shuffle (bool): Apply the shuffle filter before compressing
+            chunk_rows (int): Rows in each chunk of the arrays, default:
+                              chosen by PyTables
+        '''
+        self._check_writable()
+        import tables
+
+        if tables.which_lib_version(complib) is None:
+            raise ValueError('Compression library {} is not available'.format(complib))
+        filters = tables.Filters(complevel=complevel, complib=complib, shuffle=shuffle)
+        if self._writer is not None:
+            self._writer.flush()
+
+        repacked = out_file or self.cache_file + '.repack'
+        self.logger.info('Repacking %s into %s with %s level %s', self.cache_file,
+                         repacked, complib, complevel)
+        # Current rows of the append only tables go through an uncompressed 
+        # file as pandas can't write with all of the PyTables complibs
+        current_file = repacked + '.tables'
+        with pd.HDFStore(self.cache_file, mode='r') as src:
+            append_only = self._append_only_tables(src)
+            replaced = list(append_only)
+            with pd.HDFStore(current_file, mode='w') as dst:
+                for name in append_only:
+                    df = self._current_rows(name, src.select(name))
+                    self.logger.debug('Keeping %s of %s rows of %s', len(df),
+                                      src.get_storer(name).nrows, name)
+                    if name == '/' + self._MANIFEST:
+                        self._repack_aggregate_state(src, dst, df)
+                        replaced.append('/' + self._AGGREGATE_STATE)
+                    if df.empty:
+                        continue
+                    if name == '/' + self._MANIFEST:
+                        self._append_manifest(dst, df)
+                    elif name == '/' + self._TOMBSTONES:
+                        self._append_tombstones(dst, df)
+                    elif name == '/' + self._PROFILE_COUNTS:
+                        dst.append(self._PROFILE_COUNTS, df, format='table',
+                                   data_columns=['key', 'wmo', 'variable'],
+                                   min_itemsize=dict(key=32, wmo=16, variable=32))
+                    else:
+                        self._append_level_rows(dst, name.split('/')[-1], df)
+
+        def skip(path):
+            return any(path == n or path.startswith(n + '/') for n in replaced)
+
+        try:
+            with closing(tables.open_file(repacked, mode='w', filters=filters)) as dst:
+                for in_file, skip_node in ((self.cache_file, skip), 
+                                           (current_file, lambda path: False)):
+                    with closing(tables.open_file(in_file, mode='r')) as src:
+                        self._repack_nodes(src, dst, filters, chunk_rows, skip_node)
+        finally:
+            os.remove(current_file)
 
-        return oxy_count_df
+        if out_file is None:
+            move(repacked, self.cache_file)
+            repacked = self.cache_file
 
+        return repacked
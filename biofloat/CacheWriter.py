@@ -0,0 +1,127 @@
+import time
+import logging
+
+import pandas as pd
+
+class CacheWriter(object):
+    '''Write-behind buffer for profile DataFrames going into the local HDF
+    cache file.  Profiles and their metadata are queued in memory and
+    written in a single HDFStore open/close whenever the queue reaches
+    max_profiles profiles, max_bytes bytes or is older than max_seconds.
+    Anything still queued is written by close() or on leaving a with
+    block; the owner must close the writer, e.g. in a finally clause.
+    The queued profiles are lost if the process is killed, so owners
+    that can be killed flush() at points they can resume from.  A write
+    that fails drops its batch and leaves the writer failed: further
+    puts raise ValueError and close() writes nothing.
+    '''
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, cache_file, write_batch, max_profiles=50,
+                 max_bytes=50000000, max_seconds=60, logger=None):
+        '''Initialize CacheWriter object.
+
+        Args:
+            cache_file (str): HDF file to write to
+            write_batch (func): Called as write_batch(store, batch) with
+                                the open HDFStore and a list of queued
+                                (name, df, metadata) tuples
+            max_profiles (int): Flush after this many profiles are queued
+            max_bytes (int): Flush after this many bytes of DataFrames are queued
+            max_seconds (float): Flush on the next put() this many seconds
+                                 after the oldest profile was queued
+            logger (Logger): Use this logger instead of the module's
+        '''
+        self.cache_file = cache_file
+        self._write_batch = write_batch
+        self.max_profiles = max_profiles
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        if logger:
+            self.logger = logger
+
+        self._queue = []
+        self._pending = {}
+        self._queued_bytes = 0
+        self._queued_time = None
+        self._closed = False
+        self._failed = False
+
+    def __contains__(self, name):
+        return name in self._pending
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def put(self, name, df, metadata=None):
+        '''Queue df with metadata for writing to name in the cache file.
+        '''
+        if self._closed or self._failed:
+            raise ValueError('CacheWriter for {} is {}'.format(self.cache_file,
+                             'closed' if self._closed else 'failed'))
+
+        if name in self._pending:
+            self.remove(name)
+        self._queue.append(name)
+        self._pending[name] = (df, metadata)
+        self._queued_bytes += df.memory_usage(index=True).sum()
+        if self._queued_time is None:
+            self._queued_time = time.time()
+
+        if (len(self._queue) >= self.max_profiles or
+                self._queued_bytes >= self.max_bytes or
+                time.time() - self._queued_time >= self.max_seconds):
+            self.flush()
+
+    def get(self, name):
+        '''Return tuple of queued DataFrame and metadata for name, raises
+        KeyError if name is not queued.
+        '''
+        return self._pending[name]
+
+    def remove(self, name):
+        '''Drop name from the queue if it's there.
+        '''
+        if name in self._pending:
+            df, _ = self._pending.pop(name)
+            self._queue.remove(name)
+            self._queued_bytes -= df.memory_usage(index=True).sum()
+
+    def flush(self):
+        '''Write all queued profiles to the cache file.
+        '''
+        if not self._queue:
+            return
+
+        self.logger.debug('Writing %s profiles (%s bytes) to %s', len(self._queue),
+                          self._queued_bytes, self.cache_file)
+        batch = [(name,) + self._pending[name] for name in self._queue]
+        self._queue = []
+        self._pending = {}
+        self._queued_bytes = 0
+        self._queued_time = None
+        try:
+            with pd.HDFStore(self.cache_file) as store:
+                self._write_batch(store, batch)
+        except:
+            self._failed = True
+            self.logger.error('Dropped %s profiles that could not be written '
+                              'to %s', len(batch), self.cache_file)
+            raise
+
+    def close(self):
+        '''Flush the queue, unless a write has failed, and refuse further
+        puts.
+        '''
+        if not self._closed:
+            self._closed = True
+            if not self._failed:
+                self.flush()
+
@@ -0,0 +1,85 @@
+from collections import OrderedDict
+
+class FrameCache(object):
+    '''Least recently used cache of DataFrames bounded by the bytes that
+    they use.  Entries are keyed by tuples whose first item is the float's
+    wmo so that all the entries of a float can be invalidated together.
+    '''
+
+    def __init__(self, max_bytes=100000000):
+        '''Initialize FrameCache object.
+
+        Args:
+            max_bytes (int): Evict least recently used DataFrames to keep
+                             the total size of the cached DataFrames below this
+        '''
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._frames
+
+    def __len__(self):
+        return len(self._frames)
+
+    def get(self, key):
+        '''Return DataFrame cached for key and make it the most recently
+        used, raises KeyError if key is not cached.
+        '''
+        try:
+            df, nbytes = self._frames.pop(key)
+        except KeyError:
+            self.misses += 1
+            raise
+        self._frames[key] = (df, nbytes)
+        self.hits += 1
+
+        return df
+
+    def put(self, key, df):
+        '''Cache df for key, evicting the least recently used DataFrames
+        if needed.  DataFrames larger than max_bytes are not cached.
+        '''
+        self.remove(key)
+        nbytes = int(df.memory_usage(index=True).sum())
+        if nbytes > self.max_bytes:
+            return
+
+        self._frames[key] = (df, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted) = self._frames.popitem(last=False)
+            self.nbytes -= evicted
+
+    def remove(self, key):
+        '''Drop key from the cache if it's there.
+        '''
+        if key in self._frames:
+            _, nbytes = self._frames.pop(key)
+            self.nbytes -= nbytes
+
+    def invalidate(self, wmos):
+        '''Drop all the cached DataFrames of the floats in wmos.
+        '''
+        wmos = set(wmos)
+        for key in [k for k in self._frames if k[0] in wmos]:
+            self.remove(key)
+
+    def clear(self):
+        '''Drop all the cached DataFrames.
+        '''
+        self._frames.clear()
+        self.nbytes = 0
+
+    def info(self):
+        '''Return dictionary of hits, misses, hit_rate, number of entries,
+        nbytes and max_bytes.
+        '''
+        lookups = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses,
+                    hit_rate=float(self.hits) / lookups if lookups else 0.0,
+                    entries=len(self._frames), nbytes=self.nbytes,
+                    max_bytes=self.max_bytes)
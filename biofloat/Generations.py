@@ -0,0 +1,165 @@
+import os
+import re
+import shutil
+import logging
+
+class Lease(object):
+    '''Shared lock held on a published generation so that Generations.gc()
+    does not remove it while it's being read.  The lock is released by
+    release(), on leaving a with block, or when the process exits.
+    '''
+
+    def __init__(self, path, lock_file):
+        self.path = path
+        self._lock_file = lock_file
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def release(self):
+        '''Release the lock on the generation.
+        '''
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+class Generations(object):
+    '''Directory of immutable cache file generations for readers that need
+    a consistent snapshot while a loader is writing.  The loader builds the
+    next generation in a staging file and publish() makes it current by
+    atomically replacing the CURRENT pointer file.  Readers acquire() a
+    lease on the current generation, an flock() shared lock on its .lock
+    file, and gc() removes the old generations that no reader holds.
+    '''
+
+    logger = logging.getLogger(__name__)
+
+    _CURRENT = 'CURRENT'
+    _gen_fmt = '{}_gen{:06d}.hdf'
+    _gen_regex = re.compile(r'_gen(\d+)\.hdf$')
+    _staging_ext = '.staging'
+    _lock_ext = '.lock'
+
+    def __init__(self, directory, basename='biofloat_cache'):
+        '''Initialize Generations object.
+
+        Args:
+            directory (str): Directory of the generation files
+            basename (str): Start of the generation file names, e.g. a
+                            fixed cache file name without .hdf so that the
+                            generations keep its constraint parameters
+        '''
+        self.directory = directory
+        self.basename = basename
+
+    @classmethod
+    def is_generations(cls, path):
+        '''Return True if path is a directory with a CURRENT pointer file.
+        '''
+        return os.path.isfile(os.path.join(path, cls._CURRENT))
+
+    def current(self):
+        '''Return path of the current generation, None if none is published.
+        '''
+        try:
+            with open(os.path.join(self.directory, self._CURRENT)) as f:
+                name = f.read().strip()
+        except IOError:
+            return None
+
+        return os.path.join(self.directory, name) if name else None
+
+    def _generations(self):
+        '''Return sorted list of (number, path) tuples of the generation files.
+        '''
+        gens = []
+        for name in os.listdir(self.directory):
+            m = self._gen_regex.search(name)
+            if m:
+                gens.append((int(m.group(1)), os.path.join(self.directory, name)))
+
+        return sorted(gens)
+
+    def acquire(self):
+        '''Return Lease on the current generation, raises IOError if none
+        has been published.
+        '''
+        import fcntl
+
+        while True:
+            path = self.current()
+            if path is None:
+                raise IOError('No generation published in {}'.format(self.directory))
+            lock_file = open(path + self._lock_ext, 'a')
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+            # gc() may have removed the generation before the lock was taken
+            if os.path.exists(path):
+                self.logger.debug('Acquired lease on %s', path)
+                return Lease(path, lock_file)
+            lock_file.close()
+
+    def stage(self, seed=None):
+        '''Return path of a staging file for the next generation, starting
+        as a copy of the current generation, or of cache file seed if none
+        has been published and seed exists.
+        '''
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        gens = self._generations()
+        number = gens[-1][0] + 1 if gens else 1
+        staging = os.path.join(self.directory, self._gen_fmt.format(
+                               self.basename, number)) + self._staging_ext
+        current = self.current()
+        if current is None and seed and os.path.exists(seed):
+            current = seed
+        if current:
+            self.logger.info('Copying %s to %s', current, staging)
+            shutil.copyfile(current, staging)
+
+        return staging
+
+    def publish(self, staging):
+        '''Make staging file the current generation and return its path.
+        '''
+        path = staging[:-len(self._staging_ext)]
+        with open(staging, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.rename(staging, path)
+
+        pointer = os.path.join(self.directory, self._CURRENT)
+        with open(pointer + '.tmp', 'w') as f:
+            f.write(os.path.basename(path) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(pointer + '.tmp', pointer)
+        self.logger.info('Published %s', path)
+
+        return path
+
+    def gc(self, keep=1):
+        '''Remove the generations older than the newest keep that are not
+        current and not leased by a reader.  Returns list of removed paths.
+        '''
+        import fcntl
+
+        current = self.current()
+        removed = []
+        for _, path in self._generations()[:-keep or None]:
+            if path == current:
+                continue
+            with open(path + self._lock_ext, 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    self.logger.debug('Keeping %s, it is being read', path)
+                    continue
+                os.remove(path)
+                os.remove(path + self._lock_ext)
+            removed.append(path)
+            self.logger.info('Removed %s', path)
+
+        return removed
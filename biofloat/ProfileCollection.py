@@ -0,0 +1,189 @@
+import numpy as np
+import pandas as pd
+
+from collections import OrderedDict
+
+class ProfileCollection(object):
+    '''Profiles stored as a CF contiguous ragged array: the samples of all
+    the profiles are concatenated into flat pressure and variable arrays
+    and row_size gives the number of samples of each profile.  The wmo,
+    time, lon, lat and profile number are stored once per profile rather
+    than on every sample as in the MultiIndex of ArgoData DataFrames.
+    '''
+
+    _index_names = ['wmo', 'time', 'lon', 'lat', 'profile', 'pressure']
+
+    def __init__(self, wmo, time, lon, lat, profile, row_size, pressure, data):
+        '''Initialize ProfileCollection object.
+
+        Args:
+            wmo, time, lon, lat, profile (array): Values of each profile
+            row_size (array): Number of samples of each profile
+            pressure (array): Pressure of every sample, profile after profile
+            data (dict): Array of every sample of each variable, in the
+                         order of pressure; an OrderedDict keeps the
+                         column order of to_dataframe()
+        '''
+        self.wmo = np.asarray(wmo, dtype=object)
+        self.time = pd.to_datetime(np.asarray(time)).values
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.profile = np.asarray(profile, dtype=np.int64)
+        self.row_size = np.asarray(row_size, dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(self.row_size)))
+        self.pressure = np.asarray(pressure)
+        self.data = data
+        self.variables = list(data)
+
+        if self.offsets[-1] != len(self.pressure):
+            raise ValueError('row_size adds up to {} samples, pressure has {}'.format(
+                             self.offsets[-1], len(self.pressure)))
+
+    def __len__(self):
+        return len(self.row_size)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.view(i)
+
+    @property
+    def nsamples(self):
+        return len(self.pressure)
+
+    @property
+    def nbytes(self):
+        return (sum(a.nbytes for a in self.data.values()) + self.pressure.nbytes +
+                self.time.nbytes + self.lon.nbytes + self.lat.nbytes +
+                self.profile.nbytes + self.row_size.nbytes)
+
+    def view(self, i):
+        '''Return dictionary of the pressure and variable arrays of profile
+        i, views into the sample arrays rather than copies.
+        '''
+        s = slice(self.offsets[i], self.offsets[i + 1])
+        profile = dict((v, a[s]) for v, a in self.data.items())
+        profile['pressure'] = self.pressure[s]
+
+        return profile
+
+    def sample_profiles(self):
+        '''Return array of the profile number, 0 to len() - 1, of each sample.
+        '''
+        return np.repeat(np.arange(len(self)), self.row_size)
+
+    def reduce(self, variable, how='mean', max_pressure=None):
+        '''Return array of one value per profile: the count, sum, mean, min
+        or max of variable's samples that are not NaN and, if given, are
+        not deeper than max_pressure.  Profiles without any such samples
+        get NaN, or 0 for count.
+        '''
+        x = np.asarray(self.data[variable], dtype=np.float64)
+        valid = ~np.isnan(x)
+        if max_pressure is not None:
+            valid &= self.pressure <= max_pressure
+
+        # reduceat() needs the start of each non-empty profile
+        rows = self.row_size > 0
+        starts = self.offsets[:-1][rows]
+        count = np.zeros(len(self), dtype=np.int64)
+        if len(starts):
+            count[rows] = np.add.reduceat(valid.astype(np.int64), starts)
+        if how == 'count':
+            return count
+
+        out = np.full(len(self), np.nan)
+        if not len(starts):
+            return out
+        if how in ('sum', 'mean'):
+            out[rows] = np.add.reduceat(np.where(valid, x, 0.), starts)
+            if how == 'mean':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    out /= count
+        elif how in ('min', 'max'):
+            ufunc = np.fmin if how == 'min' else np.fmax
+            out[rows] = ufunc.reduceat(np.where(valid, x, np.nan), starts)
+        else:
+            raise ValueError('Cannot reduce by {}'.format(how))
+        out[count == 0] = np.nan
+
+        return out
+
+    def take(self, indices):
+        '''Return new ProfileCollection of the profiles at indices.
+        '''
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.nonzero(indices)[0]
+        indices = np.asarray(indices, dtype=np.intp)
+
+        # The samples of each profile are a run from its offset
+        sizes = self.row_size[indices]
+        starts = np.cumsum(sizes) - sizes
+        samples = (np.arange(sizes.sum(), dtype=np.intp) + 
+                   np.repeat(self.offsets[indices] - starts, sizes))
+
+        return ProfileCollection(self.wmo[indices], self.time[indices],
+                        self.lon[indices], self.lat[indices], self.profile[indices],
+                        self.row_size[indices], self.pressure[samples],
+                        type(self.data)((v, a[samples]) for v, a in self.data.items()))
+
+    def to_dataframe(self):
+        '''Return DataFrame with the wmo, time, lon, lat, profile and
+        pressure MultiIndex of ArgoData.get_float_dataframe().
+        '''
+        rows = self.sample_profiles()
+        index = pd.MultiIndex.from_arrays([self.wmo[rows], self.time[rows],
+                                           self.lon[rows], self.lat[rows],
+                                           self.profile[rows], self.pressure],
+                                          names=self._index_names)
+
+        return pd.DataFrame(self.data, index=index, columns=self.variables)
+
+    @classmethod
+    def from_dataframe(cls, df):
+        '''Return ProfileCollection of df, a DataFrame with the MultiIndex of
+        ArgoData.get_float_dataframe() whose profiles are in contiguous rows.
+        '''
+        if df.empty:
+            return cls.empty()
+
+        levels = dict((n, df.index.get_level_values(n).values)
+                      for n in cls._index_names)
+        wmo, profile = levels['wmo'], levels['profile']
+        starts = np.concatenate(([0], np.nonzero((wmo[1:] != wmo[:-1]) |
+                                                 (profile[1:] != profile[:-1]))[0] + 1))
+        row_size = np.diff(np.concatenate((starts, [len(df)])))
+        data = OrderedDict((c, df[c].values) for c in df.columns)
+
+        return cls(wmo[starts], levels['time'][starts], levels['lon'][starts],
+                   levels['lat'][starts], profile[starts], row_size,
+                   levels['pressure'], data)
+
+    @classmethod
+    def empty(cls, variables=()):
+        '''Return ProfileCollection without any profiles.
+        '''
+        return cls([], np.array([], dtype='datetime64[ns]'), [], [], [], [],
+                   np.array([], dtype=np.float64),
+                   OrderedDict((v, np.array([], dtype=np.float64)) for v in variables))
+
+    @classmethod
+    def concat(cls, collections):
+        '''Return one ProfileCollection of the profiles in collections,
+        with the variables of all of them.
+        '''
+        collections = list(collections)
+        variables = []
+        for pc in collections:
+            variables.extend(v for v in pc.variables if v not in variables)
+        if not collections:
+            return cls.empty()
+
+        data = OrderedDict()
+        for v in variables:
+            data[v] = np.concatenate([pc.data[v] if v in pc.data else
+                                      np.full(pc.nsamples, np.nan) for pc in collections])
+
+        return cls(*[np.concatenate([getattr(pc, a) for pc in collections])
+                     for a in ('wmo', 'time', 'lon', 'lat', 'profile',
+                               'row_size', 'pressure')] + [data])
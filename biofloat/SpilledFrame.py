@@ -0,0 +1,113 @@
+import os
+import logging
+import tempfile
+
+import pandas as pd
+
+class SpilledFrame(object):
+    '''Result of a read that did not fit in its memory_limit, kept in a
+    temporary HDF table file and read back in chunks.  DataFrames are
+    appended a float at a time and a chunk never splits the rows appended
+    together, so per float and per profile groupbys can be done chunk by
+    chunk.  The file is removed by close(), on leaving a with block or when
+    the object is garbage collected.
+    '''
+
+    logger = logging.getLogger(__name__)
+
+    _KEY = 'data'
+
+    def __init__(self, memory_limit, tmp_dir=None, columns=None):
+        '''Initialize SpilledFrame object.
+
+        Args:
+            memory_limit (int): Bytes of DataFrame to read back per chunk
+            tmp_dir (str): Directory for the temporary file, default: the
+                           system's temporary directory
+            columns (list): Columns of the appended DataFrames, by default
+                            those of the first one; appending a DataFrame
+                            with other columns raises ValueError
+        '''
+        self._store = None
+        self.memory_limit = memory_limit
+        self.columns = columns
+        fd, self.path = tempfile.mkstemp(suffix='.hdf', prefix='biofloat_spill_',
+                                         dir=tmp_dir)
+        os.close(fd)
+        self._store = pd.HDFStore(self.path, mode='w')
+        self._blocks = []
+        self._nrows = 0
+        self._row_bytes = None
+
+    def __len__(self):
+        return self._nrows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def __iter__(self):
+        return self.iter_chunks()
+
+    def append(self, df):
+        '''Append the rows of DataFrame df, which are kept together in a chunk.
+        Columns of df that the SpilledFrame lacks raise ValueError.
+        '''
+        if df.empty:
+            return
+        if self.columns is None:
+            self.columns = df.columns.tolist()
+        extra = [c for c in df.columns if c not in self.columns]
+        if extra:
+            raise ValueError('Columns {} are not in the SpilledFrame columns {}'.format(
+                             extra, self.columns))
+        df = df.reindex(columns=self.columns)
+        if self._row_bytes is None:
+            self._row_bytes = float(df.memory_usage(index=True).sum()) / len(df)
+
+        self._store.append(self._KEY, df, format='table', min_itemsize={'wmo': 16})
+        self._blocks.append((self._nrows, self._nrows + len(df)))
+        self._nrows += len(df)
+
+    def iter_chunks(self, chunk_rows=None, columns=None):
+        '''Generate DataFrames of consecutive appended blocks of rows, each
+        of about chunk_rows rows, by default as many as fit in memory_limit.
+        Read only columns if given.
+        '''
+        if not self._blocks:
+            return
+        if chunk_rows is None:
+            chunk_rows = max(1, int(self.memory_limit / self._row_bytes))
+
+        start = stop = 0
+        for _, block_stop in self._blocks:
+            if block_stop - start > chunk_rows and stop > start:
+                yield self._select(start, stop, columns)
+                start = stop
+            stop = block_stop
+        yield self._select(start, stop, columns)
+
+    def _select(self, start, stop, columns=None):
+        self.logger.debug('Reading rows %s to %s from %s', start, stop, self.path)
+        return self._store.select(self._KEY, start=start, stop=stop, columns=columns)
+
+    def to_frame(self, columns=None):
+        '''Return all the rows as one DataFrame.
+        '''
+        if not self._blocks:
+            return pd.DataFrame(columns=self.columns)
+
+        return self._select(0, self._nrows, columns)
+
+    def close(self):
+        '''Remove the temporary file.
+        '''
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+            os.remove(self.path)
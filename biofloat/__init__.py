@@ -1,4 +1,5 @@
-__all__ = ['exceptions', 'ArgoData']
+__all__ = ['exceptions', 'ArgoData', 'ProfileCollection']
 
 from .ArgoData import ArgoData
+from .ProfileCollection import ProfileCollection
 
@@ -0,0 +1,154 @@
+'''Aggregation of the profile data in a biofloat cache file onto regular
+longitude, latitude, time and pressure grids.  The data are streamed a
+float at a time and accumulated with np.bincount() into the grid cells so
+memory use depends on the size of the grid and not on the amount of data.
+'''
+
+import numpy as np
+import pandas as pd
+
+
+def bin_codes(values, edges):
+    '''Return array of the bin number of each of values in the bins between
+    edges, [edges[i], edges[i+1]), -1 for values outside of the bins.
+    '''
+    codes = np.searchsorted(edges, values, side='right') - 1
+    codes[codes >= len(edges) - 1] = -1
+
+    return codes
+
+
+class GridAggregator(object):
+    '''Accumulate counts, means and variances of variables in the cells of
+    a grid.  Means and variances are combined across the DataFrames passed
+    to add() with the pairwise update of Chan et al. so that a single pass
+    through the data is numerically stable.
+    '''
+
+    def __init__(self, variables, lon_bins, lat_bins, time_bins=None,
+                 pressure_bins=None):
+        '''Initialize GridAggregator object.
+
+        Args:
+            variables (list): Columns of the DataFrames to aggregate
+            lon_bins (array): Edges of the longitude bins
+            lat_bins (array): Edges of the latitude bins
+            time_bins (array): Edges of the time bins, e.g. from
+                               pd.date_range(), default: no time dimension
+            pressure_bins (array): Edges of the pressure layers, default:
+                                   no pressure dimension
+        '''
+        self.variables = list(variables)
+        self._edges = []
+        self._levels = []
+        for dim, edges in (('time', time_bins), ('pressure', pressure_bins),
+                           ('lat', lat_bins), ('lon', lon_bins)):
+            if edges is None:
+                continue
+            if dim == 'time':
+                edges = pd.to_datetime(edges).values
+            else:
+                edges = np.asarray(edges, dtype=np.float64)
+            self._edges.append((dim, edges))
+            self._levels.append(dim)
+
+        self.shape = tuple(len(e) - 1 for _, e in self._edges)
+        size = int(np.prod(self.shape))
+        self._count = dict((v, np.zeros(size, dtype=np.int64)) for v in self.variables)
+        self._mean = dict((v, np.zeros(size)) for v in self.variables)
+        self._m2 = dict((v, np.zeros(size)) for v in self.variables)
+
+    def _cell_codes(self, df):
+        '''Return flat grid cell number of each row of df, -1 if outside.
+        '''
+        codes = np.zeros(len(df), dtype=np.int64)
+        outside = np.zeros(len(df), dtype=bool)
+        for (dim, edges), n in zip(self._edges, self.shape):
+            c = bin_codes(df.index.get_level_values(dim).values, edges)
+            outside |= c < 0
+            codes = codes * n + c
+        codes[outside] = -1
+
+        return codes
+
+    def add(self, df):
+        '''Accumulate the variables of df, a DataFrame with the wmo, time,
+        lon, lat, profile and pressure index of ArgoData.read().
+        '''
+        if df.empty:
+            return
+
+        codes = self._cell_codes(df)
+        size = len(self._count[self.variables[0]])
+        for v in self.variables:
+            if v not in df:
+                continue
+            x = df[v].values.astype(np.float64)
+            use = (codes >= 0) & ~np.isnan(x)
+            c, x = codes[use], x[use]
+
+            count = np.bincount(c, minlength=size)
+            cells = count > 0
+            mean = np.bincount(c, weights=x, minlength=size)
+            mean[cells] /= count[cells]
+            m2 = np.bincount(c, weights=(x - mean[c]) ** 2, minlength=size)
+
+            # Combine with the accumulated count, mean and M2 of each cell
+            n = self._count[v]
+            total = n + count
+            delta = mean - self._mean[v]
+            self._mean[v][cells] += delta[cells] * count[cells] / total[cells]
+            self._m2[v] += m2
+            self._m2[v][cells] += delta[cells] ** 2 * n[cells] * count[cells] / total[cells]
+            self._count[v] = total
+
+    def to_dataset(self):
+        '''Return xray Dataset with <variable>_count, <variable>_mean and
+        <variable>_var (sample variance) arrays on the grid.  The lon, lat
+        and pressure coordinates are the bin centers and time is the start
+        of each time bin.
+        '''
+        import xray
+
+        coords = {}
+        for dim, edges in self._edges:
+            if dim == 'time':
+                coords[dim] = edges[:-1]
+            else:
+                coords[dim] = (edges[:-1] + edges[1:]) / 2.
+
+        data_vars = {}
+        for v in self.variables:
+            count = self._count[v]
+            mean = np.where(count > 0, self._mean[v], np.nan)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                var = np.where(count > 1, self._m2[v] / (count - 1), np.nan)
+            data_vars[v + '_count'] = (self._levels, count.reshape(self.shape))
+            data_vars[v + '_mean'] = (self._levels, mean.reshape(self.shape))
+            data_vars[v + '_var'] = (self._levels, var.reshape(self.shape))
+
+        return xray.Dataset(data_vars, coords=coords)
+
+
+def grid_aggregate(ad, variables, lon_bins, lat_bins, time_bins=None,
+                   pressure_bins=None, wmo_list=None, codes=None):
+    '''Return xray Dataset of the counts, means and variances of variables
+    in ArgoData ad's cache file binned to the grid given by the bin edges,
+    see GridAggregator.  The data are read a float at a time with only the
+    profiles and pressures that fall within the grid.
+    '''
+    aggregator = GridAggregator(variables, lon_bins, lat_bins, time_bins,
+                                pressure_bins)
+    time = None
+    if time_bins is not None:
+        time = (pd.Timestamp(time_bins[0]), pd.Timestamp(time_bins[-1]))
+    pressure = None
+    if pressure_bins is not None:
+        pressure = (pressure_bins[0], pressure_bins[-1])
+
+    # Stream the floats past ArgoData's cache of read() results
+    for df in ad.iter_floats(wmo_list, time=time, pressure=pressure,
+                             variables=variables, codes=codes):
+        aggregator.add(df)
+
+    return aggregator.to_dataset()
@@ -1,6 +1,6 @@
 import pandas as pd
-import xray
 
+from biofloat.ArgoData import ArgoData
 from biofloat.utils import o2sat, convert_to_mll
 
 '''Collection of functions derived from biofloat Notebook 
@@ -27,7 +27,7 @@ def woa_o2sat(month, lon, lat, depth=5, verbose=0):
     spatial corrdinates passed in.  Passed in coordinates must match
     the grid of the WOA NetCDF file.
     '''
-
+    import xray
     ds = xray.open_dataset(woa[month], decode_times=False)
     o2sat = ds.loc[dict(lon=lon, lat=lat, depth=depth)]['O_an'].values[0]
 
@@ -37,12 +37,63 @@ def woa_o2sat(month, lon, lat, depth=5, verbose=0):
 
     return o2sat
 
+def drop_qc_columns(df):
+    '''Return df without the <variable>_QC flag columns, which are codes
+    that must not be averaged.
+    '''
+    return df.drop([c for c in df.columns if str(c).endswith(ArgoData._qc_suffix)],
+                   axis=1)
+
 def surface_mean(df, max_pressure=10):
     '''Return DataFrame of surface mean values for data with pressure 
     less than max_pressure.
     '''
-    return df.query(('pressure < {:d}').format(max_pressure)).groupby(
-            level=['wmo', 'time', 'lon', 'lat']).mean()
+    return drop_qc_columns(df).query(('pressure < {:d}').format(max_pressure)
+            ).groupby(level=['wmo', 'time', 'lon', 'lat']).mean()
+
+def iter_chunks(data):
+    '''Generate the DataFrame chunks of data, a DataFrame or a SpilledFrame
+    returned by ArgoData reads with a memory_limit.
+    '''
+    if isinstance(data, pd.DataFrame):
+        yield data
+    else:
+        for df in data.iter_chunks():
+            yield df
+
+def surface_mean_chunked(data, max_pressure=10):
+    '''Return surface_mean() of data, a DataFrame or SpilledFrame, computed
+    a chunk at a time.  Chunks hold whole floats so the profile means are
+    the same as for all the data at once.
+    '''
+    sdfs = [surface_mean(df, max_pressure) for df in iter_chunks(data)]
+    if not sdfs:
+        return pd.DataFrame()
+
+    return pd.concat(sdfs)
+
+def mean_chunked(data, by):
+    '''Return DataFrame of the mean of the columns of data, a DataFrame or
+    SpilledFrame, grouped by the index levels or columns in by.  The sums
+    and counts of each chunk are combined so the groups may span chunks.
+    '''
+    sums, counts = [], []
+    for df in iter_chunks(data):
+        df = drop_qc_columns(df)
+        if set(by) <= set(df.index.names):
+            groups = df.groupby(level=by)
+        else:
+            groups = df.groupby(by)
+        sums.append(groups.sum())
+        counts.append(groups.count())
+    if not sums:
+        return pd.DataFrame()
+
+    level = list(range(len(by)))
+    total = pd.concat(sums).groupby(level=level).sum()
+    count = pd.concat(counts).groupby(level=level).sum()
+
+    return total / count[total.columns]
 
 def add_columns_for_groupby(df):
     '''Add columns derived from the index to make groupbys easier.
@@ -59,7 +110,7 @@ def monthly_mean(df):
     '''Return DataFrame of monthly mean of the float data. These columns need
     to be in df: ['wmo', 'year', 'month']
     '''
-    mdf = df.groupby(['wmo', 'year', 'month']).mean()
+    mdf = drop_qc_columns(df).groupby(['wmo', 'year', 'month']).mean()
     mdf['o2sat'] = 100 * (mdf.DOXY_ADJUSTED / o2sat(mdf.PSAL_ADJUSTED, mdf.TEMP_ADJUSTED))
 
     return mdf
@@ -1,7 +1,41 @@
 # -*- coding: utf-8 -*-
 # Module containing functions for converting biofloat DataFrames to other formats
 
+import numpy as np
+import pandas as pd
+
 from collections import OrderedDict
+from datetime import datetime
+
+from biofloat.ProfileCollection import ProfileCollection
+
+# The netCDF4 and zarr writers are optional dependencies, imported by the 
+# functions that use them: pip install biofloat[netcdf] or biofloat[zarr]
+
+# Attributes of the profile and sample variables of the CF contiguous 
+# ragged array files written by to_netcdf() and to_zarr()
+_time_units = 'days since 1950-01-01 00:00:00 UTC'
+_coordinate_attrs = OrderedDict([
+    ('row_size', dict(long_name='Number of samples in each profile',
+                      sample_dimension='obs')),
+    ('wmo', dict(long_name='Float WMO identifier', cf_role='profile_id')),
+    ('time', dict(standard_name='time', units=_time_units, axis='T')),
+    ('lon', dict(standard_name='longitude', units='degrees_east', axis='X')),
+    ('lat', dict(standard_name='latitude', units='degrees_north', axis='Y')),
+    ('cycle_number', dict(long_name='Float cycle number')),
+    ('pressure', dict(standard_name='sea_water_pressure', units='decibar', 
+                      positive='down', axis='Z')),
+])
+_variable_attrs = {
+    'TEMP_ADJUSTED': dict(standard_name='sea_water_temperature', 
+                          units='degree_Celsius'),
+    'PSAL_ADJUSTED': dict(standard_name='sea_water_salinity', units='psu'),
+    'DOXY_ADJUSTED': dict(standard_name='moles_of_oxygen_per_unit_mass_in_sea_water',
+                          units='micromole/kg'),
+}
+_wmo_length = 16
+_qc_fill = 9
+_profile_chunk = 4096
 
 def to_odv(df, odv_file_name, vars=None):
     '''Output biofloat DataFrame in Ocean Data View spreadsheet format to
@@ -37,3 +71,174 @@ def to_odv(df, odv_file_name, vars=None):
                                   for v in vars.keys()])
             odv.write(fmt_base.format(*rec_base) + rec_vars + '\n')
 
+
+def _ragged_arrays(pc):
+    '''Return OrderedDict of (dimension, array) tuples of the variables of
+    the ragged array file for ProfileCollection pc.
+    '''
+    time = (pc.time - np.datetime64('1950-01-01T00:00:00')).astype(
+                            'timedelta64[ns]').astype(np.int64) / 86400e9
+    time[pd.isnull(pc.time)] = np.nan
+    arrays = OrderedDict([
+        ('row_size', ('profile', pc.row_size.astype(np.int32))),
+        ('wmo', ('profile', pc.wmo.astype('S{:d}'.format(_wmo_length)))),
+        ('time', ('profile', time)),
+        ('lon', ('profile', pc.lon)),
+        ('lat', ('profile', pc.lat)),
+        ('cycle_number', ('profile', pc.profile.astype(np.int32))),
+        ('pressure', ('obs', pc.pressure)),
+    ])
+    for v, a in pc.data.items():
+        arrays[v] = ('obs', a)
+
+    return arrays
+
+def _attrs(name, a):
+    '''Return dictionary of the attributes and fill value of variable name
+    with values a.
+    '''
+    attrs = dict(_coordinate_attrs.get(name, _variable_attrs.get(name, {})))
+    if name not in _coordinate_attrs:
+        attrs['coordinates'] = 'time lat lon pressure'
+    if name.endswith('_QC'):
+        attrs['long_name'] = 'Argo quality flag'
+        return attrs, _qc_fill
+    if a.dtype.kind == 'f':
+        return attrs, np.nan
+
+    return attrs, None
+
+def _global_attrs(title):
+    '''Return OrderedDict of the global attributes of an exported file.
+    '''
+    return OrderedDict([('Conventions', 'CF-1.6'), ('featureType', 'profile'),
+                        ('title', title), 
+                        ('date_created', datetime.utcnow().isoformat() + 'Z'),
+                        ('source', 'biofloat')])
+
+def _iter_collections(data, chunk_samples):
+    '''Generate ProfileCollections of at least chunk_samples samples, but
+    for the last one, from data: a DataFrame, ProfileCollection, SpilledFrame
+    or an iterable of DataFrames or ProfileCollections of whole floats.
+    '''
+    if isinstance(data, (pd.DataFrame, ProfileCollection)):
+        data = [data]
+    elif hasattr(data, 'iter_chunks'):
+        data = data.iter_chunks()
+
+    buffered = []
+    nsamples = 0
+    for item in data:
+        if isinstance(item, pd.DataFrame):
+            item = ProfileCollection.from_dataframe(item)
+        if not len(item):
+            continue
+        buffered.append(item)
+        nsamples += item.nsamples
+        if nsamples >= chunk_samples:
+            yield ProfileCollection.concat(buffered)
+            buffered = []
+            nsamples = 0
+    if buffered:
+        yield ProfileCollection.concat(buffered)
+
+def to_netcdf(data, file_name, chunk_samples=100000, complevel=4, 
+              title='Bio-Argo profiling float data'):
+    '''Write data to NetCDF4 file_name with the CF contiguous ragged array
+    representation of profiles: the samples of all the profiles are along
+    the obs dimension and row_size gives the number of samples of each
+    profile.  The data may be a DataFrame, ProfileCollection or SpilledFrame
+    or, to export a whole cache file a float at a time, an iterable of them
+    such as ArgoData.iter_floats(as_collection=True).  Up to about 
+    chunk_samples samples are held in memory and written at a time, into
+    zlib compressed chunks of that size.  Returns the number of profiles
+    written.
+    '''
+    import netCDF4
+
+    nprof = nobs = 0
+    with netCDF4.Dataset(file_name, 'w', format='NETCDF4') as nc:
+        nc.setncatts(_global_attrs(title))
+        nc.createDimension('profile', None)
+        nc.createDimension('obs', None)
+        nc.createDimension('wmo_strlen', _wmo_length)
+        for pc in _iter_collections(data, chunk_samples):
+            arrays = _ragged_arrays(pc)
+            # Variables are defined before writing as NetCDF rejects chunks 
+            # longer than an unlimited dimension that has data, those first
+            # found in later data get chunks no longer than what's written
+            for name, (dim, a) in arrays.items():
+                if name not in nc.variables:
+                    attrs, fill = _attrs(name, a)
+                    chunks = _profile_chunk if dim == 'profile' else chunk_samples
+                    written = nprof if dim == 'profile' else nobs
+                    if written:
+                        chunks = min(chunks, written)
+                    if name == 'wmo':
+                        var = nc.createVariable(name, 'S1', (dim, 'wmo_strlen'),
+                                                zlib=True, complevel=complevel,
+                                                chunksizes=(chunks, _wmo_length))
+                    else:
+                        var = nc.createVariable(name, a.dtype, (dim,), zlib=True,
+                                                complevel=complevel, 
+                                                chunksizes=(chunks,), 
+                                                fill_value=fill)
+                    var.setncatts(attrs)
+            for name, (dim, a) in arrays.items():
+                start = nprof if dim == 'profile' else nobs
+                if name == 'wmo':
+                    a = netCDF4.stringtochar(a)
+                nc.variables[name][start:start + len(a)] = a
+            nprof += len(pc)
+            nobs += pc.nsamples
+
+    return nprof
+
+def to_zarr(data, store, chunk_samples=100000, complevel=4, synchronizer=None,
+            title='Bio-Argo profiling float data'):
+    '''Write data to Zarr store, a directory path or zarr store, with the
+    same contiguous ragged array variables and attributes as to_netcdf(),
+    the dimensions of each array in its _ARRAY_DIMENSIONS attribute.  New
+    profiles are appended to an existing store, so several workers may 
+    each write some of the floats, e.g. ArgoData.iter_floats() of their
+    shard of ArgoData.shard_wmo_list(), given a zarr.ProcessSynchronizer.
+    A worker takes the synchronizer's lock only to reserve the range of
+    profiles and samples it appends, the compression and writing of the
+    data are done in parallel.  Returns the number of profiles written.
+    '''
+    import zarr
+    from numcodecs import Zlib
+
+    if synchronizer is None:
+        synchronizer = zarr.ThreadSynchronizer()
+    compressor = Zlib(level=complevel)
+    count = 0
+    for pc in _iter_collections(data, chunk_samples):
+        arrays = _ragged_arrays(pc)
+        with synchronizer['.append']:
+            group = zarr.open_group(store, mode='a', synchronizer=synchronizer)
+            if 'row_size' not in group:
+                group.attrs.update(_global_attrs(title))
+            nprof = group['row_size'].shape[0] if 'row_size' in group else 0
+            nobs = group['pressure'].shape[0] if 'pressure' in group else 0
+            for name, (dim, a) in arrays.items():
+                if name not in group:
+                    attrs, fill = _attrs(name, a)
+                    chunks = _profile_chunk if dim == 'profile' else chunk_samples
+                    group.create_dataset(name, shape=(nprof if dim == 'profile'
+                                         else nobs,), chunks=(chunks,), 
+                                         dtype=a.dtype, compressor=compressor,
+                                         fill_value=fill)
+                    group[name].attrs.update(dict(attrs, _ARRAY_DIMENSIONS=[dim]))
+            # Reserve the ranges in all the arrays, also those of variables
+            # that only other workers write
+            for name, z in group.arrays():
+                dim = z.attrs['_ARRAY_DIMENSIONS'][0]
+                z.resize(nprof + len(pc) if dim == 'profile' else nobs + pc.nsamples)
+
+        for name, (dim, a) in arrays.items():
+            start = nprof if dim == 'profile' else nobs
+            group[name][start:start + len(a)] = a
+        count += len(pc)
+
+    return count
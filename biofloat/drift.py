@@ -0,0 +1,166 @@
+'''Fitting of oxygen sensor gain drift, the change with time of the WOA
+gains of calibrate.calculate_gain(), for all floats at once.  The gains of
+all the floats are stacked in one table and the per float least squares
+fits are done together by summing each float's normal equations with
+np.add.reduceat() and solving them as one stack of small linear systems.
+The fitted time varying gains are applied to the cached data a float at
+a time.
+'''
+
+import numpy as np
+import pandas as pd
+
+from collections import OrderedDict
+
+from biofloat.ProfileCollection import ProfileCollection
+
+_seconds_per_year = 365.25 * 86400
+
+
+def _years(dates, start):
+    '''Return array of years from datetime64 array start to dates.
+    '''
+    return (dates - start).astype('timedelta64[s]').astype(np.float64) / _seconds_per_year
+
+def _design(t, knots):
+    '''Return design matrix of the intercept, slope and a hinge at each
+    of the columns of knots for times t in years.
+    '''
+    return np.column_stack([np.ones(len(t)), t] +
+                           [np.maximum(0., t - knots[:, k])
+                            for k in range(knots.shape[1])])
+
+def _knot_columns(knots):
+    '''Return tuple of the knot and change of slope column names.
+    '''
+    return (['knot_{:d}'.format(k + 1) for k in range(knots)],
+            ['dslope_{:d}'.format(k + 1) for k in range(knots)])
+
+def fit_drift(gdf, knots=0, min_points=None):
+    '''Return DataFrame indexed by wmo of the drift of the gain of each
+    float in gdf, the stacked calculate_gain() DataFrames of the floats
+    with wmo, date and gain columns.  The gain is fitted as a linear
+    function of the years since the float's first gain, or with knots
+    set as a continuous piecewise linear function with that many changes
+    of slope equally spaced in the float's time range.  The columns are
+    the start and end dates, the number of gains n, their gain_mean, the
+    fitted intercept and slope per year, the knot_<i> times in years and
+    dslope_<i> changes of slope at each knot and the rmse of the fit.
+    Floats with fewer than min_points gains, by default the number of
+    coefficients plus one, or whose gains cannot determine the fit have
+    NaN coefficients.
+    '''
+    gdf = gdf[np.isfinite(gdf['gain'].values) & gdf['date'].notnull().values]
+    codes, floats = pd.factorize(gdf['wmo'].astype(str).values, sort=True)
+    order = np.argsort(codes, kind='mergesort')
+    codes = codes[order]
+    dates = pd.to_datetime(gdf['date']).values[order]
+    y = gdf['gain'].values.astype(np.float64)[order]
+    ncoefs = 2 + knots
+    if min_points is None:
+        min_points = ncoefs + 1
+
+    knot_names, dslope_names = _knot_columns(knots)
+    columns = (['start', 'end', 'n', 'gain_mean', 'intercept', 'slope'] +
+               knot_names + dslope_names + ['rmse'])
+    if not len(y):
+        return pd.DataFrame(columns=columns, index=pd.Index([], name='wmo'))
+
+    # Each float's gains are in consecutive rows starting at starts
+    starts = np.concatenate(([0], np.nonzero(np.diff(codes))[0] + 1))
+    n = np.diff(np.append(starts, len(y)))
+    ns = dates.view(np.int64)
+    start = np.minimum.reduceat(ns, starts).view(dates.dtype)
+    end = np.maximum.reduceat(ns, starts).view(dates.dtype)
+    t = _years(dates, start[codes])
+    knot_years = (_years(end, start)[:, None] *
+                  np.arange(1, knots + 1)[None, :] / (knots + 1.))
+
+    # Normal equations X'X b = X'y of all the floats, solved as one stack
+    X = _design(t, knot_years[codes])
+    xtx = np.add.reduceat(X[:, :, None] * X[:, None, :], starts)
+    xty = np.add.reduceat(X * y[:, None], starts)
+    s = np.linalg.svd(xtx, compute_uv=False)
+    ok = (n >= min_points) & (s[:, -1] > 1e-10 * s[:, 0])
+    xtx[~ok] = np.eye(ncoefs)
+    xty[~ok] = 0.
+    coefs = np.linalg.solve(xtx, xty[:, :, None])[:, :, 0]
+    coefs[~ok] = np.nan
+
+    resid = y - (X * coefs[codes]).sum(axis=1)
+    df = pd.DataFrame(OrderedDict([('start', start), ('end', end), ('n', n),
+                    ('gain_mean', np.add.reduceat(y, starts) / n),
+                    ('intercept', coefs[:, 0]), ('slope', coefs[:, 1])]),
+                    index=pd.Index(floats, name='wmo'), columns=columns)
+    for k in range(knots):
+        df[knot_names[k]] = knot_years[:, k]
+        df[dslope_names[k]] = coefs[:, 2 + k]
+    df['rmse'] = np.sqrt(np.add.reduceat(resid ** 2, starts) / n)
+
+    return df
+
+def drift_gain(drift_df, wmo, time):
+    '''Return array of the gain at each time of float wmo, arrays of the
+    same length, from fit_drift() DataFrame drift_df.  Times outside a
+    float's fitted range get the gain at the nearest end.  Floats whose
+    fit has NaN coefficients get their gain_mean, floats not in drift_df
+    get NaN.
+    '''
+    rows = drift_df.index.get_indexer(np.asarray(wmo).astype(str))
+    gain = np.full(len(rows), np.nan)
+    fitted = rows >= 0
+    if not fitted.any():
+        return gain
+
+    d = drift_df.iloc[rows[fitted]]
+    start = d['start'].values
+    t = np.clip(_years(pd.to_datetime(np.asarray(time)[fitted]).values, start),
+                0., _years(d['end'].values, start))
+    knot_names, dslope_names = _knot_columns(sum(c.startswith('knot_') 
+                                                 for c in drift_df.columns))
+    coefs = d[['intercept', 'slope'] + dslope_names].values
+    g = (_design(t, d[knot_names].values.reshape(len(d), -1)) * coefs).sum(axis=1)
+    gain[fitted] = np.where(np.isnan(g), d['gain_mean'].values, g)
+
+    return gain
+
+def apply_drift(data, drift_df, variable='DOXY_ADJUSTED', column=None):
+    '''Generate the DataFrames or ProfileCollections of data with variable
+    multiplied by the drift_gain() at the time of each profile, in column
+    if given or else in place of variable.  The data may be a DataFrame,
+    ProfileCollection, SpilledFrame or an iterable of them, such as
+    ArgoData.iter_floats(), so that a whole cache can be calibrated a
+    float at a time.
+    '''
+    if isinstance(data, (pd.DataFrame, ProfileCollection)):
+        data = [data]
+    elif hasattr(data, 'iter_chunks'):
+        data = data.iter_chunks()
+
+    column = column or variable
+    for item in data:
+        if isinstance(item, ProfileCollection):
+            gain = np.repeat(drift_gain(drift_df, item.wmo, item.time), item.row_size)
+            values = OrderedDict(item.data)
+            values[column] = item.data[variable] * gain
+            yield ProfileCollection(item.wmo, item.time, item.lon, item.lat,
+                                    item.profile, item.row_size, item.pressure,
+                                    values)
+        else:
+            item = item.copy()
+            item[column] = item[variable].values * drift_gain(drift_df,
+                                    item.index.get_level_values('wmo'),
+                                    item.index.get_level_values('time'))
+            yield item
+
+def calibrate_cache(ad, drift_df, variable='DOXY_ADJUSTED', column=None,
+                    wmo_list=None, as_collection=False):
+    '''Generate the data of the floats in drift_df, or in wmo_list, read a
+    float at a time from ArgoData ad's cache file and calibrated with
+    apply_drift().
+    '''
+    if wmo_list is None:
+        wmo_list = drift_df.index.tolist()
+
+    return apply_drift(ad.iter_floats(wmo_list, as_collection=as_collection),
+                       drift_df, variable, column)
@@ -75,3 +75,108 @@ def convert_to_mll(o2, s, t, p):
     '''
     return sw.dens(s, t, p) * o2 / 44.66 / 1000.0
 
+
+# Constants of Eqn (4) of Weiss 1970 used by o2sat()
+_weiss_a = (-177.7888, 255.5907, 146.4813, -22.2040)
+_weiss_b = (-0.037362, 0.016504, -0.0020564)
+
+def _o2sat_kernel(s, pt, out, work, work2):
+    '''Evaluate o2sat(s, pt) into out using the work and work2 arrays of the
+    same length for all intermediate values.
+    '''
+    a, b = _weiss_a, _weiss_b
+
+    # x = t / 100 with t the IPTS-68 temperature in Kelvin
+    np.multiply(pt, 1.00024, out=out)
+    out += Kelvin
+    out /= 100.
+
+    # s * (b0 + b1 * x + b2 * x**2) by Horner's rule
+    np.multiply(out, b[2], out=work)
+    work += b[1]
+    work *= out
+    work += b[0]
+    work *= s
+
+    # + a0 + a1 / x + a2 * ln(x) + a3 * x
+    np.multiply(out, a[3], out=work2)
+    work += work2
+    np.log(out, out=work2)
+    work2 *= a[2]
+    work += work2
+    np.reciprocal(out, out=work2)
+    work2 *= a[1]
+    work += work2
+    work += a[0]
+
+    np.exp(work, out=out)
+    out *= 1000. / 22.392
+
+    return out
+
+def _chunks(n, chunksize):
+    '''Generate slices that cover range(n) in chunksize steps.
+    '''
+    for start in range(0, n, chunksize):
+        yield slice(start, min(start + chunksize, n))
+
+def o2sat_chunked(s, pt, out=None, chunksize=1000000):
+    '''Same as o2sat() for 1-d arrays, but evaluated chunksize values at a
+    time into out (allocated if not given) so that the temporary arrays
+    used are chunksize long however long s and pt are.
+    '''
+    # Views of the columns; each chunk is cast to float64 as it is used
+    s = np.asarray(s)
+    pt = np.asarray(pt)
+    if out is None:
+        out = np.empty(len(s))
+    work = np.empty(min(chunksize, len(s)))
+    work2 = np.empty_like(work)
+    for sl in _chunks(len(s), chunksize):
+        n = sl.stop - sl.start
+        _o2sat_kernel(np.asarray(s[sl], dtype=np.float64),
+                      np.asarray(pt[sl], dtype=np.float64),
+                      out[sl], work[:n], work2[:n])
+
+    return out
+
+def percent_saturation(o2, s, pt, out=None, chunksize=1000000):
+    '''Return 100 * o2 / o2sat(s, pt), the percent oxygen saturation of o2
+    in um/kg, computed in chunks like o2sat_chunked().
+    '''
+    out = o2sat_chunked(s, pt, out, chunksize)
+    o2 = np.asarray(o2)
+    for sl in _chunks(len(out), chunksize):
+        np.divide(np.asarray(o2[sl], dtype=np.float64), out[sl], out=out[sl])
+        out[sl] *= 100.
+
+    return out
+
+def convert_to_mll_chunked(o2, s, t, p, out=None, chunksize=1000000):
+    '''Same as convert_to_mll() for 1-d arrays with sw.dens() evaluated 
+    chunksize values at a time into out (allocated if not given).
+    '''
+    o2, s, t, p = [np.asarray(a) for a in (o2, s, t, p)]
+    if out is None:
+        out = np.empty(len(o2))
+    for sl in _chunks(len(o2), chunksize):
+        out[sl] = sw.dens(*[np.asarray(a[sl], dtype=np.float64) for a in (s, t, p)])
+        out[sl] *= np.asarray(o2[sl], dtype=np.float64)
+        out[sl] /= 44.66 * 1000.0
+
+    return out
+
+def add_oxygen_columns(dfs, oxygen='DOXY_ADJUSTED', salinity='PSAL_ADJUSTED',
+                       temperature='TEMP_ADJUSTED', chunksize=1000000):
+    '''Generate the DataFrames from dfs, e.g. ArgoData.iter_read(), with
+    'o2sat' percent saturation and 'o2_mll' oxygen in ml/l columns added.
+    Memory use is bounded by the size of each DataFrame and chunksize.
+    '''
+    for df in dfs:
+        df['o2sat'] = percent_saturation(df[oxygen].values, df[salinity].values,
+                            df[temperature].values, chunksize=chunksize)
+        df['o2_mll'] = convert_to_mll_chunked(df[oxygen].values, 
+                            df[salinity].values, df[temperature].values,
+                            df.index.get_level_values('pressure').values,
+                            chunksize=chunksize)
+        yield df
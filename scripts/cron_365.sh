@@ -1,7 +1,8 @@
 #!/bin/bash
 # Script to execute from cron in the early hours of the morning
 # to update local biofloat cache with new profile data.
-# Copies the cache file to anonymous FTP and saves a daily log file.
+# Publishes the day's changes as a delta file on anonymous FTP, copies the
+# whole cache file there once a week, and saves a daily log file.
 #
 # Execute from cron like:
 # 0 2 * * *  dev/biofloatgit/scripts/cron_365.sh
@@ -13,6 +14,12 @@ ftp_dir=/mbari/FTP/pub/biofloat
 ########
 
 log_file=$biofloat_dir/logs/cron_365_$(date +%Y%m%d).out
+cache_file=$work_dir/biofloat_fixed_cache_age365_variablesDOXY_ADJUSTED-PSAL_ADJUSTED-TEMP_ADJUSTED.hdf
 source $biofloat_dir/venv-biofloat/bin/activate
 python $biofloat_dir/scripts/load_biofloat_cache.py --age 365 --cache_dir $work_dir -v > $log_file 2>&1
-cp /data/biofloat/biofloat_fixed_cache_age365_variablesDOXY_ADJUSTED-PSAL_ADJUSTED-TEMP_ADJUSTED.hdf $ftp_dir
+python $biofloat_dir/scripts/delta_biofloat_cache.py --cache_file $cache_file \
+    --export $ftp_dir/biofloat_delta_age365_$(date +%Y%m%d).hdf -v >> $log_file 2>&1
+# Full copy on Sundays for new users, others apply the daily delta files
+if [ $(date +%u) -eq 7 ]; then
+    cp $cache_file $ftp_dir
+fi
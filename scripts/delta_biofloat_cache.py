@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+import sys
+from os.path import join, dirname, getsize
+parent_dir = join(dirname(__file__), "../")
+sys.path.insert(0, parent_dir)
+
+from biofloat import ArgoData
+
+class CacheDelta(object):
+
+    def process(self):
+        ad = ArgoData(verbosity=self.args.verbose, cache_file=self.args.cache_file)
+        if self.args.export:
+            count = ad.export_delta(self.args.export, self.args.since)
+            print(('Exported {} changed profiles from {} to {} ({:.1f} MB)').format(
+                  count, self.args.cache_file, self.args.export,
+                  getsize(self.args.export) / 1e6))
+        for delta_file in self.args.apply:
+            count = ad.apply_delta(delta_file, force=self.args.force)
+            print(('Applied {} changed profiles from {} to {}').format(
+                  count, delta_file, self.args.cache_file))
+
+    def process_command_line(self):
+        import argparse
+        from argparse import RawTextHelpFormatter
+        from dateutil.parser import parse
+
+        examples = 'Examples:' + '\n'
+        examples += '---------' + '\n'
+        examples += sys.argv[0] + " --cache_file /data/biofloat/biofloat_fixed_cache_age365.hdf"
+        examples += " --export /mbari/FTP/pub/biofloat/delta_20160301.hdf\n"
+        examples += sys.argv[0] + " --cache_file biofloat_fixed_cache_age365.hdf"
+        examples += " --apply delta_20160301.hdf delta_20160302.hdf\n"
+        examples += "\n\n"
+
+        parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter,
+                    description='Script to publish the profiles changed in a cache\n'
+                                'file as a small delta file and to patch a copy of the\n'
+                                'cache file with published delta files.',
+                    epilog=examples)
+
+        parser.add_argument('--cache_file', action='store', required=True,
+                            help='Full path to cache file')
+        parser.add_argument('--export', action='store',
+                            help='Write the profiles changed since the last export\n'
+                                 'to this delta file')
+        parser.add_argument('--since', action='store', type=parse,
+                            help='Export the changes after this time instead, e.g.\n'
+                                 '2016-03-01T02:00')
+        parser.add_argument('--apply', action='store', nargs='*', default=[],
+                            help='Delta files to patch cache_file with, in order')
+        parser.add_argument('--force', action='store_true',
+                            help='Apply deltas that start after the last one applied')
+        parser.add_argument('-v', '--verbose', nargs='?', choices=[0,1,2,3], type=int,
+                            help='0: ERROR, 1: WARN, 2: INFO, 3:DEBUG', default=0, const=2)
+
+        self.args = parser.parse_args()
+
+        if not self.args.export and not self.args.apply:
+            parser.print_help()
+            print "\n*** Must specify --export or --apply ***\n"
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    cd = CacheDelta()
+    cd.process_command_line()
+    cd.process()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+import sys
+from os.path import join, dirname
+parent_dir = join(dirname(__file__), "../")
+sys.path.insert(0, parent_dir)
+
+from biofloat import ArgoData
+from biofloat import converters
+
+class CacheExport(object):
+
+    def shard(self):
+        '''Return (shard, num_shards) tuple parsed from --shard i/N argument.
+        '''
+        shard, num_shards = self.args.shard.split('/')
+
+        return int(shard), int(num_shards)
+
+    def process(self):
+        ad = ArgoData(verbosity=self.args.verbose, cache_file=self.args.cache_file)
+        wmo_list = self.args.wmo or None
+        if self.args.shard:
+            if wmo_list is None:
+                wmo_list = ad.get_cache_file_all_wmo_list()
+            wmo_list = ad.shard_wmo_list(wmo_list, *self.shard())
+            print(('Shard {} has {} floats').format(self.args.shard, len(wmo_list)))
+
+        pressure = (None, self.args.pressure) if self.args.pressure else None
+        floats = ad.iter_floats(wmo_list, pressure=pressure, as_collection=True)
+        if self.args.netcdf:
+            count = converters.to_netcdf(floats, self.args.netcdf, 
+                                         chunk_samples=self.args.chunk_samples,
+                                         complevel=self.args.complevel)
+            out = self.args.netcdf
+        else:
+            import zarr
+            synchronizer = None
+            if self.args.shard:
+                synchronizer = zarr.ProcessSynchronizer(self.args.zarr + '.sync')
+            count = converters.to_zarr(floats, self.args.zarr,
+                                       chunk_samples=self.args.chunk_samples,
+                                       complevel=self.args.complevel,
+                                       synchronizer=synchronizer)
+            out = self.args.zarr
+        print(('Exported {} profiles from {} to {}').format(count, 
+              self.args.cache_file, out))
+
+    def process_command_line(self):
+        import argparse
+        from argparse import RawTextHelpFormatter
+
+        examples = 'Examples:' + '\n'
+        examples += '---------' + '\n'
+        examples += sys.argv[0] + " --cache_file biofloat_fixed_cache_age365.hdf"
+        examples += " --netcdf biofloat_age365.nc\n"
+        examples += "for i in 0 1 2 3; do " + sys.argv[0]
+        examples += " --cache_file biofloat_fixed_cache_age365.hdf"
+        examples += " --zarr biofloat_age365.zarr --shard $i/4 & done\n"
+        examples += "\n\n"
+
+        parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter,
+                    description='Script to export the profiles in a cache file to a\n'
+                                'CF contiguous ragged array NetCDF4 file or Zarr store,\n'
+                                'a float at a time.  Several workers may export the\n'
+                                'shards of the floats to the same Zarr store.',
+                    epilog=examples)
+
+        parser.add_argument('--cache_file', action='store', required=True,
+                            help='Full path to cache file')
+        parser.add_argument('--netcdf', action='store',
+                            help='NetCDF4 file to write')
+        parser.add_argument('--zarr', action='store',
+                            help='Zarr directory store to write or append to')
+        parser.add_argument('--wmo', action='store', nargs='*', default=[],
+                            help='One or more WMO numbers to export, default: all')
+        parser.add_argument('--shard', action='store',
+                            help='Append only shard i of N (e.g. 0/4) of the floats\n'
+                            'to the --zarr store, run one worker for each shard')
+        parser.add_argument('--pressure', action='store', type=int,
+                            help='Export only data shallower than this pressure')
+        parser.add_argument('--chunk_samples', action='store', type=int, default=100000,
+                            help='Samples to hold in memory and to write per chunk')
+        parser.add_argument('--complevel', action='store', type=int, default=4,
+                            help='Compression level, 0-9')
+        parser.add_argument('-v', '--verbose', nargs='?', choices=[0,1,2,3], type=int,
+                            help='0: ERROR, 1: WARN, 2: INFO, 3:DEBUG', default=0, const=2)
+
+        self.args = parser.parse_args()
+
+        if (not self.args.netcdf) == (not self.args.zarr):
+            parser.print_help()
+            print "\n*** Must specify either --netcdf or --zarr ***\n"
+            sys.exit(1)
+
+        if self.args.shard:
+            try:
+                shard, num_shards = self.shard()
+                if not 0 <= shard < num_shards or not self.args.zarr:
+                    raise ValueError
+            except ValueError:
+                parser.print_help()
+                print "\n*** --shard must be i/N with 0 <= i < N and needs --zarr ***\n"
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    ce = CacheExport()
+    ce.process_command_line()
+    ce.process()
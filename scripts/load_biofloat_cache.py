@@ -1,11 +1,13 @@
 #!/usr/bin/env python
 
 import sys
-from os.path import join, dirname, abspath, expanduser
+import signal
+from os.path import join, dirname, abspath, expanduser, splitext, basename
 parent_dir = join(dirname(__file__), "../")
 sys.path.insert(0, parent_dir)
 
 from biofloat import ArgoData
+from biofloat.Generations import Generations
 
 class ArgoDataLoader(object):
 
@@ -41,6 +43,13 @@ class ArgoDataLoader(object):
 
         return cache_file
 
+    def shard(self):
+        '''Return (shard, num_shards) tuple parsed from --shard i/N argument.
+        '''
+        shard, num_shards = self.args.shard.split('/')
+
+        return int(shard), int(num_shards)
+
     def process(self):
         if self.args.cache_file:
             cache_file = self.args.cache_file
@@ -53,25 +62,64 @@ class ArgoDataLoader(object):
             cache_dir = expanduser('~')
     
         cache_file = abspath(join(cache_dir, cache_file))
+        if self.args.shard:
+            base, ext = splitext(cache_file)
+            cache_file = base + ArgoData._shard_fmt.format(*self.shard()) + ext
+
+        generations = None
+        if self.args.generations_dir:
+            # Load into a copy of the current generation and publish it when done
+            generations = Generations(self.args.generations_dir, 
+                                      splitext(basename(cache_file))[0])
+            cache_file = generations.stage(seed=cache_file)
 
         print(('Loading cache file {}').format(cache_file))
         ad = ArgoData(verbosity=self.args.verbose, cache_file=cache_file,
-                      bio_list=self.args.bio_list, variables=self.args.variables)
+                      bio_list=self.args.bio_list, variables=self.args.variables,
+                      batch_profiles=self.args.batch_profiles,
+                      batch_bytes=self.args.batch_mb * 1000000,
+                      batch_seconds=self.args.batch_seconds,
+                      pressure_tolerance=self.args.pressure_tolerance,
+                      standard_levels=self.args.standard_levels,
+                      discovery=self.args.discovery,
+                      qc_accept=self.args.qc_accept)
+
+        if self.args.convert_blanks:
+            print(('Converted {} blank profiles to tombstones').format(
+                  ad.convert_blank_profiles()))
 
         if self.args.age:
             wmo_list = ad.get_oxy_floats_from_status(age_gte=self.args.age)
         elif self.args.wmo:
             wmo_list = self.args.wmo
 
+        if self.args.shard:
+            wmo_list = ad.shard_wmo_list(wmo_list, *self.shard())
+            print(('Shard {} has {} floats').format(self.args.shard, len(wmo_list)))
+
         ad.get_float_dataframe(wmo_list, max_profiles=self.args.profiles, 
                                          max_pressure=self.args.pressure,
                                          append_df=False)
 
-        # After loading add lookup information to the cache file
-        df = ad.get_cache_file_oxy_count_df(max_profiles=self.args.profiles, flush=True)
+        # Counts are maintained as profiles are written, verify if requested
+        if self.args.verify_counts:
+            bad_df = ad.verify_cache_file_count_df()
+            if not bad_df.empty:
+                print(('Rebuilding counts, {} do not match').format(len(bad_df)))
+                ad.get_cache_file_count_df(flush=True)
+
+        # Save the means that woa_calibration.py reads before publishing
+        print(('Updated aggregates of {} floats').format(len(ad.update_aggregates())))
+
+        df = ad.get_cache_file_oxy_count_df()
         print(('{} floats appear to have valid oxygen data').format(len(df)))
         print(('Finished loading cache file {}').format(cache_file))
 
+        if generations:
+            print(('Published generation {}').format(generations.publish(cache_file)))
+            for path in generations.gc(self.args.keep_generations):
+                print(('Removed generation {}').format(path))
+
     def process_command_line(self):
         import argparse
         from argparse import RawTextHelpFormatter
@@ -81,6 +129,9 @@ class ArgoDataLoader(object):
         examples += sys.argv[0] + " --age 340 --profiles 20\n"
         examples += sys.argv[0] + " --age 340 --pressure 10\n"
         examples += sys.argv[0] + " --wmo 1900650 1901157 5901073 -v\n"
+        examples += sys.argv[0] + " --age 340 --shard 0/4\n"
+        examples += sys.argv[0] + " --age 340 --discovery index\n"
+        examples += sys.argv[0] + " --age 365 --generations_dir /data/biofloat/age365\n"
         examples += "\n\n"
     
         parser = argparse.ArgumentParser(
@@ -102,11 +153,48 @@ class ArgoDataLoader(object):
         parser.add_argument('--cache_file', action='store', help='Override default file')
         parser.add_argument('--cache_dir', action='store', help='Directory for cache file'
                             ' otherwise it is \nput in the users home directory')
+        parser.add_argument('--shard', action='store',
+                            help='Load only shard i of N (e.g. 0/4) of the floats\n'
+                            'into its own cache file so that N loaders can run in\n'
+                            'parallel; combine them with merge_biofloat_cache.py')
+        parser.add_argument('--generations_dir', action='store',
+                            help='Load into a new generation of the cache file in this\n'
+                            'directory and publish it when done so that readers of\n'
+                            'the directory always see a complete cache file')
+        parser.add_argument('--keep_generations', action='store', type=int, default=2,
+                            help='Number of newest generations to keep, older ones are\n'
+                            'removed once no reader holds them')
         parser.add_argument('--bio_list', action='store', nargs='*', default=['DOXY_ADJUSTED'],
                             help='List of bio variables to look for in N_PROF 1') 
         parser.add_argument('--variables', action='store', nargs='*', 
                             default=['TEMP_ADJUSTED', 'PSAL_ADJUSTED', 'DOXY_ADJUSTED'],
                             help='Bio-Argo variables to add to the DataFrame') 
+        parser.add_argument('--pressure_tolerance', action='store', type=float,
+                            help='Keep the N_PROF 0 pressures and put bio variables\n'
+                            'found only in N_PROF 1 at the nearest pressure within\n'
+                            'this many decibars')
+        parser.add_argument('--standard_levels', action='store', nargs='*', type=float,
+                            help='Pressures to keep each profile interpolated to\n'
+                            'in the cache file for ArgoData.get_standard_levels()')
+        parser.add_argument('--discovery', action='store', choices=['catalog', 'index'],
+                            default='catalog',
+                            help='Find the profiles of each float in its THREDDS\n'
+                            'catalog or all at once in the merge-profile index')
+        parser.add_argument('--qc_accept', action='store', nargs='*', type=int,
+                            help='Store the QC flags of the variables and keep only\n'
+                            'the values with these flags, e.g. 1 2 5 8')
+        parser.add_argument('--batch_profiles', action='store', type=int, default=50,
+                            help='Number of profiles to hold in memory between writes')
+        parser.add_argument('--batch_mb', action='store', type=float, default=50,
+                            help='Megabytes of profile data to hold in memory between writes')
+        parser.add_argument('--batch_seconds', action='store', type=float, default=60,
+                            help='Maximum seconds to hold profile data between writes')
+        parser.add_argument('--verify_counts', action='store_true',
+                            help='Recompute the float profile and measurement counts\n'
+                            'from all the profiles and rebuild them if they differ')
+        parser.add_argument('--convert_blanks', action='store_true',
+                            help='Replace blank profile nodes saved by earlier versions\n'
+                            'with rows in the tombstones table before loading')
         parser.add_argument('-v', '--verbose', nargs='?', choices=[0,1,2,3], type=int,
                             help='0: ERROR, 1: WARN, 2: INFO, 3:DEBUG', default=0, const=2)
 
@@ -117,9 +205,23 @@ class ArgoDataLoader(object):
             print "\n*** Must specify either --age or --wmo ***\n"
             sys.exit(1)
 
+        if self.args.shard:
+            try:
+                shard, num_shards = self.shard()
+                if not 0 <= shard < num_shards:
+                    raise ValueError
+            except ValueError:
+                parser.print_help()
+                print "\n*** --shard must be i/N with 0 <= i < N ***\n"
+                sys.exit(1)
+
 
 if __name__ == '__main__':
 
+    # The watchdog kills stalled loads with SIGTERM, exit normally so
+    # that profiles still held in memory are written to the cache file
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
     adl = ArgoDataLoader()
     adl.process_command_line()
     adl.process()
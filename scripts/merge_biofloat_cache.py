@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+import sys
+from os.path import join, dirname
+parent_dir = join(dirname(__file__), "../")
+sys.path.insert(0, parent_dir)
+
+from biofloat import ArgoData
+
+class CacheMerger(object):
+
+    def process(self):
+        ad = ArgoData(verbosity=self.args.verbose, cache_file=self.args.cache_file)
+        shard_files = ad._get_shard_files(self.args.shards)
+        if not shard_files:
+            print(('No shard files match {}').format(self.args.shards))
+            sys.exit(1)
+
+        print(('Merging {} shard files into {}').format(len(shard_files), 
+                                                        self.args.cache_file))
+        ad.merge_cache_files(shard_files)
+        print(('Finished merging cache file {}').format(self.args.cache_file))
+
+    def process_command_line(self):
+        import argparse
+        from argparse import RawTextHelpFormatter
+
+        examples = 'Examples:' + '\n' 
+        examples += '---------' + '\n' 
+        examples += sys.argv[0] + " --shards '/data/biofloat/biofloat_fixed_cache_age365*_shard*.hdf'"
+        examples += " --cache_file /data/biofloat/biofloat_fixed_cache_age365.hdf\n"
+        examples += "\n\n"
+    
+        parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter,
+                    description='Script to combine the shard cache files written by\n'
+                                'load_biofloat_cache.py --shard i/N into a single\n'
+                                'cache file for publishing.',
+                    epilog=examples)
+                                             
+        parser.add_argument('--shards', action='store', required=True,
+                            help='Directory or quoted glob pattern of shard files')
+        parser.add_argument('--cache_file', action='store', required=True,
+                            help='Full path to merged cache file')
+        parser.add_argument('-v', '--verbose', nargs='?', choices=[0,1,2,3], type=int,
+                            help='0: ERROR, 1: WARN, 2: INFO, 3:DEBUG', default=0, const=2)
+
+        self.args = parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    cm = CacheMerger()
+    cm.process_command_line()
+    cm.process()
+
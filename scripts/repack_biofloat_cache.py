@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from os.path import join, dirname, getsize
+parent_dir = join(dirname(__file__), "../")
+sys.path.insert(0, parent_dir)
+
+from biofloat import ArgoData
+
+class CacheRepacker(object):
+
+    def codec(self, spec):
+        '''Return tuple of complib and complevel from spec, e.g. 'blosc:lz4:5'.
+        '''
+        complib, _, level = spec.rpartition(':')
+        if not level.isdigit():
+            return spec, self.args.complevel
+        return complib, int(level)
+
+    def read_time(self, cache_file):
+        '''Return tuple of seconds and bytes to read all the profiles in cache_file.
+        '''
+        ad = ArgoData(verbosity=self.args.verbose, cache_file=cache_file)
+        start = time.time()
+        df = ad.read()
+        secs = time.time() - start
+
+        return secs, df.memory_usage(index=True).sum()
+
+    def benchmark(self):
+        '''Repack the cache file with each of the codecs into a temporary 
+        directory and report file size and repack and read throughput.
+        '''
+        tmp_dir = tempfile.mkdtemp(dir=self.args.tmp_dir)
+        fmt = '{:>16s} {:>10s} {:>7s} {:>14s} {:>12s}'
+        print(fmt.format('codec', 'file MB', 'ratio', 'repack MB/s', 'read MB/s'))
+        try:
+            size = getsize(self.args.cache_file)
+            secs, nbytes = self.read_time(self.args.cache_file)
+            print(fmt.format('original', '{:.1f}'.format(size / 1e6), '1.00', '',
+                             '{:.1f}'.format(nbytes / secs / 1e6)))
+            for spec in self.args.codecs:
+                complib, complevel = self.codec(spec)
+                out_file = join(tmp_dir, 'repack.hdf')
+                ad = ArgoData(verbosity=self.args.verbose, cache_file=self.args.cache_file)
+                start = time.time()
+                ad.repack(out_file, complib, complevel, not self.args.no_shuffle,
+                          self.args.chunk_rows)
+                repack_secs = time.time() - start
+                secs, nbytes = self.read_time(out_file)
+                print(fmt.format('{}:{}'.format(complib, complevel),
+                                 '{:.1f}'.format(getsize(out_file) / 1e6),
+                                 '{:.2f}'.format(float(getsize(out_file)) / size),
+                                 '{:.1f}'.format(size / repack_secs / 1e6),
+                                 '{:.1f}'.format(nbytes / secs / 1e6)))
+                os.remove(out_file)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def process(self):
+        if self.args.benchmark:
+            self.benchmark()
+            return
+
+        ad = ArgoData(verbosity=self.args.verbose, cache_file=self.args.cache_file)
+        size = getsize(self.args.cache_file)
+        out_file = ad.repack(self.args.out_file, self.args.complib, self.args.complevel,
+                             not self.args.no_shuffle, self.args.chunk_rows)
+        print(('Repacked {} ({:.1f} MB) into {} ({:.1f} MB)').format(
+              self.args.cache_file, size / 1e6, out_file, getsize(out_file) / 1e6))
+
+    def process_command_line(self):
+        import argparse
+        from argparse import RawTextHelpFormatter
+
+        examples = 'Examples:' + '\n' 
+        examples += '---------' + '\n' 
+        examples += sys.argv[0] + " --cache_file /data/biofloat/biofloat_fixed_cache_age365.hdf\n"
+        examples += sys.argv[0] + " --cache_file /data/biofloat/biofloat_fixed_cache_age365.hdf"
+        examples += " --complib blosc:lz4 --complevel 5 --out_file /tmp/lz4.hdf\n"
+        examples += sys.argv[0] + " --cache_file /data/biofloat/biofloat_fixed_cache_age365.hdf"
+        examples += " --benchmark --codecs zlib:1 zlib:9 blosc:lz4:5 blosc:zstd:5\n"
+        examples += "\n\n"
+    
+        parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter,
+                    description='Script to compact a cache file by copying it into a\n'
+                                'fresh compressed file without the space left by\n'
+                                'removed and replaced profiles.',
+                    epilog=examples)
+                                             
+        parser.add_argument('--cache_file', action='store', required=True,
+                            help='Full path to cache file')
+        parser.add_argument('--out_file', action='store',
+                            help='Write the repacked file here instead of replacing cache_file')
+        parser.add_argument('--complib', action='store', default='zlib',
+                            help='Compression library: zlib, lzo, bzip2, blosc or a\n'
+                                 'blosc variant such as blosc:lz4 or blosc:zstd')
+        parser.add_argument('--complevel', action='store', type=int, default=9,
+                            help='Compression level 0-9')
+        parser.add_argument('--no_shuffle', action='store_true',
+                            help='Do not apply the shuffle filter before compressing')
+        parser.add_argument('--chunk_rows', action='store', type=int,
+                            help='Rows per chunk, by default chosen by PyTables')
+        parser.add_argument('--benchmark', action='store_true',
+                            help='Report file size and throughput for each of --codecs\n'
+                                 'without changing cache_file')
+        parser.add_argument('--codecs', action='store', nargs='*', 
+                            default=['zlib:1', 'zlib:5', 'zlib:9', 'lzo:5', 'bzip2:5',
+                                     'blosc:blosclz:5', 'blosc:lz4:5', 'blosc:zstd:5'],
+                            help='complib:complevel codecs to benchmark')
+        parser.add_argument('--tmp_dir', action='store',
+                            help='Directory for the benchmark files')
+        parser.add_argument('-v', '--verbose', nargs='?', choices=[0,1,2,3], type=int,
+                            help='0: ERROR, 1: WARN, 2: INFO, 3:DEBUG', default=0, const=2)
+
+        self.args = parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    cr = CacheRepacker()
+    cr.process_command_line()
+    cr.process()
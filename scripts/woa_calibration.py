@@ -6,9 +6,7 @@ parent_dir = join(dirname(__file__), "../")
 sys.path.insert(0, parent_dir)
 
 import logging
-import matplotlib as plt
 import pandas as pd
-import xray
 
 from biofloat import ArgoData
 from biofloat.utils import o2sat, convert_to_mll
@@ -16,6 +14,7 @@ from biofloat.calibrate import (woa_o2sat, surface_mean, monthly_mean,
                                 add_columns_for_groupby, add_columns_for_woa_lookup,
                                 add_column_from_woa, calculate_gain
                                )
+from biofloat.drift import fit_drift
 
 class WOA_Calibrator(object):
 
@@ -30,25 +29,51 @@ class WOA_Calibrator(object):
 
     def __init__(self):
         self._woa_lookup_count = 0
+        self._monthly_means = {}
 
     def make_plot(self):
+        import matplotlib as plt
+
         plt.style.use('ggplot')
         plt.rcParams['figure.figsize'] = (18.0, 4.0)
         gdf[['o2sat', 'woa_o2sat']].unstack(level=0).plot()
         gdf[['gain']].unstack(level=0).plot()
 
 
-    def woa_lookup(self, df):
-        '''Given a DataFrame of profile data for an Argo float as read from
-        a biofloat cache file, average the data to the spatial temporal
-        grid of the World Ocean Atlas and return a DataFrame with float
-        and WOA O2 saturation columns added.  The WOA lookup goes across
-        the Internet so can take a minute or so to lookup all the values.
+    def float_monthly_mean(self, ad, wmo):
+        '''Return DataFrame of monthly mean surface values for float wmo.
+        These are taken from the aggregates read by read_monthly_means()
+        unless --profiles or --pressure limit the data to use.
+        '''
+        if self.args.profiles or self.args.pressure:
+            df = ad.get_float_dataframe([wmo],
+                                        max_profiles=self.args.profiles, 
+                                        max_pressure=self.args.pressure,
+                                        update_cache=False)
+            if df.empty:
+                return df
+            return monthly_mean(add_columns_for_groupby(surface_mean(df)))
+
+        return self._monthly_means.get(wmo, pd.DataFrame())
+
+    def read_monthly_means(self, ad, wmo_list):
+        '''Read the monthly means of all the floats in wmo_list from the
+        aggregates kept in the cache file at once, rather than float by float.
+        '''
+        if self.args.profiles or self.args.pressure:
+            return
+        mdf = ad.get_monthly_mean(wmo_list)
+        if not mdf.empty:
+            self._monthly_means = dict(list(mdf.groupby(level='wmo')))
+
+    def woa_lookup(self, msdf):
+        '''Given a DataFrame of monthly mean surface values for an Argo 
+        float, as returned by float_monthly_mean(), match the data to the 
+        spatial temporal grid of the World Ocean Atlas and return a DataFrame
+        with float and WOA O2 saturation columns added.  The WOA lookup goes
+        across the Internet so can take a minute or so to lookup all the values.
         '''
         gdf = pd.DataFrame([pd.np.nan])
-        sdf = surface_mean(df)
-        sdf = add_columns_for_groupby(sdf)
-        msdf = monthly_mean(sdf)
         if not msdf.empty:
             msdf = add_columns_for_woa_lookup(msdf)
             self._woa_lookup_count += len(msdf)
@@ -71,6 +96,8 @@ class WOA_Calibrator(object):
             wmo_list = ad.get_cache_file_oxy_count_df()['wmo'].tolist()
 
         self.logger.info('Reading float profile data from %s', self.args.cache_file)
+        self.read_monthly_means(ad, wmo_list)
+        gdfs = []
         for i, wmo in enumerate(wmo_list):
             self.logger.info('WMO_%s: Float %s of %s', wmo, i+1, len(wmo_list))
             try:
@@ -80,11 +107,7 @@ class WOA_Calibrator(object):
                     wmo_gdf = s.get(('/WOA_WMO_{}').format(wmo))
                     self.logger.debug('Done.')
             except KeyError:
-                df = ad.get_float_dataframe([wmo],
-                                            max_profiles=self.args.profiles, 
-                                            max_pressure=self.args.pressure,
-                                            update_cache=False)
-                wmo_gdf = self.woa_lookup(df)
+                wmo_gdf = self.woa_lookup(self.float_monthly_mean(ad, wmo))
 
                 if not wmo_gdf.dropna().empty:
                     # Save intermediate results to HDF file so that the script can
@@ -98,6 +121,16 @@ class WOA_Calibrator(object):
                 self.logger.debug('wmo_gdf head: %s', wmo_gdf.head())
                 self.logger.info('Gain for %s = %s', wmo, 
                                  wmo_gdf.groupby('wmo').gain.mean().values[0])
+                gdfs.append(wmo_gdf[['wmo', 'date', 'gain']])
+
+        if gdfs:
+            # Fit the drift of the gains of all the floats at once
+            ddf = fit_drift(pd.concat(gdfs, ignore_index=True), knots=self.args.knots)
+            for wmo, r in ddf.iterrows():
+                self.logger.info('Gain drift for %s = %s per year from %s', wmo, 
+                                 r['slope'], r['intercept'])
+            with pd.HDFStore(self.args.results_file) as s:
+                s.put('/drift', ddf)
 
     def process_command_line(self):
         import argparse
@@ -119,14 +152,17 @@ class WOA_Calibrator(object):
                                             required=True)
         parser.add_argument('--wmo', action='store', nargs='*', default=[],
                                      help='One or more WMO numbers to read from cache file')
-        parser.add_argument('--profiles', action='store', 
+        parser.add_argument('--profiles', action='store', type=int,
                                      help='Maximum number of profiles to read in')
-        parser.add_argument('--pressure', action='store', 
+        parser.add_argument('--pressure', action='store', type=int,
                                      help='Maximum pressure to read in')
         parser.add_argument('--print_woa_lookups', action='store_true', 
                                      help='In conjunction with -v print WOA lookups')
         parser.add_argument('--results_file', action='store', required=True,
                              help='File name for float and woa surface saturation values')
+        parser.add_argument('--knots', action='store', type=int, default=0,
+                             help='Number of changes of slope in the fitted gain drift\n'
+                                  'of each float, saved as /drift in results_file')
         parser.add_argument('-v', '--verbose', nargs='?', choices=[0,1,2,3], type=int,
                             help='0: ERROR, 1: WARN, 2: INFO, 3:DEBUG', default=0, const=2)
 
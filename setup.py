@@ -65,7 +65,15 @@ setup(
         'statsmodels>=0.6.1',
         'xray>=0.6'
     ],
-    scripts = ['scripts/load_biofloat_cache.py',
+    extras_require = {
+        'netcdf': ['netCDF4>=1.2'],
+        'zarr': ['zarr>=2.2'],
+    },
+    scripts = ['scripts/delta_biofloat_cache.py',
+               'scripts/export_biofloat_cache.py',
+               'scripts/load_biofloat_cache.py',
+               'scripts/merge_biofloat_cache.py',
+               'scripts/repack_biofloat_cache.py',
                'scripts/woa_calibration.py'],
     cmdclass = {'install_scripts': my_install_scripts},
 
@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+'''Benchmarks of biofloat operations on synthetic data that do not need
+network access.  Run with --help to see the available benchmarks.
+'''
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+parentDir = os.path.join(os.path.dirname(__file__), "../")
+sys.path.insert(0, parentDir)
+
+import numpy as np
+import pandas as pd
+
+from datetime import datetime
+from biofloat import ArgoData
+from biofloat.CacheWriter import CacheWriter
+from biofloat.aggregate import grid_aggregate
+from biofloat.drift import fit_drift
+
+
+# Seconds allowed for starting Python, importing biofloat and reading a cache
+IMPORT_TIME_BUDGET = 1.5
+
+# Factor on IMPORT_TIME_BUDGET that the unit test allows for loaded machines
+IMPORT_TIME_MARGIN = 3
+
+# Network, parsing and plotting modules that cache-only code must not import
+LAZY_MODULES = ('xray', 'bs4', 'requests', 'pydap.client', 'matplotlib')
+
+
+def synthetic_profile(wmo, profile, nlevels):
+    '''Return DataFrame of one profile in the layout of _profile_to_dataframe().
+    '''
+    time = pd.Timestamp('2015-01-01') + pd.Timedelta(days=10 * profile)
+    lon = -150 + 0.01 * profile
+    lat = 20 + 0.01 * profile
+    pressures = np.round(np.sort(np.random.uniform(0, 2000, nlevels)), 2)
+    indices = pd.MultiIndex.from_tuples(
+            [(wmo, time, lon, lat, profile, p) for p in pressures],
+            names=['wmo', 'time', 'lon', 'lat', 'profile', 'pressure'])
+
+    return pd.DataFrame({'TEMP_ADJUSTED': np.random.uniform(2, 25, nlevels),
+                         'PSAL_ADJUSTED': np.random.uniform(33, 36, nlevels),
+                         'DOXY_ADJUSTED': np.random.uniform(0, 300, nlevels)},
+                        index=indices)
+
+
+def write_synthetic_cache(ad, nfloats, nprofiles, nlevels):
+    '''Write nfloats * nprofiles synthetic profiles into ad's cache_file the
+    way _get_data_from_argo() does, return list of the wmo numbers.
+    '''
+    wmo_list = [str(1900000 + f) for f in range(nfloats)]
+    ad._init_profile_tables()
+    ad._writer = CacheWriter(ad.cache_file, ad._write_profiles, **ad._batch_parms)
+    try:
+        for wmo in wmo_list:
+            for profile in range(1, nprofiles + 1):
+                url = 'http://localhost/dodsC/profiles/D{}_{:03d}.nc'.format(wmo, profile)
+                key, _ = ad._float_profile_key(url)
+                ad._put_profile(synthetic_profile(wmo, profile, nlevels), key,
+                                dict(url=url, dateloaded=datetime.utcnow()))
+    finally:
+        ad._writer.close()
+        ad._writer = None
+
+    return wmo_list
+
+
+def synthetic_catalog(wmo, nprofiles, codes=('R', 'D', 'MR', 'BD')):
+    '''Return THREDDS catalog.xml text for a float's profiles directory with
+    nprofiles profiles for each of codes, as served by the Ifremer GDAC.
+    '''
+    dataset = ('  <dataset name="{0}{1}_{2:03d}.nc" ID="argo/{0}{1}_{2:03d}.nc"'
+               ' urlPath="CORIOLIS-ARGO-GDAC-OBS/aoml/{1}/profiles/{0}{1}_{2:03d}.nc">\n'
+               '    <dataSize units="Kbytes">58.11</dataSize>\n'
+               '    <date type="modified">2015-12-01T10:16:04Z</date>\n'
+               '  </dataset>\n')
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+             '<catalog xmlns="http://www.unidata.ucar.edu/namespaces/thredds/'
+             'InvCatalog/v1.0" name="profiles" version="1.0.1">\n',
+             '<dataset name="profiles" ID="argo/{}/profiles">\n'.format(wmo)]
+    for profile in range(1, nprofiles + 1):
+        for code in codes:
+            lines.append(dataset.format(code, wmo, profile))
+    lines.append('</dataset>\n</catalog>\n')
+
+    return ''.join(lines)
+
+
+def _soup_url_keys(ad, xml, base_url):
+    '''The BeautifulSoup parsing that get_profile_opendap_urls() used to do.
+    '''
+    import re
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(xml, 'html.parser')
+    urls = [base_url + e['urlpath'] for e in 
+            soup.findAll('dataset', attrs={'urlpath': re.compile("nc$")})]
+    return [(url,) + ad._float_profile_key(url) for url in ad._sort_opendap_urls(urls)]
+
+
+def bench_catalog(nprofiles=(100, 1000, 5000), repeat=3):
+    '''Compare BeautifulSoup and streaming parsing of THREDDS catalogs into 
+    the sorted (url, key, code) list used by _get_data_from_argo().
+    '''
+    from io import BytesIO
+    ad = ArgoData()
+    base_url = 'http://tds0.ifremer.fr/thredds/dodsC/'
+    fmt = '{:>10s} {:>10s} {:>10s} {:>10s} {:>8s}'
+    print(fmt.format('datasets', 'KB', 'soup s', 'stream s', 'speedup'))
+    for n in nprofiles:
+        xml = synthetic_catalog('1900650', n)
+        soup_secs = stream_secs = float('inf')
+        for _ in range(repeat):
+            start = time.time()
+            soup_keys = _soup_url_keys(ad, xml, base_url)
+            soup_secs = min(soup_secs, time.time() - start)
+            start = time.time()
+            stream_keys = ad._parse_catalog(BytesIO(xml.encode('utf-8')), base_url)
+            stream_secs = min(stream_secs, time.time() - start)
+        assert soup_keys == stream_keys
+        print(fmt.format(str(len(stream_keys)), '{:.0f}'.format(len(xml) / 1e3),
+                         '{:.3f}'.format(soup_secs), '{:.3f}'.format(stream_secs),
+                         '{:.1f}'.format(soup_secs / stream_secs)))
+
+
+def frame_bytes(df):
+    '''Return bytes used by df including its index.
+    '''
+    return df.memory_usage(index=True, deep=True).sum()
+
+
+def bench_compact(nfloats=20, nprofiles=100, nlevels=500):
+    '''Compare file size, write and read times and in-memory size of the
+    default and compact cache layouts.  The 'append' row is the previous
+    read path that appended profile DataFrames one at a time.
+    '''
+    tmp_dir = tempfile.mkdtemp()
+    fmt = '{:>8s} {:>12s} {:>10s} {:>10s} {:>12s}'
+    print(('{} floats x {} profiles x {} levels').format(nfloats, nprofiles, nlevels))
+    print(fmt.format('layout', 'file MB', 'write s', 'read s', 'frame MB'))
+    try:
+        for layout in ('append', 'default', 'compact'):
+            ad = ArgoData(cache_file=os.path.join(tmp_dir, layout + '.hdf'),
+                          compact=(layout == 'compact'))
+            np.random.seed(1)
+            start = time.time()
+            wmo_list = write_synthetic_cache(ad, nfloats, nprofiles, nlevels)
+            write_secs = time.time() - start
+
+            start = time.time()
+            if layout == 'append':
+                df = pd.DataFrame()
+                for name in ad.get_profile_metadata()['name']:
+                    df = df.append(ad._get_df(name)[0])
+            else:
+                df = ad.get_float_dataframe(wmo_list, update_cache=False)
+            read_secs = time.time() - start
+
+            print(fmt.format(layout, '{:.1f}'.format(os.path.getsize(ad.cache_file) / 1e6),
+                             '{:.2f}'.format(write_secs), '{:.2f}'.format(read_secs),
+                             '{:.1f}'.format(frame_bytes(df) / 1e6)))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+_OXYGEN_CODE = '''
+import time, resource
+import numpy as np
+from biofloat import utils
+np.random.seed(1)
+s = np.random.uniform(30, 37, {block})
+t = np.random.uniform(-1, 30, {block})
+p = np.random.uniform(0, 2000, {block})
+o2 = np.random.uniform(0, 350, {block})
+o2sat, o2_mll = np.empty({block}), np.empty({block})
+base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.time()
+for _ in range({nblocks}):
+    if {chunked}:
+        utils.percent_saturation(o2, s, t, out=o2sat, chunksize={chunksize})
+        utils.convert_to_mll_chunked(o2, s, t, p, out=o2_mll, chunksize={chunksize})
+    else:
+        o2sat = 100 * o2 / utils.o2sat(s, t)
+        o2_mll = utils.convert_to_mll(o2, s, t, p)
+print(time.time() - start)
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base)
+'''
+
+
+def bench_oxygen(nsamples=100000000, block=10000000, chunksize=1000000):
+    '''Compare time and peak memory of computing percent oxygen saturation
+    and ml/l oxygen for nsamples values, streamed block values at a time,
+    with the utils functions and their chunked versions.  Each runs in its
+    own interpreter so that its peak memory can be measured.
+    '''
+    fmt = '{:>10s} {:>12s} {:>10s} {:>16s}'
+    print(('{:.0e} samples in blocks of {:.0e}, chunksize {:.0e}').format(
+          nsamples, block, chunksize))
+    print(fmt.format('', 'samples/s', 'seconds', 'peak extra MB'))
+    for chunked in (False, True):
+        code = _OXYGEN_CODE.format(block=block, nblocks=max(nsamples // block, 1), 
+                                   chunked=chunked, chunksize=chunksize)
+        out = subprocess.check_output([sys.executable, '-W', 'ignore', '-c', code],
+                                      cwd=parentDir).decode().split()
+        secs, rss_kb = float(out[0]), float(out[1])
+        print(fmt.format('chunked' if chunked else 'utils', 
+                         '{:.3g}'.format(nsamples / secs), '{:.1f}'.format(secs),
+                         '{:.0f}'.format(rss_kb / 1e3)))
+
+
+def bench_standard_levels(nfloats=20, nprofiles=100, nlevels=500,
+                          levels=np.arange(0, 2001, 10)):
+    '''Compare interpolating every profile read from the cache to levels
+    with reading the gridded values maintained in the cache file.
+    '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        ad = ArgoData(cache_file=os.path.join(tmp_dir, 'levels.hdf'), 
+                      standard_levels=levels)
+        np.random.seed(1)
+        start = time.time()
+        wmo_list = write_synthetic_cache(ad, nfloats, nprofiles, nlevels)
+        print(('Wrote {} profiles with standard levels in {:.2f} s').format(
+              nfloats * nprofiles, time.time() - start))
+
+        start = time.time()
+        df = ad.get_float_dataframe(wmo_list, update_cache=False)
+        grid = []
+        for _, pdf in df['DOXY_ADJUSTED'].groupby(level=['wmo', 'profile']):
+            pressures = pdf.index.get_level_values('pressure').values
+            grid.append(np.interp(levels, pressures, pdf.values, 
+                                  left=np.nan, right=np.nan))
+        print(('{:>30s} {:.2f} s').format('read and interpolate', time.time() - start))
+
+        start = time.time()
+        grid = ad.get_standard_levels('DOXY_ADJUSTED', wmo_list).values
+        print(('{:>30s} {:.2f} s').format('get_standard_levels', time.time() - start))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def bench_grid(nfloats=20, nprofiles=100, nlevels=500):
+    '''Compare reading all floats and grouping by lon, lat, time and pressure
+    bins with the streaming grid_aggregate().
+    '''
+    tmp_dir = tempfile.mkdtemp()
+    lon_bins = np.arange(-150, -148.9, 0.1)
+    lat_bins = np.arange(20, 21.1, 0.1)
+    time_bins = pd.date_range('2015-01-01', '2018-01-01', freq='MS')
+    pressure_bins = [0, 10, 50, 100, 200, 500, 1000, 2000]
+    try:
+        ad = ArgoData(cache_file=os.path.join(tmp_dir, 'grid.hdf'))
+        np.random.seed(1)
+        wmo_list = write_synthetic_cache(ad, nfloats, nprofiles, nlevels)
+
+        start = time.time()
+        df = ad.get_float_dataframe(wmo_list, update_cache=False).reset_index()
+        df['lon'] = pd.cut(df['lon'], lon_bins, right=False)
+        df['lat'] = pd.cut(df['lat'], lat_bins, right=False)
+        df['time'] = df['time'].dt.to_period('M')
+        df['pressure'] = pd.cut(df['pressure'], pressure_bins, right=False)
+        df.groupby(['time', 'pressure', 'lat', 'lon'])['DOXY_ADJUSTED'].agg(
+                   ['count', 'mean', 'var'])
+        print(('{:>30s} {:.2f} s, frame {:.0f} MB').format('read and groupby',
+              time.time() - start, frame_bytes(df) / 1e6))
+
+        start = time.time()
+        grid_aggregate(ad, ['DOXY_ADJUSTED'], lon_bins, lat_bins, time_bins,
+                       pressure_bins)
+        print(('{:>30s} {:.2f} s').format('grid_aggregate', time.time() - start))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def bench_collection(nfloats=20, nprofiles=100, nlevels=500):
+    '''Compare the memory and per profile surface means of the MultiIndex
+    DataFrame and the ProfileCollection read from the same cache.
+    '''
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        ad = ArgoData(cache_file=os.path.join(tmp_dir, 'collection.hdf'),
+                      frame_cache_bytes=0)
+        np.random.seed(1)
+        wmo_list = write_synthetic_cache(ad, nfloats, nprofiles, nlevels)
+
+        start = time.time()
+        df = ad.get_float_dataframe(wmo_list, update_cache=False)
+        read_secs = time.time() - start
+        start = time.time()
+        sdf = df.query('pressure <= 10')
+        sdf.groupby(level=['wmo', 'profile'])['DOXY_ADJUSTED'].mean()
+        print(('{:>30s} read {:.2f} s, surface means {:.2f} s, {:.0f} MB').format(
+              'DataFrame', read_secs, time.time() - start, frame_bytes(df) / 1e6))
+
+        start = time.time()
+        pc = ad.get_float_dataframe(wmo_list, update_cache=False, as_collection=True)
+        read_secs = time.time() - start
+        start = time.time()
+        pc.reduce('DOXY_ADJUSTED', 'mean', max_pressure=10)
+        print(('{:>30s} read {:.2f} s, surface means {:.2f} s, {:.0f} MB').format(
+              'ProfileCollection', read_secs, time.time() - start, pc.nbytes / 1e6))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def bench_drift(nfloats=5000, nmonths=60, knots=1):
+    '''Compare fitting the gain drift of each float with np.linalg.lstsq()
+    in a loop over the floats with fit_drift() of the stacked gain table.
+    '''
+    np.random.seed(1)
+    dates = pd.date_range('2012-01-01', periods=nmonths, freq='MS')
+    t = np.tile(np.asarray((dates - dates[0]).days) / 365.25, nfloats)
+    gdf = pd.DataFrame(dict(wmo=np.repeat(np.arange(nfloats) + 1900000, nmonths),
+                            date=np.tile(dates.values, nfloats),
+                            gain=1 + 0.01 * t + np.random.normal(0, 0.01, len(t))))
+
+    start = time.time()
+    for _, df in gdf.groupby('wmo'):
+        ty = np.asarray((df['date'] - df['date'].min()).dt.days) / 365.25
+        X = np.column_stack([np.ones(len(ty)), ty] + [np.maximum(0, ty - 
+                            ty.max() * (k + 1.) / (knots + 1)) for k in range(knots)])
+        np.linalg.lstsq(X, df['gain'].values)
+    print(('{:>30s} {:.2f} s').format('per float lstsq', time.time() - start))
+
+    start = time.time()
+    fit_drift(gdf, knots)
+    print(('{:>30s} {:.2f} s').format('fit_drift', time.time() - start))
+
+
+def import_time(statement='import biofloat', repeat=5):
+    '''Return tuple of the best wall clock seconds to run statement in a 
+    fresh Python interpreter and a list of the LAZY_MODULES it imported.
+    '''
+    code = ('import sys, time; start = time.time(); {}; '
+            'print(time.time() - start); '
+            'print(" ".join(m for m in {!r} if m in sys.modules))'
+           ).format(statement, LAZY_MODULES)
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        out = subprocess.check_output([sys.executable, '-W', 'ignore', '-c', code],
+                                      cwd=parentDir).decode().split('\n')
+        times.append(time.time() - start)
+
+    return min(times), out[1].split()
+
+
+def bench_import_time(repeat=5):
+    '''Report startup time of importing biofloat, reading a cache file and 
+    importing the scripts against IMPORT_TIME_BUDGET.  Return the number
+    of statements over budget or importing any of the LAZY_MODULES.
+    '''
+    tmp_dir = tempfile.mkdtemp()
+    cache_file = os.path.join(tmp_dir, 'import.hdf')
+    wmo_list = write_synthetic_cache(ArgoData(cache_file=cache_file), 1, 2, 10)
+    statements = [
+        ('import', 'import biofloat'),
+        ('cache read', ('import biofloat; biofloat.ArgoData(cache_file={!r})'
+                        '.get_float_dataframe({!r}, update_cache=False)'
+                       ).format(cache_file, wmo_list)),
+    ]
+    for script in ('load_biofloat_cache', 'woa_calibration'):
+        statements.append((script + '.py', 
+            'sys.path.insert(0, "scripts"); import {}'.format(script)))
+
+    fmt = '{:>30s} {:>10s} {:>8s}  {}'
+    print(fmt.format('', 'seconds', 'budget', 'lazy modules imported'))
+    failures = 0
+    try:
+        for name, statement in statements:
+            secs, imported = import_time(statement, repeat)
+            print(fmt.format(name, '{:.2f}'.format(secs), 
+                             'OK' if secs <= IMPORT_TIME_BUDGET else 'OVER',
+                             ' '.join(imported)))
+            if secs > IMPORT_TIME_BUDGET or imported:
+                failures += 1
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    return failures
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run biofloat benchmarks')
+    parser.add_argument('--compact', action='store_true',
+                        help='Compare default and compact cache layouts')
+    parser.add_argument('--import_time', action='store_true',
+                        help='Check startup times against IMPORT_TIME_BUDGET')
+    parser.add_argument('--catalog', action='store_true',
+                        help='Compare BeautifulSoup and streaming catalog parsing')
+    parser.add_argument('--oxygen', action='store_true',
+                        help='Compare utils and chunked oxygen saturation kernels')
+    parser.add_argument('--samples', action='store', type=float, default=1e8,
+                        help='Number of samples for --oxygen')
+    parser.add_argument('--standard_levels', action='store_true',
+                        help='Compare interpolating profiles with reading standard levels')
+    parser.add_argument('--grid', action='store_true',
+                        help='Compare groupby and grid_aggregate() gridding')
+    parser.add_argument('--collection', action='store_true',
+                        help='Compare DataFrame and ProfileCollection reads')
+    parser.add_argument('--drift', action='store_true',
+                        help='Compare per float and stacked gain drift fits')
+    parser.add_argument('--floats', action='store', type=int, default=20,
+                        help='Number of synthetic floats')
+    parser.add_argument('--profiles', action='store', type=int, default=100,
+                        help='Number of synthetic profiles per float')
+    parser.add_argument('--levels', action='store', type=int, default=500,
+                        help='Number of pressure levels per synthetic profile')
+    args = parser.parse_args()
+
+    if args.compact:
+        bench_compact(args.floats, args.profiles, args.levels)
+    if args.import_time and bench_import_time():
+        sys.exit('Startup over IMPORT_TIME_BUDGET or imported LAZY_MODULES')
+    if args.catalog:
+        bench_catalog()
+    if args.standard_levels:
+        bench_standard_levels(args.floats, args.profiles, args.levels)
+    if args.grid:
+        bench_grid(args.floats, args.profiles, args.levels)
+    if args.collection:
+        bench_collection(args.floats, args.profiles, args.levels)
+    if args.drift:
+        bench_drift()
+    if args.oxygen:
+        bench_oxygen(int(args.samples))
@@ -2,13 +2,34 @@
 
 import os
 import sys
+import shutil
+import tempfile
 import unittest
+import numpy as np
+import pandas as pd
+
+from datetime import datetime
 parentDir = os.path.join(os.path.dirname(__file__), "../")
 sys.path.insert(0, parentDir)
 
 from biofloat import ArgoData
 from biofloat import utils
 from biofloat import converters
+from biofloat import aggregate
+from biofloat import drift
+from biofloat.CacheWriter import CacheWriter
+from biofloat.SpilledFrame import SpilledFrame
+
+def export_zarr(args):
+    '''Export floats of a cache file to a shared zarr store in a worker 
+    process of CacheTest.test_zarr_export().
+    '''
+    import zarr
+    cache_file, wmo_list, store = args
+    ad = ArgoData(cache_file=cache_file)
+    return converters.to_zarr(ad.iter_floats(wmo_list, as_collection=True), store,
+                              chunk_samples=4, 
+                              synchronizer=zarr.ProcessSynchronizer(store + '.sync'))
 
 class DataTest(unittest.TestCase):
     def setUp(self):
@@ -123,5 +144,988 @@ class DataTest(unittest.TestCase):
     def test_remove_df(self):
         self.ad._remove_df(self.ad._GLOBAL_META)
 
+class CacheTest(unittest.TestCase):
+    '''Tests of cache file operations that do not need network access.
+    '''
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmp_dir, 'biofloat_test_cache.hdf')
+        self.ad = ArgoData(verbosity=0, cache_file=self.cache_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _profile_df(self, wmo, profile, nlevels=5):
+        time = pd.Timestamp('2015-01-01') + pd.Timedelta(days=10 * profile)
+        indices = pd.MultiIndex.from_tuples(
+                [(wmo, time, -122.5, 36.5, profile, float(p)) for p in range(nlevels)],
+                names=['wmo', 'time', 'lon', 'lat', 'profile', 'pressure'])
+        return pd.DataFrame({'TEMP_ADJUSTED': np.linspace(15, 10, nlevels),
+                             'PSAL_ADJUSTED': np.linspace(33, 34, nlevels),
+                             'DOXY_ADJUSTED': np.linspace(250, 200, nlevels)},
+                            index=indices)
+
+    def _metadata(self, wmo, profile, code='D'):
+        url = ('http://tds0.ifremer.fr/thredds/dodsC/CORIOLIS-ARGO-GDAC-OBS/'
+               'aoml/{0}/profiles/{1}{0}_{2:03d}.nc').format(wmo, code, profile)
+        return dict(url=url, dateloaded=datetime.utcnow())
+
+    def _load_profiles(self, ad, wmo, num_profiles=2, code='D'):
+        for profile in range(1, num_profiles + 1):
+            m = self._metadata(wmo, profile, code)
+            key, _ = ad._float_profile_key(m['url'])
+            ad._put_df(self._profile_df(wmo, profile), key, m)
+
+    def test_sharded_cache(self):
+        wmo_list = ['1900650', '1900651', '1900652', '1900653']
+        shards = [self.ad.shard_wmo_list(wmo_list, i, 2) for i in range(2)]
+        self.assertEqual(sorted(shards[0] + shards[1]), wmo_list)
+        for i, shard_wmos in enumerate(shards):
+            shard_file = os.path.join(self.tmp_dir, 
+                            'biofloat_test_cache_shard{}of2.hdf'.format(i))
+            ad = ArgoData(cache_file=shard_file)
+            for wmo in shard_wmos:
+                self._load_profiles(ad, wmo)
+
+        ad = ArgoData(cache_file=os.path.join(self.tmp_dir, '*_shard*.hdf'),
+                      index_ttl_days=None, discovery='index')
+        self.assertEqual([(s.index_ttl_days, s.discovery) for s in ad._shards],
+                         [(None, 'index')] * 2)
+        self.assertEqual(sorted(ad.get_cache_file_all_wmo_list()), wmo_list)
+        self.assertRaises(IOError, ArgoData, 
+                          cache_file=os.path.join(self.tmp_dir, '*_none*.hdf'))
+        df = ad.get_float_dataframe(wmo_list, update_cache=False)
+        self.assertEqual(len(df), 4 * 2 * 5)
+        self.assertEqual(len(ad.get_cache_file_oxy_count_df()), 4)
+
+        # Floats are returned in wmo_list order whichever shard holds them
+        interleaved = ['1900653', '1900650', '1900651', '1900652']
+        self.assertEqual([w in shards[0] for w in interleaved], [False, True] * 2)
+        for df in (ad.get_float_dataframe(interleaved, update_cache=False),
+                   ad.read(interleaved), 
+                   pd.concat(ad.iter_floats(interleaved))):
+            self.assertEqual(df.index.get_level_values('wmo').unique().tolist(),
+                             interleaved)
+        pc = ad.read(interleaved, as_collection=True)
+        self.assertEqual(pd.unique(pc.wmo).tolist(), interleaved)
+
+        self.ad.merge_cache_files(os.path.join(self.tmp_dir, '*_shard*.hdf'))
+        self.assertEqual(sorted(self.ad.get_cache_file_all_wmo_list()), wmo_list)
+        df = self.ad.get_float_dataframe(wmo_list, update_cache=False)
+        self.assertEqual(len(df), 4 * 2 * 5)
+
+    def test_cache_writer(self):
+        writer = CacheWriter(self.cache_file, self.ad._write_profiles, max_profiles=3)
+        try:
+            for profile in range(1, 5):
+                writer.put('/WMO_1900650/P{:03d}'.format(profile),
+                           self._profile_df('1900650', profile),
+                           self._metadata('1900650', profile))
+                if profile == 2:
+                    raise IOError('Simulated failure')
+        except IOError:
+            pass
+        finally:
+            self.assertEqual(len(writer), 2)
+            writer.close()
+
+        self.assertEqual(len(writer), 0)
+        df, m = self.ad._get_df('/WMO_1900650/P002')
+        self.assertEqual(len(df), 5)
+        self.assertEqual(m['url'], self._metadata('1900650', 2)['url'])
+
+        # A failed write is reported once and not retried by close()
+        def failing_write(store, batch):
+            raise IOError('Simulated write failure')
+
+        writer = CacheWriter(self.cache_file, failing_write)
+        writer.put('/WMO_1900650/P003', self._profile_df('1900650', 3),
+                   self._metadata('1900650', 3))
+        with self.assertRaises(IOError):
+            try:
+                writer.flush()
+            finally:
+                writer.close()
+        with self.assertRaises(ValueError):
+            writer.put('/WMO_1900650/P004', self._profile_df('1900650', 4),
+                       self._metadata('1900650', 4))
+
+    def test_cache_file_count_df(self):
+        self._load_profiles(self.ad, '1900650', num_profiles=2)
+        df = self.ad.get_cache_file_oxy_count_df()
+        self.assertEqual(df['num_profiles'].tolist(), [2])
+        self.assertEqual(df['num_measurements'].tolist(), [10])
+
+        # Counts are maintained as profiles are written and replaced
+        self.ad._put_profile(self._profile_df('1900650', 3, nlevels=3), 
+                             '/WMO_1900650/P003', dict(url='x'))
+        self.ad._put_profile(self._profile_df('1900650', 1, nlevels=1), 
+                             '/WMO_1900650/P001', dict(url='x'))
+        self.ad._put_profile(self._profile_df('1900651', 1, nlevels=4), 
+                             '/WMO_1900651/P001', dict(url='x'))
+        df = self.ad.get_cache_file_oxy_count_df().set_index('wmo')
+        self.assertEqual(df.loc['1900650', 'num_profiles'], 3)
+        self.assertEqual(df.loc['1900650', 'num_measurements'], 1 + 5 + 3)
+        self.assertEqual(df.loc['1900651', 'num_measurements'], 4)
+        self.assertTrue(self.ad.verify_cache_file_count_df().empty)
+
+    def test_profile_manifest(self):
+        self._load_profiles(self.ad, '1900650', num_profiles=2)
+        df = self.ad.get_profile_metadata()
+        self.assertEqual(df['name'].tolist(), ['/WMO_1900650/P002', '/WMO_1900650/P001'])
+        self.assertEqual(df['nrows'].tolist(), [5, 5])
+
+        # Profiles written after the manifest exists are added to it
+        self.ad._init_profile_tables()
+        self.ad._put_profile(self._profile_df('1900650', 3), '/WMO_1900650/P003',
+                             self._metadata('1900650', 3))
+        self.ad._remove_df('/WMO_1900650/P001')
+        df = self.ad.get_profile_metadata()
+        self.assertEqual(df['name'].tolist(), ['/WMO_1900650/P003', '/WMO_1900650/P002'])
+        self.assertTrue((df['nbytes'] > 0).all())
+        pd.util.testing.assert_frame_equal(df, self.ad.get_profile_metadata(flush=True))
+
+    def test_compact(self):
+        self._load_profiles(self.ad, '1900650', num_profiles=3)
+        df = self.ad.get_float_dataframe(['1900650'], update_cache=False)
+        self.assertEqual(df.index.names, self.ad._index_names)
+
+        ad = ArgoData(cache_file=os.path.join(self.tmp_dir, 'compact.hdf'), compact=True)
+        for profile in range(1, 4):
+            ad._put_profile(self._profile_df('1900650', profile), 
+                            '/WMO_1900650/P{:03d}'.format(profile),
+                            self._metadata('1900650', profile))
+        cdf = ad.get_float_dataframe(['1900650'], update_cache=False)
+        self.assertTrue((cdf.dtypes == np.float32).all())
+        self.assertTrue((cdf.index.get_level_values('lon') == -122.5).all())
+        pd.util.testing.assert_frame_equal(cdf.astype(np.float64), df, 
+                                           check_index_type=False)
+
+        # Compact storage is read back as the usual float64 DataFrame
+        ad.compact = False
+        pd.util.testing.assert_frame_equal(df, ad.get_float_dataframe(['1900650'], 
+                                           update_cache=False), check_less_precise=True)
+
+    def test_read(self):
+        self._load_profiles(self.ad, '1900650', num_profiles=3)
+        self._load_profiles(self.ad, '1900651', num_profiles=2, code='R')
+        df = self.ad.get_profile_metadata()
+        self.assertEqual(df['pmax'].tolist(), [4] * 5)
+        self.assertEqual(df['time'].min(), pd.Timestamp('2015-01-11'))
+
+        df = self.ad.read(['1900650', '1900651'], time=('2015-01-15', None),
+                          pressure=(1, 2), variables=['DOXY_ADJUSTED'], codes=['d'])
+        self.assertEqual(df.columns.tolist(), ['DOXY_ADJUSTED'])
+        self.assertEqual(sorted(set(df.index.get_level_values('profile'))), [2, 3])
+        self.assertEqual(sorted(set(df.index.get_level_values('pressure'))), [1, 2])
+        self.assertEqual(len(df), 4)
+
+        # Profiles outside the constraints are not read
+        self.assertEqual(len(self.ad._query_manifest(time=(None, '2015-01-15'))), 2)
+        self.assertTrue(self.ad._query_manifest(pressure=(10, None)).empty)
+
+        dfs = list(self.ad.iter_read(['1900651'], max_profiles=1))
+        self.assertEqual(len(dfs), 1)
+        self.assertEqual(dfs[0].index.get_level_values('profile')[0], 2)
+        df = self.ad.get_float_dataframe(['1900651'], max_pressure=3, 
+                                         update_cache=False)
+        self.assertEqual(len(df), 2 * 4)
+
+    def test_frame_cache(self):
+        self._load_profiles(self.ad, '1900650', num_profiles=2)
+        self._load_profiles(self.ad, '1900651', num_profiles=1)
+        self.ad._init_profile_tables()
+        df = self.ad.read(['1900650', '1900651'], pressure=(1, 2))
+        df['TEMP_ADJUSTED'] = 0
+        df = self.ad.read(['1900650', '1900651'], pressure=(1, 2))
+        self.assertTrue((df['TEMP_ADJUSTED'] > 0).all())
+        info = self.ad.frame_cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['entries']), (2, 2, 2))
+
+        # Writing a profile invalidates only that float's DataFrames
+        self.ad._put_profile(self._profile_df('1900650', 3), '/WMO_1900650/P003',
+                             self._metadata('1900650', 3))
+        self.assertEqual(len(self.ad.read(['1900650'], pressure=(1, 2))), 3 * 2)
+        self.ad.read(['1900651'], pressure=(1, 2))
+        info = self.ad.frame_cache_info()
+        self.assertEqual((info['hits'], info['misses']), (3, 3))
+
+        # Lists of constraints share the entries of the equal tuples
+        self.assertEqual(len(self.ad.read(['1900651'], pressure=[1, 2])), 2)
+        self.ad.update_aggregates()
+        info = self.ad.frame_cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['entries']), (4, 3, 2))
+
+        # Least recently used DataFrames are evicted to stay within max_bytes
+        from biofloat.FrameCache import FrameCache
+        fc = FrameCache(max_bytes=int(df.memory_usage(index=True).sum()) * 2)
+        for key in 'abc':
+            fc.put((key,), df)
+        self.assertEqual([k in fc for k in [('a',), ('b',), ('c',)]],
+                         [False, True, True])
+        fc.invalidate(['b'])
+        self.assertEqual(len(fc), 1)
+
+        ad = ArgoData(cache_file=self.cache_file, frame_cache_bytes=0)
+        self.assertIsNone(ad.frame_cache_info())
+        self.assertEqual(len(ad.read(['1900650'])), 3 * 5)
+
+    def test_index_refresh(self):
+        status = pd.DataFrame({'WMO': [1900650, 1900651], 'OXYGEN': [1, 0]})
+        calls = []
+        def fetch(url, metadata):
+            calls.append(metadata.get('etag'))
+            if metadata.get('etag') == 'v1':
+                return None, {}
+            return status, dict(etag='v1')
+
+        url = 'http://example.com/argo_all.txt'
+        df = self.ad._get_index(self.ad._STATUS, url, fetch)
+        pd.util.testing.assert_frame_equal(df, status)
+        self.ad._get_index(self.ad._STATUS, url, fetch)
+        self.assertEqual(calls, [None])
+
+        # Expired tables are checked with the saved validators
+        ad = ArgoData(cache_file=self.cache_file, index_ttl_days=0)
+        pd.util.testing.assert_frame_equal(ad._get_index(ad._STATUS, url, fetch), status)
+        self.assertEqual(calls, [None, 'v1'])
+        status = status.iloc[:1]
+        ad._get_index(ad._STATUS, 'http://example.com/new.txt', fetch)
+        df, metadata = ad._get_df(ad._STATUS)
+        self.assertEqual(len(df), 1)
+        self.assertEqual(metadata['url'], 'http://example.com/new.txt')
+        with pd.HDFStore(self.cache_file) as store:
+            self.assertEqual(store.keys(), ['/' + ad._STATUS])
+
+        # A cached table is used when the source can't be read
+        def fail(url, metadata):
+            raise IOError('No network')
+        self.assertEqual(len(ad._get_index(ad._STATUS, url, fail)), 1)
+        ad._remove_df(ad._STATUS)
+        self.assertRaises(IOError, ad._get_index, ad._STATUS, url, fail)
+
+        text = u'\ufeffWMO,NAME\n1900650,\xe9t\xe9\n'.encode('utf-16-le')
+        df = self.ad._decode_csv([text[i:i + 5] for i in range(0, len(text), 5)],
+                                 'utf-16')
+        self.assertEqual(df.columns.tolist(), ['WMO', 'NAME'])
+        self.assertEqual(df['NAME'][0], u'\xe9t\xe9')
+
+    def test_profile_work_list(self):
+        files = ['aoml/1900650/profiles/BR1900650_002.nc',
+                 'aoml/1900650/profiles/BD1900650_001.nc',
+                 'aoml/1900650/profiles/MR1900650_003.nc',
+                 'aoml/1900651/profiles/BR1900651_001.nc',
+                 'aoml/1900652/profiles/BD1900652_001.nc']
+        index_df = pd.DataFrame({'file': files,
+                    'date': pd.to_datetime(['2015-01-11', '2015-01-01', '2015-01-21',
+                                            '2015-01-01', '2016-01-01']),
+                    'latitude': [36.5, 36.5, 36.6, -10, 36.5],
+                    'longitude': [-122.5, -122.5, -122.6, 40, -122.5],
+                    'parameters': ['PRES DOXY', 'PRES DOXY', 'PRES DOXY CHLA',
+                                   'PRES DOXY', 'PRES NITRATE'],
+                    'date_update': pd.to_datetime(['2016-01-01'] * 5)})
+        self.ad._indexes[self.ad._MERGE_PROFILE_INDEX] = (index_df,
+                dict(url=self.ad._merge_index_url, checked=datetime.utcnow()))
+
+        df = self.ad.get_profile_work_list(['1900650', '1900651'])
+        self.assertEqual(df['wmo'].tolist(), ['1900650'] * 3 + ['1900651'])
+        url_keys = zip(df['url'], df['key'], df['code'])
+        self.assertEqual(url_keys[:3], self.ad._sort_url_keys(url_keys[:3]))
+        self.assertEqual(df['key'].tolist()[:3], ['/WMO_1900650/P001',
+                         '/WMO_1900650/P003', '/WMO_1900650/P002'])
+        self.assertTrue(df['url'][0].endswith('dodsC/CORIOLIS-ARGO-GDAC-OBS/'
+                                              + files[1]))
+
+        df = self.ad.get_profile_work_list(time=('2015-01-05', '2015-12-31'),
+                            region=(-123, 30, -120, 40), parameters=['DOXY'])
+        self.assertEqual(df['key'].tolist(), ['/WMO_1900650/P003', '/WMO_1900650/P002'])
+        df = self.ad.get_profile_work_list(parameters=['DOXY', 'CHLA'])
+        self.assertEqual(df['code'].tolist(), ['MR'])
+
+        self.ad.discovery = 'index'
+        self.assertEqual([(w, len(uk)) for w, uk in self.ad._float_url_keys(['1900652'])],
+                         [('1900652', 1)])
+        self.assertRaises(ValueError, ArgoData, cache_file=self.cache_file,
+                          discovery='crawl')
+
+    def test_index_discovery(self):
+        from biofloat.exceptions import RequiredVariableNotPresent
+        files = ['aoml/1900650/profiles/MR1900650_001.nc',
+                 'aoml/1900650/profiles/MD1900650_002.nc']
+        index_df = pd.DataFrame({'file': files,
+                    'date': pd.to_datetime(['2015-01-11', '2015-01-21']),
+                    'latitude': [36.5, 36.5], 'longitude': [-122.5, -122.5],
+                    'parameters': ['PRES TEMP PSAL DOXY'] * 2,
+                    'date_update': pd.to_datetime(['2016-01-01'] * 2)})
+        ad = ArgoData(cache_file=self.cache_file, discovery='index',
+                      index_ttl_days=None)
+        ad._indexes[ad._MERGE_PROFILE_INDEX] = (index_df, 
+                                                dict(url=ad._merge_index_url))
+
+        def profile_to_dataframe(wmo, url, key, max_pressure):
+            # Only the merged files have the core variables
+            if not os.path.basename(url).startswith('M'):
+                raise RequiredVariableNotPresent('TEMP_ADJUSTED not in ' + url)
+            return self._profile_df(wmo, int(key[-3:]))
+        ad._profile_to_dataframe = profile_to_dataframe
+
+        # A tombstone left by loading the bio file is retried for the merged one
+        ad._init_profile_tables()
+        url = ad.get_profile_work_list()['url'][0]
+        ad._put_tombstone('/WMO_1900650/P001', url.replace('/MR', '/BR'),
+                          ad._MISSING_VARIABLE)
+        df = ad._get_data_from_argo(['1900650'])
+        self.assertEqual(len(df), 2 * 5)
+        self.assertEqual(sorted(ad.get_profile_metadata()['name']),
+                         ['/WMO_1900650/P001', '/WMO_1900650/P002'])
+        self.assertTrue(ad.get_tombstones().empty)
+        self.assertEqual(len(ad.read(['1900650'])), 2 * 5)
+
+    def test_profile_collection(self):
+        from biofloat import ProfileCollection
+        self._load_profiles(self.ad, '1900650', num_profiles=2)
+        self._load_profiles(self.ad, '1900651', num_profiles=1)
+        df = self.ad.get_float_dataframe(['1900650', '1900651'], update_cache=False)
+        pc = self.ad.get_float_dataframe(['1900650', '1900651'], update_cache=False,
+                                         as_collection=True)
+        self.assertEqual((len(pc), pc.nsamples), (3, 15))
+        self.assertEqual(pc.wmo.tolist(), ['1900650', '1900650', '1900651'])
+        pd.util.testing.assert_frame_equal(pc.to_dataframe(), df, check_index_type=False)
+        pd.util.testing.assert_frame_equal(
+                ProfileCollection.from_dataframe(df).to_dataframe(), df)
+
+        # Profile views share memory with the sample arrays
+        view = pc.view(1)
+        view['TEMP_ADJUSTED'][0] = -1
+        self.assertEqual(pc.data['TEMP_ADJUSTED'][5], -1)
+        np.testing.assert_allclose(pc.reduce('TEMP_ADJUSTED', 'max'), [15, 13.75, 15])
+        np.testing.assert_allclose(pc.reduce('DOXY_ADJUSTED', 'mean', max_pressure=1),
+                                   [243.75] * 3)
+        self.assertEqual(pc.reduce('PSAL_ADJUSTED', 'count').tolist(), [5, 5, 5])
+
+        # Empty profiles get NaN
+        sub = pc.take([2, 0])
+        sub = ProfileCollection.concat([sub, ProfileCollection.empty(['CHLA'])])
+        sub.data['PSAL_ADJUSTED'][:5] = np.nan
+        self.assertEqual(sub.profile.tolist(), [1, 2])
+        self.assertTrue(np.isnan(sub.reduce('PSAL_ADJUSTED', 'min')[0]))
+        self.assertTrue(np.isnan(sub.data['CHLA']).all())
+        for indices in ([], np.zeros(len(pc), dtype=bool)):
+            sub = pc.take(indices)
+            self.assertEqual((len(sub), len(sub.pressure)), (0, 0))
+            self.assertEqual(sub.variables, pc.variables)
+
+        pc = self.ad.read(['1900650'], pressure=(1, 2), variables=['DOXY_ADJUSTED'],
+                          as_collection=True)
+        self.assertEqual(pc.variables, ['DOXY_ADJUSTED'])
+        self.assertEqual(pc.row_size.tolist(), [2, 2])
+
+    def test_delta(self):
+        self._load_profiles(self.ad, '1900650', num_profiles=2)
+        self.ad._init_profile_tables()
+        consumer_file = os.path.join(self.tmp_dir, 'consumer.hdf')
+        delta_file = os.path.join(self.tmp_dir, 'delta.hdf')
+        self.assertEqual(self.ad.export_delta(delta_file), 0)
+        shutil.copy(self.cache_file, consumer_file)
+
+        self.ad._put_profile(self._profile_df('1900650', 3), '/WMO_1900650/P003',
+                             self._metadata('1900650', 3))
+        self.ad._put_profile(self._profile_df('1900650', 1, nlevels=2),
+                             '/WMO_1900650/P001', self._metadata('1900650', 1))
+        self.ad._remove_df('/WMO_1900650/P002')
+        self.ad._put_tombstone('/WMO_1900651/P001',
+                               self._metadata('1900651', 1)['url'], 'no_data')
+        self.assertEqual(self.ad.get_changelog()['action'].tolist(),
+                         ['added', 'replaced', 'removed'])
+        self.assertEqual(self.ad.export_delta(delta_file), 3)
+
+        consumer = ArgoData(cache_file=consumer_file)
+        self.assertEqual(consumer.apply_delta(delta_file), 3)
+        pd.util.testing.assert_frame_equal(
+                consumer.get_float_dataframe(['1900650'], update_cache=False),
+                self.ad.get_float_dataframe(['1900650'], update_cache=False))
+        self.assertEqual(consumer.get_tombstones()['key'].tolist(), ['/WMO_1900651/P001'])
+        self.assertEqual(sorted(consumer.get_profile_metadata()['name']),
+                         ['/WMO_1900650/P001', '/WMO_1900650/P003'])
+
+        # A delta that does not follow the consumer's state is refused
+        self.ad._remove_df('/WMO_1900650/P003')
+        self.ad.export_delta(delta_file)
+        self.ad.export_delta(delta_file)
+        self.assertRaises(ValueError, consumer.apply_delta, delta_file)
+
+        # Deltas are applied in order, stale ones only when forced
+        with pd.HDFStore(consumer_file, mode='r') as store:
+            until = consumer._delta_state(store)
+        first_file = os.path.join(self.tmp_dir, 'delta1.hdf')
+        second_file = os.path.join(self.tmp_dir, 'delta2.hdf')
+        self.assertEqual(self.ad.export_delta(first_file, since=until), 1)
+        self.ad._put_profile(self._profile_df('1900650', 4), '/WMO_1900650/P004',
+                             self._metadata('1900650', 4))
+        self.assertEqual(self.ad.export_delta(second_file), 1)
+        self.assertRaises(ValueError, consumer.apply_delta, second_file)
+        self.assertEqual(consumer.apply_delta(first_file), 1)
+        self.assertEqual(consumer.apply_delta(second_file), 1)
+        self.assertRaises(ValueError, consumer.apply_delta, first_file)
+        self.assertRaises(ValueError, consumer.apply_delta, second_file)
+        self.assertEqual(consumer.apply_delta(first_file, force=True), 1)
+        self.assertRaises(ValueError, consumer.apply_delta, second_file)
+        self.assertEqual(sorted(consumer.get_profile_metadata()['name']),
+                         ['/WMO_1900650/P001', '/WMO_1900650/P004'])
+
+    def test_generations(self):
+        from biofloat.Generations import Generations
+        self._load_profiles(self.ad, '1900650', num_profiles=2)
+        gen_dir = os.path.join(self.tmp_dir, 'generations')
+        generations = Generations(gen_dir, 'age365')
+        self.assertIsNone(generations.current())
+        staging = generations.stage(seed=self.cache_file)
+        first = generations.publish(staging)
+        self.assertEqual(os.path.basename(first), 'age365_gen000001.hdf')
+        self.assertEqual(generations.current(), first)
+
+        # Readers see the current generation while the next one is loaded
+        reader = ArgoData(cache_file=gen_dir)
+        self.assertEqual(reader.cache_file, first)
+        staging = generations.stage()
+        self._load_profiles(ArgoData(cache_file=staging), '1900651', num_profiles=1)
+        self.assertEqual(reader.get_cache_file_all_wmo_list(), ['1900650'])
+        second = generations.publish(staging)
+        self.assertEqual(sorted(ArgoData(cache_file=gen_dir).get_cache_file_all_wmo_list()),
+                         ['1900650', '1900651'])
+
+        # Old generations are removed once no reader holds them
+        self.assertEqual(generations.gc(keep=1), [])
+        self.assertEqual(len(reader.read(['1900650'])), 10)
+        reader.release_snapshot()
+        self.assertEqual(generations.gc(keep=1), [first])
+        with generations.acquire() as lease:
+            self.assertEqual(lease.path, second)
+
+    def test_generations_read_only(self):
+        from biofloat.Generations import Generations
+        for profile in (1, 2):
+            self.ad._put_profile(self._profile_df('1900650', profile),
+                                 '/WMO_1900650/P{:03d}'.format(profile),
+                                 self._metadata('1900650', profile))
+        index_df = pd.DataFrame({'file': ['aoml/1900650/profiles/MR1900650_001.nc'],
+                                 'date': pd.to_datetime(['2015-01-11'])})
+        self.ad._put_df(index_df, self.ad._MERGE_PROFILE_INDEX, 
+                        dict(url=self.ad._merge_index_url, checked=datetime(2000, 1, 1)))
+        generations = Generations(os.path.join(self.tmp_dir, 'generations'))
+        generation = generations.publish(generations.stage(seed=self.cache_file))
+
+        reader = ArgoData(cache_file=generations.directory)
+        mtime = os.path.getmtime(generation)
+        self.assertIsNone(reader.index_ttl_days)
+        self.assertEqual(len(reader.get_merge_profile_index()), 1)
+        self.assertEqual(len(reader.get_surface_mean()), 2)
+        self.assertEqual(len(reader.get_monthly_mean(max_pressure=2)), 1)
+        self.assertEqual(len(reader.get_profile_metadata(flush=True)), 2)
+        self.assertEqual(len(reader.read(['1900650'])), 10)
+        self.assertRaises(IOError, reader.update_aggregates)
+        self.assertRaises(IOError, reader._put_profile, self._profile_df('1900650', 3),
+                          '/WMO_1900650/P003', self._metadata('1900650', 3))
+        self.assertRaises(IOError, reader.repack)
+        self.assertEqual(os.path.getmtime(generation), mtime)
+        reader.release_snapshot()
+
+    def test_memory_limit(self):
+        from biofloat.calibrate import surface_mean, surface_mean_chunked, mean_chunked
+        for wmo in ('1900650', '1900651', '1900652'):
+            self._load_profiles(self.ad, wmo, num_profiles=2)
+        wmo_list = ['1900650', '1900651', '1900652']
+        df = self.ad.get_float_dataframe(wmo_list, update_cache=False)
+        pd.util.testing.assert_frame_equal(self.ad.get_float_dataframe(wmo_list,
+                        update_cache=False, memory_limit=10 ** 9), df)
+
+        # Larger results are spilled and read back in chunks of whole floats
+        spilled = self.ad.get_float_dataframe(wmo_list, update_cache=False,
+                                              memory_limit=1000)
+        self.assertEqual(len(spilled), len(df))
+        chunks = list(spilled.iter_chunks())
+        self.assertTrue(len(chunks) > 1)
+        for chunk in chunks:
+            self.assertEqual(len(chunk) % 10, 0)
+        pd.util.testing.assert_frame_equal(spilled.to_frame(), df, check_index_type=False)
+        pd.util.testing.assert_frame_equal(surface_mean_chunked(spilled),
+                                           surface_mean(df), check_index_type=False)
+        pd.util.testing.assert_frame_equal(mean_chunked(spilled, ['profile']),
+                                           df.groupby(level='profile').mean())
+        path = spilled.path
+        spilled.close()
+        self.assertFalse(os.path.exists(path))
+
+        # Columns first found in later floats are kept
+        df = self._profile_df('1900653', 1)
+        df['CHLA'] = 0.5
+        self.ad._put_df(df, '/WMO_1900653/P001', self._metadata('1900653', 1))
+        self.ad.get_profile_metadata(flush=True)
+        spilled = self.ad.read(wmo_list + ['1900653'], memory_limit=1000)
+        self.assertEqual(spilled.to_frame()['CHLA'].count(), 5)
+        self.assertRaises(ValueError, SpilledFrame(1000, columns=['TEMP_ADJUSTED']).append, df)
+
+    def test_ragged_export(self):
+        self._load_profiles(self.ad, '1900650', num_profiles=3)
+        self._load_profiles(self.ad, '1900651', num_profiles=2)
+        wmo_list = ['1900650', '1900651']
+        floats = list(self.ad.iter_floats(wmo_list, as_collection=True))
+        self.assertEqual([len(pc) for pc in floats], [3, 2])
+
+        # Floats are buffered into collections of at least chunk_samples
+        pcs = list(converters._iter_collections(iter(floats), chunk_samples=10))
+        self.assertEqual([pc.nsamples for pc in pcs], [15, 10])
+        pcs = list(converters._iter_collections(self.ad.read(wmo_list), 
+                                                   chunk_samples=100))
+        self.assertEqual([len(pc) for pc in pcs], [5])
+
+        arrays = converters._ragged_arrays(pcs[0])
+        self.assertEqual(arrays['row_size'][1].tolist(), [5] * 5)
+        self.assertEqual(arrays['wmo'][1][0], b'1900650')
+        self.assertEqual(arrays['time'][1].min(), 
+                         (pd.Timestamp('2015-01-11') - pd.Timestamp('1950-01-01')).days)
+        self.assertEqual(arrays['DOXY_ADJUSTED'][0], 'obs')
+
+        try:
+            import netCDF4
+        except ImportError:
+            self.skipTest('netCDF4 is not installed')
+        nc_file = os.path.join(self.tmp_dir, 'export.nc')
+        self.assertEqual(converters.to_netcdf(iter(floats), nc_file, chunk_samples=10), 5)
+        with netCDF4.Dataset(nc_file) as nc:
+            self.assertEqual(nc.featureType, 'profile')
+            self.assertEqual(nc.variables['row_size'][:].tolist(), [5] * 5)
+            profiles = zip(netCDF4.chartostring(nc.variables['wmo'][:]).tolist(),
+                           nc.variables['cycle_number'][:].tolist())
+            self.assertEqual(sorted(profiles), [('1900650', 1), ('1900650', 2),
+                             ('1900650', 3), ('1900651', 1), ('1900651', 2)])
+            self.assertEqual(nc.variables['cycle_number'].dimensions, ('profile',))
+            self.assertEqual(nc.variables['pressure'].chunking(), [10])
+            np.testing.assert_allclose(nc.variables['DOXY_ADJUSTED'][:],
+                                       self.ad.read(wmo_list)['DOXY_ADJUSTED'].values)
+
+    def _ragged_frame(self, group):
+        '''Return DataFrame of the samples of ragged array group indexed by
+        wmo, profile and pressure.
+        '''
+        row_size = group['row_size'][:]
+        df = pd.DataFrame(dict((v, group[v][:]) for v in ('pressure', 'DOXY_ADJUSTED')))
+        df['wmo'] = np.repeat(group['wmo'][:].astype(str), row_size)
+        df['profile'] = np.repeat(group['cycle_number'][:].astype(np.int64), row_size)
+
+        return df.set_index(['wmo', 'profile', 'pressure']).sort_index()
+
+    def test_zarr_export(self):
+        try:
+            import zarr
+        except ImportError:
+            self.skipTest('zarr is not installed')
+        from multiprocessing import Pool
+        self._load_profiles(self.ad, '1900650', num_profiles=3)
+        self._load_profiles(self.ad, '1900651', num_profiles=2)
+        df = self.ad.read().reset_index(['time', 'lon', 'lat'])[['DOXY_ADJUSTED']]
+        df = df.sort_index()
+
+        store = os.path.join(self.tmp_dir, 'export.zarr')
+        self.assertEqual(converters.to_zarr(self.ad.iter_floats(as_collection=True),
+                                            store, chunk_samples=10), 5)
+        group = zarr.open_group(store, mode='r')
+        self.assertEqual(group.attrs['featureType'], 'profile')
+        self.assertEqual(group['cycle_number'].attrs['_ARRAY_DIMENSIONS'], ['profile'])
+        self.assertEqual(sorted(group['wmo'][:].tolist()), 
+                         [b'1900650'] * 3 + [b'1900651'] * 2)
+        pd.util.testing.assert_frame_equal(self._ragged_frame(group), df,
+                                           check_names=False)
+
+        # Two workers append their floats to one store
+        store = os.path.join(self.tmp_dir, 'workers.zarr')
+        pool = Pool(2)
+        try:
+            counts = pool.map(export_zarr, [(self.cache_file, ['1900650'], store),
+                                            (self.cache_file, ['1900651'], store)])
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(counts, [3, 2])
+        group = zarr.open_group(store, mode='r')
+        self.assertEqual(group['row_size'][:].sum(), 25)
+        pd.util.testing.assert_frame_equal(self._ragged_frame(group), df,
+                                           check_names=False)
+
+    def test_drift(self):
+        dates = pd.date_range('2015-01-01', periods=49, freq='MS')
+        t = np.asarray((dates - dates[0]).days) / 365.25
+        gdfs = [pd.DataFrame(dict(wmo='1900650', date=dates, gain=1.0 + 0.02 * t)),
+                pd.DataFrame(dict(wmo='1900651', date=dates, 
+                                  gain=1.1 - 0.01 * t + 0.04 * np.maximum(0, t - 2))),
+                pd.DataFrame(dict(wmo='1900652', date=dates[:2], gain=[1.2, 1.3]))]
+        gdf = pd.concat(gdfs[::-1], ignore_index=True)
+        gdf.loc[0, 'gain'] = np.inf
+
+        ddf = drift.fit_drift(gdf)
+        self.assertEqual(ddf.index.tolist(), ['1900650', '1900651', '1900652'])
+        self.assertEqual(ddf['n'].tolist(), [49, 49, 1])
+        np.testing.assert_allclose(ddf.loc['1900650', ['intercept', 'slope']].values
+                                   .astype(float), [1.0, 0.02], atol=1e-10)
+        self.assertTrue(np.isnan(ddf.loc['1900652', 'slope']))
+
+        # The piecewise fit finds the change of slope at the middle knot
+        ddf = drift.fit_drift(gdf, knots=1)
+        np.testing.assert_allclose(ddf.loc['1900651', ['intercept', 'slope', 'knot_1', 
+                                   'dslope_1']].values.astype(float),
+                                   [1.1, -0.01, 2, 0.04], atol=1e-10)
+        self.assertTrue(ddf.loc['1900651', 'rmse'] < 1e-10)
+        self.assertTrue(ddf.loc['1900650', 'rmse'] < 1e-10)
+        gain = drift.drift_gain(ddf, ['1900651', '1900651', '1900652', '1900653'],
+                                pd.to_datetime(['2014-01-01', '2019-01-01', 
+                                                '2016-01-01', '2016-01-01']))
+        np.testing.assert_allclose(gain[:3], [1.1, 1.1 - 0.04 + 0.04 * 2, 1.3],
+                                   atol=1e-10)
+        self.assertTrue(np.isnan(gain[3]))
+
+        # The gains are applied to the cached data a float at a time
+        self._load_profiles(self.ad, '1900650', num_profiles=2)
+        df = self.ad.read(['1900650'])
+        cdfs = list(drift.calibrate_cache(self.ad, ddf, column='DOXY_CALIBRATED'))
+        self.assertEqual(len(cdfs), 1)
+        times = df.index.get_level_values('time')
+        expected = df['DOXY_ADJUSTED'].values * (1.0 + 0.02 * np.asarray(
+                                                 (times - dates[0]).days) / 365.25)
+        np.testing.assert_allclose(cdfs[0]['DOXY_CALIBRATED'].values, expected)
+        pc, = drift.calibrate_cache(self.ad, ddf, as_collection=True)
+        np.testing.assert_allclose(np.sort(pc.data['DOXY_ADJUSTED']), np.sort(expected))
+
+    def test_standard_levels(self):
+        self._load_profiles(self.ad, '1900650', num_profiles=2)
+        ad = ArgoData(cache_file=self.cache_file, standard_levels=[0.5, 2, 10])
+        ad._init_profile_tables()
+        df = ad.get_standard_levels('TEMP_ADJUSTED')
+        self.assertEqual(df.columns.tolist(), [0.5, 2, 10])
+        self.assertEqual(df.index.get_level_values('profile').tolist(), [1, 2])
+        np.testing.assert_allclose(df.values, [[14.375, 12.5, np.nan]] * 2)
+
+        # Profiles written, replaced and removed update the levels
+        ad._put_profile(self._profile_df('1900650', 3), '/WMO_1900650/P003',
+                        self._metadata('1900650', 3))
+        ad._put_profile(self._profile_df('1900650', 1, nlevels=2), '/WMO_1900650/P001',
+                        self._metadata('1900650', 1))
+        ad._remove_df('/WMO_1900650/P002')
+        df = ad.get_standard_levels('DOXY_ADJUSTED', ['1900650'])
+        self.assertEqual(df.index.get_level_values('profile').tolist(), [1, 3])
+        np.testing.assert_allclose(df.values, [[225, np.nan, np.nan], 
+                                               [243.75, 225, np.nan]])
+
+    def test_aggregates(self):
+        from biofloat.calibrate import surface_mean, add_columns_for_groupby, monthly_mean
+        self._load_profiles(self.ad, '1900650', num_profiles=4)
+        self._load_profiles(self.ad, '1900651', num_profiles=2)
+        self.assertEqual(self.ad.update_aggregates(), ['1900650', '1900651'])
+        self.assertEqual(self.ad.update_aggregates(), [])
+
+        df = self.ad.get_float_dataframe(['1900650'], update_cache=False)
+        sdf = surface_mean(df)
+        mdf = monthly_mean(add_columns_for_groupby(sdf.copy()))
+        pd.util.testing.assert_frame_equal(self.ad.get_monthly_mean(['1900650']), 
+                                           mdf, check_like=True)
+        cached_sdf = self.ad.get_surface_mean(['1900650'])
+        self.assertEqual(len(cached_sdf), 4)
+        np.testing.assert_allclose(cached_sdf['TEMP_ADJUSTED'], sdf['TEMP_ADJUSTED'])
+        self.assertTrue((cached_sdf['o2sat'] > 0).all())
+
+        # Long wmo lists are selected in chunks
+        many = [str(w) for w in range(1900700, 1900740)]
+        self.assertEqual(len(self.ad.get_surface_mean(many + ['1900651'])), 2)
+
+        # Only floats with changed profiles are recomputed
+        self.ad._init_profile_tables()
+        self.ad._remove_df('/WMO_1900651/P001')
+        self.assertEqual(self.ad.update_aggregates(), ['1900651'])
+        self.assertEqual(len(self.ad.get_surface_mean()), 5)
+
+    def test_aggregates_after_repack(self):
+        self._load_profiles(self.ad, '1900650', num_profiles=3)
+        for _ in range(2):
+            self._load_profiles(self.ad, '1900650', num_profiles=1)
+        self.assertEqual(self.ad.update_aggregates(), ['1900650'])
+        self.ad.repack()
+        self.assertEqual(self.ad.update_aggregates(), [])
+        self.assertEqual(len(self.ad.get_surface_mean()), 3)
+        for profile in (4, 5):
+            self.ad._put_profile(self._profile_df('1900650', profile),
+                                 '/WMO_1900650/P{:03d}'.format(profile),
+                                 self._metadata('1900650', profile))
+
+        # Reading computes the changed float without writing the cache file
+        self.assertEqual(len(self.ad.get_surface_mean()), 5)
+        self.assertEqual(self.ad.update_aggregates(), ['1900650'])
+        self.assertEqual(len(self.ad.get_surface_mean()), 5)
+
+        # Aggregates for each max_pressure are kept apart
+        self.assertEqual(self.ad.update_aggregates(max_pressure=2), ['1900650'])
+        self.assertEqual(self.ad.update_aggregates(), [])
+        self.assertEqual(self.ad.update_aggregates(max_pressure=2), [])
+        np.testing.assert_allclose(
+                self.ad.get_surface_mean(max_pressure=2)['TEMP_ADJUSTED'], 14.375)
+        np.testing.assert_allclose(
+                self.ad.get_surface_mean()['TEMP_ADJUSTED'], 12.5)
+
+    def test_aggregates_read_only(self):
+        self._load_profiles(self.ad, '1900650', num_profiles=2)
+        self.assertEqual(len(self.ad.get_monthly_mean()), 1)
+        with pd.HDFStore(self.cache_file, mode='r') as store:
+            self.assertNotIn('/' + self.ad._AGGREGATE_STATE, store)
+            self.assertNotIn('/' + self.ad._MONTHLY_MEAN, store)
+
+    def test_grid_aggregate(self):
+        from benchmarks import write_synthetic_cache
+        np.random.seed(1)
+        wmo_list = write_synthetic_cache(self.ad, 3, 20, 50)
+        time_bins = pd.date_range('2015-01-01', '2016-01-01', freq='QS')
+        ds = aggregate.grid_aggregate(self.ad, ['DOXY_ADJUSTED', 'TEMP_ADJUSTED'],
+                    lon_bins=[-150, -149.9, -149.5], lat_bins=[20, 20.5],
+                    time_bins=time_bins, pressure_bins=[0, 100, 500, 2000])
+        self.assertEqual(ds['DOXY_ADJUSTED_mean'].dims, ('time', 'pressure', 'lat', 'lon'))
+        self.assertEqual(ds['DOXY_ADJUSTED_mean'].shape, (4, 3, 1, 2))
+        self.assertEqual(self.ad.frame_cache_info()['entries'], 0)
+
+        df = self.ad.get_float_dataframe(wmo_list, update_cache=False).reset_index()
+        df = df[(df['time'] < time_bins[-1]) & (df['pressure'] < 2000)]
+        df['time'] = time_bins[np.searchsorted(time_bins.values, df['time'].values,
+                                               side='right') - 1]
+        df['pressure'] = pd.cut(df['pressure'], [0, 100, 500, 2000], right=False)
+        df['lon'] = np.where(df['lon'] < -149.9, -149.95, -149.7)
+        grouped = df.groupby(['time', 'pressure', 'lon'])['DOXY_ADJUSTED']
+        expected = grouped.agg(['count', 'mean', 'var']).values
+        result = ds.to_dataframe().reset_index().sort_values(['time', 'pressure', 'lon'])
+        result = result[result['DOXY_ADJUSTED_count'] > 0]
+        self.assertEqual(result['DOXY_ADJUSTED_count'].sum(), len(df))
+        np.testing.assert_allclose(result[['DOXY_ADJUSTED_count', 'DOXY_ADJUSTED_mean', 
+                                           'DOXY_ADJUSTED_var']].values, expected)
+
+    def test_repack(self):
+        ad = ArgoData(cache_file=self.cache_file, standard_levels=[1, 2])
+        ad._init_profile_tables()
+        for profile in range(1, 4):
+            ad._put_profile(self._profile_df('1900650', profile, nlevels=200),
+                            '/WMO_1900650/P{:03d}'.format(profile),
+                            self._metadata('1900650', profile))
+        ad._remove_df('/WMO_1900650/P001')
+        ad._put_profile(self._profile_df('1900650', 2, nlevels=100), '/WMO_1900650/P002',
+                        self._metadata('1900650', 2))
+        df = ad.read()
+
+        out_file = os.path.join(self.tmp_dir, 'repacked.hdf')
+        ad._min_compress_bytes = 1024
+        ad.repack(out_file, complib='blosc:lz4', complevel=5, chunk_rows=64)
+        self.assertLess(os.path.getsize(out_file), os.path.getsize(self.cache_file))
+        rad = ArgoData(cache_file=out_file, standard_levels=[1, 2])
+        pd.util.testing.assert_frame_equal(rad.read(), df)
+        pd.util.testing.assert_frame_equal(rad.get_profile_metadata(), 
+                                           ad.get_profile_metadata())
+        pd.util.testing.assert_frame_equal(rad.get_standard_levels('TEMP_ADJUSTED'),
+                                           ad.get_standard_levels('TEMP_ADJUSTED'))
+        with pd.HDFStore(out_file, mode='r') as store:
+            self.assertEqual(store.get_storer('manifest').nrows, 2)
+        self.assertTrue(rad.verify_cache_file_count_df().empty)
+
+        self.assertRaises(ValueError, ad.repack, out_file, complib='nocodec')
+        ad.repack()
+        pd.util.testing.assert_frame_equal(ad.read(), df)
+
+    def test_tombstones(self):
+        self.ad._init_profile_tables()
+        self.ad._put_profile(self._profile_df('1900650', 1), '/WMO_1900650/P001',
+                             self._metadata('1900650', 1))
+        self.ad._put_tombstone('/WMO_1900650/P002', self._metadata('1900650', 2)['url'],
+                               self.ad._NO_DATA)
+        df = self.ad.get_tombstones()
+        self.assertEqual(df['key'].tolist(), ['/WMO_1900650/P002'])
+        self.assertEqual(df['reason'].tolist(), ['no_data'])
+        self.assertEqual(self.ad.get_profile_metadata()['name'].tolist(), 
+                         ['/WMO_1900650/P001'])
+        with pd.HDFStore(self.cache_file, mode='r') as store:
+            self.assertFalse('/WMO_1900650/P002' in store)
+
+        # Retry according to the policy for the reason
+        tombstone = df.set_index('key').loc['/WMO_1900650/P002']
+        url = self._metadata('1900650', 2)['url']
+        self.assertFalse(self.ad._retry_tombstone(tombstone, url, 'D'))
+        ad = ArgoData(cache_file=self.cache_file, retry_days=dict(no_data=0))
+        self.assertTrue(ad._retry_tombstone(tombstone, url, 'D'))
+
+        # Saving the profile clears its tombstone
+        self.ad._put_profile(self._profile_df('1900650', 2), '/WMO_1900650/P002',
+                             self._metadata('1900650', 2))
+        self.assertTrue(self.ad.get_tombstones().empty)
+
+        # Blank nodes from older versions are converted to tombstones
+        self.ad._put_df(self.ad._blank_df, '/WMO_1900651/P001', 
+                        self._metadata('1900651', 1))
+        self.ad.get_profile_metadata(flush=True)
+        self.assertEqual(self.ad.convert_blank_profiles(), 1)
+        self.assertEqual(self.ad.get_tombstones()['key'].tolist(), ['/WMO_1900651/P001'])
+        self.assertEqual(len(self.ad.get_profile_metadata()), 2)
+
+    def _nprof_dataset(self):
+        '''Return dict standing in for the xray Dataset of a profile with
+        high resolution T/S in N_PROF [0] and oxygen only in [1].
+        '''
+        nan = np.nan
+        return {'PRES_ADJUSTED': pd.DataFrame([[0, 5, 10, 15, 20, 2000],
+                                               [1, 11, 19, nan, nan, nan]]),
+                'TEMP_ADJUSTED': pd.DataFrame([[15, 14, 13, 12, 11, 2],
+                                               [nan] * 6]),
+                'PSAL_ADJUSTED': pd.DataFrame([[33, 33.1, 33.2, 33.3, 33.4, 34.6],
+                                               [nan] * 6]),
+                'DOXY_ADJUSTED': pd.DataFrame([[nan] * 6,
+                                               [250, 240, 230, nan, nan, nan]]),
+                'JULD': pd.Series(pd.to_datetime(['2015-01-01', '2015-01-01'])),
+                'LONGITUDE': pd.Series([-122.5, -122.5]),
+                'LATITUDE': pd.Series([36.5, 36.5])}
+
+    def test_merge_nprof(self):
+        ad = ArgoData(pressure_tolerance=2)
+        ds = self._nprof_dataset()
+        df = ad._merge_profile_dataframe('1900650', 'url', ds, 1000, 1)
+        self.assertEqual(df.index.names, ad._index_names)
+        self.assertEqual(df.index.get_level_values('pressure').tolist(), 
+                         [0, 5, 10, 15, 20])
+        self.assertEqual(df['TEMP_ADJUSTED'].tolist(), [15, 14, 13, 12, 11])
+        np.testing.assert_array_equal(df['DOXY_ADJUSTED'].values, 
+                                      [250, np.nan, 240, np.nan, 230])
+
+        # Agrees with default extraction where the pressures are the same
+        default_df = ad._build_profile_dataframe('1900650', 'url', ds, 1000, 1, 
+                                                 nprof=0)
+        pd.util.testing.assert_frame_equal(df.drop('DOXY_ADJUSTED', axis=1),
+                default_df.drop('DOXY_ADJUSTED', axis=1), check_like=True)
+
+        # Core levels without a matched oxygen value are saved too
+        ad = ArgoData(cache_file=self.cache_file, pressure_tolerance=1)
+        ad._profile_to_dataframe = lambda wmo, url, key, max_pressure: (
+                ad._merge_profile_dataframe(wmo, url, ds, max_pressure, 1))
+        url = self._metadata('1900650', 1)['url']
+        key, code = ad._float_profile_key(url)
+        ad._save_profile(url, 0, [url], '1900650', key, code, 1000, 'WMO_1900650', 
+                         ad._MAX_VALUE)
+        df = ad.read(['1900650'])
+        self.assertEqual(df.index.get_level_values('pressure').tolist(), 
+                         [0, 5, 10, 15, 20])
+        np.testing.assert_array_equal(df['DOXY_ADJUSTED'].values, 
+                                      [250, np.nan, 240, np.nan, 230])
+
+    def test_qc(self):
+        ds = self._nprof_dataset()
+        ds['TEMP_ADJUSTED_QC'] = pd.DataFrame([list('112341'), list('      ')])
+        ds['DOXY_ADJUSTED_QC'] = pd.DataFrame([list('      '), list('134   ')])
+        ad = ArgoData(cache_file=os.path.join(self.tmp_dir, 'qc.hdf'),
+                      qc_accept={'TEMP_ADJUSTED': [1, 2], 'DOXY_ADJUSTED': [1, 3]})
+        df = ad._build_profile_dataframe('1900650', 'url', ds, 1000, 1, nprof=0)
+        self.assertEqual(df['TEMP_ADJUSTED_QC'].dtype, np.int8)
+        self.assertEqual(df['TEMP_ADJUSTED_QC'].tolist(), [1, 1, 2, 3, 4])
+        np.testing.assert_array_equal(df['TEMP_ADJUSTED'].values, 
+                                      [15, 14, 13, np.nan, np.nan])
+        # PSAL_ADJUSTED_QC is missing, its flags are all _QC_MISSING
+        self.assertEqual(df['PSAL_ADJUSTED_QC'].tolist(), [9] * 5)
+        self.assertEqual(df['PSAL_ADJUSTED'].tolist(), [33, 33.1, 33.2, 33.3, 33.4])
+
+        ad.pressure_tolerance = 2
+        df = ad._merge_profile_dataframe('1900650', 'url', ds, 1000, 1)
+        self.assertEqual(df['DOXY_ADJUSTED_QC'].tolist(), [1, 9, 3, 9, 4])
+        np.testing.assert_array_equal(df['DOXY_ADJUSTED'].values, 
+                                      [250, np.nan, 240, np.nan, np.nan])
+
+        # Flags are kept as int8 columns, also in compact storage, and reads
+        # can select on them
+        for compact in (False, True):
+            ad.compact = compact
+            for profile in (1, 2):
+                df = self._profile_df('1900650', profile)
+                df['DOXY_ADJUSTED_QC'] = np.array([1, 2, 1, 3, 1], dtype=np.int8)
+                ad._put_profile(df, '/WMO_1900650/P{:03d}'.format(profile),
+                                self._metadata('1900650', profile))
+            ad.clear_frame_cache()
+            df = ad.read(['1900650'])
+            self.assertEqual(df['DOXY_ADJUSTED_QC'].dtype, np.int8)
+            self.assertEqual(len(df), 10)
+            df = ad.read(['1900650'], qc={'DOXY_ADJUSTED': [1]}, 
+                         variables=['DOXY_ADJUSTED'])
+            self.assertEqual(df.columns.tolist(), ['DOXY_ADJUSTED'])
+            self.assertEqual(sorted(set(df.index.get_level_values('pressure'))), 
+                             [0, 2, 4])
+            self.assertEqual(len(df), 6)
+            pc = ad.read(['1900650'], qc={'DOXY_ADJUSTED': [2, 3]}, as_collection=True)
+            self.assertEqual(pc.data['DOXY_ADJUSTED_QC'].tolist(), [2, 3, 2, 3])
+
+        # The flags are not averaged
+        from biofloat.calibrate import mean_chunked
+        self.assertEqual(ad.update_aggregates(), ['1900650'])
+        for df in (ad.get_surface_mean(), ad.get_monthly_mean(), 
+                   mean_chunked(ad.read(['1900650']), ['profile'])):
+            self.assertNotIn('DOXY_ADJUSTED_QC', df.columns)
+            self.assertIn('DOXY_ADJUSTED', df.columns)
+
+        # Profiles saved without flags match only _QC_MISSING
+        self._load_profiles(self.ad, '1900651', num_profiles=1)
+        self.assertTrue(self.ad.read(['1900651'], qc={'TEMP_ADJUSTED': [1]}).empty)
+        self.assertEqual(len(self.ad.read(['1900651'], qc={'TEMP_ADJUSTED': [9]})), 5)
+
+    def test_util_chunked(self):
+        np.random.seed(1)
+        n = 1001
+        s = np.random.uniform(30, 37, n)
+        t = np.random.uniform(-1, 30, n)
+        p = np.random.uniform(0, 2000, n)
+        o2 = np.random.uniform(0, 350, n)
+        np.testing.assert_allclose(utils.o2sat_chunked(s, t, chunksize=100),
+                                   utils.o2sat(s, t), rtol=1e-12)
+        np.testing.assert_allclose(utils.percent_saturation(o2, s, t, chunksize=100),
+                                   100 * o2 / utils.o2sat(s, t), rtol=1e-12)
+        np.testing.assert_allclose(utils.convert_to_mll_chunked(o2, s, t, p, 
+                                   chunksize=100), utils.convert_to_mll(o2, s, t, p),
+                                   rtol=1e-12)
+
+        # float32 columns, as compact caches return, are cast a chunk at a time
+        s32, t32, o232 = [pd.Series(a.astype(np.float32), index=a.argsort())
+                          for a in (s, t, o2)]
+        s64, t64, o264 = [a.values.astype(np.float64) for a in (s32, t32, o232)]
+        np.testing.assert_allclose(utils.percent_saturation(o232, s32, t32, chunksize=100),
+                                   100 * o264 / utils.o2sat(s64, t64), rtol=1e-12)
+
+        self._load_profiles(self.ad, '1900650', num_profiles=2)
+        for df in utils.add_oxygen_columns(self.ad.iter_read()):
+            np.testing.assert_allclose(df['o2sat'], 100 * df['DOXY_ADJUSTED'] /
+                    utils.o2sat(df['PSAL_ADJUSTED'], df['TEMP_ADJUSTED']))
+
+    def test_parse_catalog(self):
+        from io import BytesIO
+        from benchmarks import synthetic_catalog
+        xml = synthetic_catalog('1900650', 2, codes=('R', 'D', 'MR', 'BD'))
+        base_url = 'http://tds0.ifremer.fr/thredds/dodsC/'
+        url_keys = self.ad._parse_catalog(BytesIO(xml.encode('utf-8')), base_url)
+        self.assertEqual([code for _, _, code in url_keys], 
+                         ['D', 'D', 'BD', 'BD', 'MR', 'MR', 'R', 'R'])
+        self.assertEqual([key for _, key, _ in url_keys][:2],
+                         ['/WMO_1900650/P002', '/WMO_1900650/P001'])
+        urls = [url for url, _, _ in url_keys]
+        self.assertTrue(urls[0].startswith(base_url + 'CORIOLIS-ARGO-GDAC-OBS/'))
+        self.assertEqual(self.ad._sort_opendap_urls(urls[::-1]), urls)
+
+    def test_lazy_imports(self):
+        from benchmarks import import_time, IMPORT_TIME_BUDGET, IMPORT_TIME_MARGIN
+        self._load_profiles(self.ad, '1900650', num_profiles=1)
+        secs, imported = import_time(('import biofloat; biofloat.ArgoData(cache_file={!r})'
+                                      '.get_float_dataframe(["1900650"], update_cache=False)'
+                                     ).format(self.cache_file), repeat=3)
+        self.assertEqual(imported, [])
+        self.assertLessEqual(secs, IMPORT_TIME_BUDGET * IMPORT_TIME_MARGIN)
+
+        # The scripts' --help must not pay for the network modules either
+        for script in ('load_biofloat_cache', 'woa_calibration'):
+            _, imported = import_time('sys.path.insert(0, "scripts"); import {}'
+                                      .format(script), repeat=1)
+            self.assertEqual(imported, [], script)
+
+
 if __name__ == '__main__':
     unittest.main()